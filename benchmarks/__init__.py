@@ -0,0 +1,9 @@
+'''
+    Benchmarks of the plugin on synthetic populations of groups and users, run from the root of the repository:
+
+        python -m benchmarks.bench --preset small --backend json --output small.json
+        python -m benchmarks.compare old.json new.json
+        python -m benchmarks.loadtest --groups 200 --users 50 --rate 500 --member-latency 50
+        python -m benchmarks.simulate --groups 100 --users 100 --weeks 8
+        python -m benchmarks.replay path/to/morning/trace --output replay.json
+'''
@@ -0,0 +1,207 @@
+'''
+    Time the commands of the plugin on a synthetic population, report latency percentiles, bytes written per event,
+    load time and peak RSS as JSON, to be diffed between releases with benchmarks.compare.
+'''
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from time import perf_counter, perf_counter_ns
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import json
+import platform
+import random
+import shutil
+import sys
+import tempfile
+try:
+    import resource
+except ModuleNotFoundError:
+    resource = None
+from .plugin import load_plugin
+
+# Number of groups and range of users per group
+PRESETS: Dict[str, Tuple[int, Tuple[int, int]]] = {
+    "small": (100, (50, 200)),
+    "medium": (1000, (50, 500)),
+    "large": (10000, (50, 2000))
+}
+
+
+def bytes_written() -> Optional[int]:
+    '''
+        Bytes written by this process so far, None if the platform doesn't tell.
+    '''
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("wchar:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+
+    return None
+
+
+def peak_rss() -> Optional[int]:
+    '''
+        Peak resident set size of this process in bytes, None if the platform doesn't tell.
+    '''
+    if resource is None:
+        return None
+
+    # Kilobytes on Linux, bytes on macOS
+    maxrss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def summarize(samples: List[int]) -> Dict[str, float]:
+    '''
+        Latency percentiles in microseconds of samples in nanoseconds.
+    '''
+    samples = sorted(samples)
+
+    def at(q: float) -> float:
+        return samples[min(len(samples) - 1, int(q * len(samples)))] / 1000
+
+    return {
+        "n": len(samples),
+        "mean_us": sum(samples) / len(samples) / 1000,
+        "p50_us": at(0.5),
+        "p90_us": at(0.9),
+        "p99_us": at(0.99),
+        "max_us": samples[-1] / 1000
+    }
+
+
+async def timed(calls: List[Tuple[Any, ...]], func: Callable[..., Awaitable[Any]]) -> Dict[str, float]:
+    samples: List[int] = []
+    for args in calls:
+        start: int = perf_counter_ns()
+        await func(*args)
+        samples.append(perf_counter_ns() - start)
+
+    return summarize(samples)
+
+
+async def run(args: Namespace, morning_path: Path) -> Dict[str, Any]:
+    # Modules of the plugin are importable only once it's loaded
+    from nonebot_plugin_morning.data_source import MorningManager
+    from nonebot_plugin_morning.history import np
+    from .datagen import USER_BASE, write_dataset
+
+    groups, users = PRESETS[args.preset] if args.preset else (args.groups, tuple(args.users))
+    rng = random.Random(args.seed)
+    result: Dict[str, Any] = dict()
+
+    start: float = perf_counter()
+    sizes: Dict[str, int] = write_dataset(morning_path, groups, users, args.nights, args.seed)
+    generate_s: float = perf_counter() - start
+    result["meta"] = {
+        "preset": args.preset,
+        "backend": args.backend,
+        "groups": groups,
+        "users": list(users),
+        "total_users": sum(sizes.values()),
+        "nights": args.nights,
+        "ops": args.ops,
+        "seed": args.seed,
+        "dataset_bytes": (morning_path / "morning.json").stat().st_size,
+        "python": platform.python_version(),
+        "numpy": np is not None
+    }
+
+    # The first load imports morning.json into the other backends
+    manager = MorningManager()
+    start = perf_counter()
+    await manager.load_data()
+    import_s: float = perf_counter() - start
+    await manager.close()
+
+    manager = MorningManager()
+    start = perf_counter()
+    await manager.load_data()
+    result["load"] = {"generate_s": generate_s, "import_s": import_s, "load_s": perf_counter() - start}
+
+    gids: List[str] = list(sizes)
+    picks: List[Tuple[str, str]] = []
+    for _ in range(args.ops):
+        gid: str = rng.choice(gids)
+        picks.append((gid, str(USER_BASE + rng.randrange(sizes[gid]))))
+
+    ops: Dict[str, Dict[str, float]] = dict()
+    await manager.flush()
+    written: Optional[int] = bytes_written()
+
+    ops["get_night_msg"] = await timed([(gid, uid, "人") for gid, uid in picks], manager.get_night_msg)
+    ops["get_morning_msg"] = await timed([(gid, uid, "人") for gid, uid in picks], manager.get_morning_msg)
+
+    start = perf_counter()
+    await manager.flush()
+    flush_s: float = perf_counter() - start
+    if written is not None:
+        written = bytes_written() - written
+
+    result["writes"] = {
+        "events": 2 * len(picks),
+        "flush_s": flush_s,
+        "bytes_written": written,
+        "bytes_per_event": written / (2 * len(picks)) if written is not None else None
+    }
+
+    ops["get_my_routine"] = await timed(picks, manager.get_my_routine)
+    ops["get_group_routine"] = await timed([(gid,) for gid, _ in picks], manager.get_group_routine)
+
+    # Rollovers run lazily on the first access after a boundary, stamp the data back to the last day or week to time them
+    # Groups may be loaded on demand, only the ones picked above are surely in memory
+    rolled: List[Tuple[str, ...]] = [(gid,) for gid in sorted(set(gid for gid, _ in picks))]
+    for gid, in rolled:
+        manager._morning[gid].counters.day -= 1
+    ops["day_rollover"] = await timed(rolled, manager.get_group_routine)
+
+    for gid, in rolled:
+        manager._morning[gid].counters.week -= 1
+    ops["week_rollover_group"] = await timed(rolled, manager.get_group_routine)
+
+    for gid, uid in picks:
+        manager._morning[gid].users[uid].week -= 1
+    ops["week_rollover_user"] = await timed(picks, manager.get_my_routine)
+
+    result["ops"] = ops
+    await manager.close()
+    result["peak_rss_bytes"] = peak_rss()
+
+    return result
+
+
+def main() -> None:
+    parser = ArgumentParser(prog="python -m benchmarks.bench", description=__doc__)
+    parser.add_argument("--preset", choices=list(PRESETS), help="size of the population, overrides --groups and --users")
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--users", type=int, nargs=2, default=[50, 200], metavar=("MIN", "MAX"), help="users per group")
+    parser.add_argument("--nights", type=int, default=30, help="nights of sleep history per user")
+    parser.add_argument("--backend", choices=["json", "sqlite", "eventlog", "sharded"], default="json")
+    parser.add_argument("--ops", type=int, default=1000, help="calls timed per command")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--path", type=Path, help="directory of the data, a temporary one if absent")
+    parser.add_argument("--output", type=Path, help="JSON file of the results, stdout if absent")
+    args: Namespace = parser.parse_args()
+
+    morning_path: Path = args.path if args.path else Path(tempfile.mkdtemp(prefix="morning_bench_"))
+    load_plugin(morning_path, args.backend)
+
+    try:
+        result: Dict[str, Any] = asyncio.run(run(args, morning_path))
+    finally:
+        if not args.path:
+            shutil.rmtree(morning_path, ignore_errors=True)
+
+    output: str = json.dumps(result, indent=4)
+    if args.output:
+        args.output.write_text(output, encoding="utf-8")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
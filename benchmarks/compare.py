@@ -0,0 +1,48 @@
+'''
+    Compare two results of benchmarks.bench, e.g. of the last release and of the working tree.
+'''
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from typing import Any, Dict, Iterator, Tuple
+import json
+
+
+def flatten(result: Dict[str, Any], prefix: str = "") -> Iterator[Tuple[str, float]]:
+    '''
+        Numeric metrics of a result as dotted keys, metadata excluded.
+    '''
+    for key, value in result.items():
+        if prefix == "" and key == "meta":
+            continue
+
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+def main() -> None:
+    parser = ArgumentParser(prog="python -m benchmarks.compare", description=__doc__)
+    parser.add_argument("old", type=Path)
+    parser.add_argument("new", type=Path)
+    args: Namespace = parser.parse_args()
+
+    old: Dict[str, Any] = json.loads(args.old.read_text(encoding="utf-8"))
+    new: Dict[str, Any] = json.loads(args.new.read_text(encoding="utf-8"))
+    if old["meta"] != new["meta"]:
+        changed = [key for key in new["meta"] if old["meta"].get(key) != new["meta"][key]]
+        print(f"Warning: meta differs in {', '.join(changed)}\n")
+
+    old_metrics: Dict[str, float] = dict(flatten(old))
+    print(f"{'metric':<36}{'old':>14}{'new':>14}{'change':>10}")
+    for key, value in flatten(new):
+        before = old_metrics.get(key)
+        if before is None:
+            print(f"{key:<36}{'-':>14}{value:>14.2f}{'':>10}")
+        else:
+            change: str = f"{(value - before) / before * 100:+.1f}%" if before else ""
+            print(f"{key:<36}{before:>14.2f}{value:>14.2f}{change:>10}")
+
+
+if __name__ == "__main__":
+    main()
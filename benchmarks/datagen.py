@@ -0,0 +1,103 @@
+'''
+    Synthetic morning.json in the current data format. Import after benchmarks.plugin.load_plugin().
+'''
+import random
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Tuple
+try:
+    import ujson as json
+except ModuleNotFoundError:
+    import json
+from nonebot_plugin_morning.config import default_config, MorningConfig
+from nonebot_plugin_morning.history import DAY
+from nonebot_plugin_morning.model import DATA_VERSION, GroupRecord, UserRecord
+from nonebot_plugin_morning.utils import day_index, week_index
+
+# Ids of the synthetic groups and users, the j-th user of a group is USER_BASE + j
+GROUP_BASE: int = 100000
+USER_BASE: int = 10000000
+
+
+def permissive_config() -> Dict[str, Any]:
+    '''
+        config.json accepting every good-morning/night at any time, so that each call goes through the whole update.
+        Time windows are disabled, thus days and weeks start at 0 A.M.
+    '''
+    config: MorningConfig = default_config.copy(deep=True)
+    config.morning.morning_intime.enable = False
+    config.morning.multi_get_up.enable = True
+    config.morning.super_get_up.enable = True
+    config.night.night_intime.enable = False
+    config.night.good_sleep.enable = False
+    config.night.deep_sleep.enable = True
+
+    return config.dict()
+
+
+def _user(rng: random.Random, now_ts: int, nights: int, week: int) -> UserRecord:
+    user = UserRecord()
+    for k in range(nights, 0, -1):
+        # Some nights are missed
+        if rng.random() < 0.2:
+            continue
+
+        start: int = now_ts - k * DAY + rng.randint(-2 * 3600, 2 * 3600)
+        user.history.append(start, rng.randint(5 * 3600, 9 * 3600), (nights + 1) * DAY)
+
+    if len(user.history):
+        user.night_time = user.history.start[-1]
+        user.morning_time = user.night_time + user.history.duration[-1]
+    else:
+        user.night_time = now_ts - DAY
+
+    user.week = week
+    user.weekly_morning_count = user.weekly_night_count = rng.randint(0, 7)
+    user.weekly_sleep = user.weekly_morning_count * rng.randint(5 * 3600, 9 * 3600)
+    user.lastweek_morning_count = user.lastweek_night_count = rng.randint(0, 7)
+    user.lastweek_sleep = user.lastweek_morning_count * rng.randint(5 * 3600, 9 * 3600)
+    user.lastweek_earliest_morning_time = user.morning_time
+    user.lastweek_latest_night_time = user.night_time
+    user.morning_count = user.night_count = len(user.history) + rng.randint(0, 300)
+    user.total_sleep = sum(user.history.duration) + user.morning_count * 7 * 3600
+
+    return user
+
+
+def write_dataset(morning_path: Path, groups: int, users: Tuple[int, int], nights: int, seed: int) -> Dict[str, int]:
+    '''
+        Write morning.json of groups with a random number of users in the range, each with the history of some nights,
+        and the permissive config.json. Groups are streamed into the file one by one, so any size fits in memory.
+        Return the number of users of each group.
+    '''
+    rng = random.Random(seed)
+    now_time: datetime = datetime.now().astimezone()
+    now_ts: int = int(now_time.timestamp())
+    day: int = day_index(now_time, 0)
+    week: int = week_index(now_time, 0)
+    sizes: Dict[str, int] = dict()
+
+    morning_path.mkdir(parents=True, exist_ok=True)
+    with open(morning_path / "config.json", "w", encoding="utf-8") as f:
+        json.dump(permissive_config(), f, ensure_ascii=False, indent=4)
+
+    with open(morning_path / "morning.json", "w", encoding="utf-8") as f:
+        f.write(f'{{"version": {DATA_VERSION}')
+        for i in range(groups):
+            gid: str = str(GROUP_BASE + i)
+            group = GroupRecord()
+            group.counters.day = day
+            group.counters.week = week
+
+            sizes[gid] = rng.randint(*users)
+            for j in range(sizes[gid]):
+                group.users[str(USER_BASE + j)] = _user(rng, now_ts, nights, week)
+
+            group.counters.good_morning = rng.randint(0, sizes[gid])
+            group.counters.good_night = rng.randint(0, sizes[gid])
+            f.write(f', "{gid}": ')
+            f.write(json.dumps(group.to_dict(), ensure_ascii=False))
+
+        f.write("}")
+
+    return sizes
@@ -0,0 +1,211 @@
+'''
+    Burst load test: fire good-night and then good-morning events of every user across many groups at a fixed rate
+    through the real matchers, with a fake OneBot bot whose get_group_member_info takes a configurable latency.
+    Report throughput, handler latency, event loop stalls and whether any daily count increment was lost.
+'''
+from argparse import ArgumentParser, Namespace
+from collections import Counter
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+import asyncio
+import json
+import random
+import re
+import shutil
+import tempfile
+import time
+from .bench import peak_rss, summarize
+from .plugin import load_plugin
+
+# Order of the good-morning/night in the replies
+ORDER_PATTERN = re.compile(r"你是今[早晚]第(\d+)个")
+
+
+class LoadStats:
+    '''
+        Latencies of commands, orders in the replies of each group and lateness of the event loop.
+    '''
+
+    def __init__(self):
+        self.latencies: Dict[str, List[int]] = dict()
+        # (command, gid) -> orders replied
+        self.orders: Dict[Tuple[str, int], List[int]] = dict()
+        self.stalls: List[float] = []
+
+
+async def watch_loop(stats: LoadStats, interval: float) -> None:
+    '''
+        Measure how late the event loop wakes up a task sleeping for the interval.
+    '''
+    loop = asyncio.get_running_loop()
+    while True:
+        start: float = loop.time()
+        await asyncio.sleep(interval)
+        stats.stalls.append(loop.time() - start - interval)
+
+
+async def save_periodically(interval: float) -> None:
+    '''
+        Stand-in of the save scheduler, which is not started here.
+    '''
+    from nonebot_plugin_morning.data_source import morning_manager
+
+    while True:
+        await asyncio.sleep(interval)
+        await morning_manager.flush()
+
+
+async def run(args: Namespace, morning_path: Path) -> Dict[str, Any]:
+    # Modules of NoneBot adapters and the plugin are importable only once NoneBot is initialized
+    import nonebot
+    from nonebot.adapters.onebot.v11 import Adapter, Bot
+    from nonebot_plugin_morning.data_source import morning_manager
+    from nonebot_plugin_morning.member_cache import member_cache
+    from nonebot_plugin_morning.model import DATA_VERSION
+    from .datagen import GROUP_BASE, USER_BASE, permissive_config
+
+    class FakeBot(Bot):
+        '''
+            OneBot bot answering the APIs locally, get_group_member_info takes the given latency.
+        '''
+
+        async def call_api(self, api: str, **data: Any) -> Any:
+            if api == "get_group_member_info":
+                await asyncio.sleep(args.member_latency / 1000)
+                return {"user_id": data["user_id"], "nickname": str(data["user_id"]), "card": "",
+                        "sex": random.choice(["male", "female", "unknown"])}
+
+            if api == "send_msg":
+                match = ORDER_PATTERN.search(str(data["message"]))
+                if match is not None:
+                    stats.orders.setdefault((command.get(), data["group_id"]), []).append(int(match.group(1)))
+
+            return {"message_id": 0}
+
+    morning_path.mkdir(parents=True, exist_ok=True)
+    (morning_path / "config.json").write_text(json.dumps(permissive_config()), encoding="utf-8")
+    (morning_path / "morning.json").write_text(json.dumps({"version": DATA_VERSION}), encoding="utf-8")
+    await morning_manager.load_data()
+
+    bot = FakeBot(Adapter(nonebot.get_driver()), str(args.self_id))
+    stats = LoadStats()
+    # Command of the event being handled by the current task
+    command: "ContextVar[str]" = ContextVar("command")
+    message_id: int = 0
+
+    async def dispatch(text: str, gid: int, uid: int) -> None:
+        nonlocal message_id
+        message_id += 1
+        command.set(text)
+
+        event = Adapter.json_to_event({
+            "time": int(time.time()), "self_id": args.self_id, "post_type": "message", "message_type": "group",
+            "sub_type": "normal", "message_id": message_id, "group_id": gid, "user_id": uid,
+            "message": text, "raw_message": text, "font": 0,
+            "sender": {"user_id": uid, "nickname": str(uid), "role": "member"}
+        })
+
+        start: int = time.perf_counter_ns()
+        await bot.handle_event(event)
+        stats.latencies.setdefault(text, []).append(time.perf_counter_ns() - start)
+
+    async def burst(kind: str) -> Dict[str, Any]:
+        '''
+            Every user says the command once in a random order at the rate, with queries of routines mixed in.
+        '''
+        rng = random.Random(f"{args.seed}{kind}")
+        events: List[Tuple[str, int, int]] = [
+            (kind, GROUP_BASE + i, USER_BASE + j) for i in range(args.groups) for j in range(args.users)]
+        rng.shuffle(events)
+        for _ in range(int(len(events) * args.query_ratio)):
+            gid, uid = events[rng.randrange(len(events))][1:]
+            events.append((rng.choice(["我的作息", "群友作息"]), gid, uid))
+        rng.shuffle(events)
+
+        loop = asyncio.get_running_loop()
+        tasks: List["asyncio.Task[None]"] = []
+        start: float = loop.time()
+        for n, (text, gid, uid) in enumerate(events):
+            delay: float = start + n / args.rate - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(dispatch(text, gid, uid)))
+
+        await asyncio.gather(*tasks)
+        elapsed: float = loop.time() - start
+
+        # Every good-morning/night is accepted under the permissive config, so the daily count of a group
+        # must equal the number of them and the orders replied must be 1..N without duplicates
+        key: str = "good_morning" if kind == "早安" else "good_night"
+        accepted: int = 0
+        lost: int = 0
+        duplicated: int = 0
+        for i in range(args.groups):
+            gid = GROUP_BASE + i
+            orders: List[int] = stats.orders.get((kind, gid), [])
+            accepted += len(orders)
+            lost += len(orders) - getattr(morning_manager._morning[str(gid)].counters, key)
+            duplicated += sum(count - 1 for count in Counter(orders).values() if count > 1)
+
+        return {"events": len(events), "elapsed_s": elapsed, "throughput_per_s": len(events) / elapsed,
+                "accepted": accepted, "lost_increments": lost, "duplicated_orders": duplicated}
+
+    watcher = asyncio.create_task(watch_loop(stats, args.watch_interval / 1000))
+    saver = asyncio.create_task(save_periodically(args.save_interval))
+    try:
+        phases: Dict[str, Any] = {"night": await burst("晚安"), "morning": await burst("早安")}
+    finally:
+        watcher.cancel()
+        saver.cancel()
+        await morning_manager.close()
+
+    stalls: List[int] = [int(stall * 1e9) for stall in stats.stalls]
+
+    return {
+        "meta": {
+            "backend": args.backend, "groups": args.groups, "users": args.users, "rate": args.rate,
+            "query_ratio": args.query_ratio, "member_latency_ms": args.member_latency, "seed": args.seed
+        },
+        "phases": phases,
+        "latency": {text: summarize(samples) for text, samples in stats.latencies.items()},
+        "loop_stall": {**summarize(stalls), "total_ms": sum(stalls) / 1e6} if stalls else None,
+        "member_cache": {"hits": member_cache.hits, "misses": member_cache.misses},
+        "peak_rss_bytes": peak_rss()
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser(prog="python -m benchmarks.loadtest", description=__doc__)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--users", type=int, default=50, help="users per group")
+    parser.add_argument("--rate", type=float, default=500, help="events fired per second")
+    parser.add_argument("--query-ratio", type=float, default=0.1, help="queries of routines per good-morning/night")
+    parser.add_argument("--member-latency", type=float, default=50, help="latency of get_group_member_info in ms")
+    parser.add_argument("--save-interval", type=float, default=1, help="seconds between write-backs")
+    parser.add_argument("--watch-interval", type=float, default=10, help="ms between checks of event loop stalls")
+    parser.add_argument("--backend", choices=["json", "sqlite", "eventlog", "sharded"], default="json")
+    parser.add_argument("--self-id", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--path", type=Path, help="directory of the data, a temporary one if absent")
+    parser.add_argument("--output", type=Path, help="JSON file of the results, stdout if absent")
+    args: Namespace = parser.parse_args()
+
+    morning_path: Path = args.path if args.path else Path(tempfile.mkdtemp(prefix="morning_load_"))
+    load_plugin(morning_path, args.backend, command_start={""})
+
+    try:
+        result: Dict[str, Any] = asyncio.run(run(args, morning_path))
+    finally:
+        if not args.path:
+            shutil.rmtree(morning_path, ignore_errors=True)
+
+    output: str = json.dumps(result, indent=4, ensure_ascii=False)
+    if args.output:
+        args.output.write_text(output, encoding="utf-8")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+from pathlib import Path
+from typing import Any
+import nonebot
+from nonebot.log import logger
+
+
+def load_plugin(morning_path: Path, backend: str, **config: Any) -> None:
+    '''
+        Initialize NoneBot without a driver nor a bot, and load the plugin storing its data under morning_path.
+        Other configs of NoneBot may be given, e.g. command_start.
+        Startup hooks are never run, so neither the scheduler nor the periodic write-back is started.
+        Modules of the plugin can only be imported after this.
+    '''
+    # Logs are neither part of the measured time nor of the measured writes
+    logger.remove()
+    nonebot.init(driver="~none", morning_path=str(morning_path), morning_storage=backend, **config)
+    nonebot.load_plugin("nonebot_plugin_morning")
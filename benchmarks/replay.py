@@ -0,0 +1,195 @@
+'''
+    Replay a trace session recorded with MORNING_TRACE against this version of the plugin under a virtual clock,
+    as fast as possible. Report throughput and latency, the commands whose outcome differs from the recorded one,
+    and the groups whose final state differs from the snapshot recorded at the end of the session.
+'''
+from argparse import ArgumentParser, Namespace
+from pathlib import Path
+from time import perf_counter, perf_counter_ns
+from typing import Any, Dict, List, Optional, Tuple
+import asyncio
+import json
+import shutil
+import tempfile
+from .bench import peak_rss, summarize
+from .plugin import load_plugin
+
+# Time in milliseconds, command, group, user, outcome and arguments
+TraceLine = Tuple[int, str, str, str, str, str]
+
+
+def read_trace(path: Path) -> List[TraceLine]:
+    lines: List[TraceLine] = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            fields: List[str] = line.rstrip("\n").split("\t")
+            # A line cut by a crash is ignored
+            if len(fields) == 6 and line.endswith("\n"):
+                lines.append((int(fields[0]), fields[1], fields[2], fields[3], fields[4], fields[5]))
+
+    return lines
+
+
+def find_session(trace_dir: Path, session: Optional[str]) -> Tuple[str, Optional[str]]:
+    '''
+        The session to replay, the latest complete one if not given, and the session whose snapshot ends it.
+    '''
+    logs: List[int] = sorted(int(p.stem) for p in trace_dir.glob("*.log"))
+    snapshots: List[int] = sorted(int(p.stem) for p in trace_dir.glob("*.json"))
+
+    def end_of(begin: int) -> Optional[str]:
+        later: List[int] = [stem for stem in snapshots if stem > begin]
+        return str(later[0]) if later else None
+
+    if session is not None:
+        return session, end_of(int(session))
+
+    complete: List[int] = [stem for stem in logs if stem in snapshots and end_of(stem) is not None]
+    if not complete:
+        raise SystemExit(f"No complete session in {trace_dir}")
+
+    return str(complete[-1]), end_of(complete[-1])
+
+
+async def handle(manager: Any, command: str, gid: str, uid: str, args: str) -> None:
+    '''
+        Handle a recorded command again, with the recorded arguments joined by "#".
+    '''
+    params: List[str] = args.split("#")
+    if command == "morning":
+        await manager.get_morning_msg(gid, uid, "群友")
+    elif command == "night":
+        await manager.get_night_msg(gid, uid, "群友")
+    elif command == "my_routine":
+        await manager.get_my_routine(gid, uid)
+    elif command == "group_routine":
+        await manager.get_group_routine(gid)
+    elif command == "daily_boards":
+        await manager.get_daily_boards(gid)
+    elif command == "sleep_ranking":
+        await manager.get_sleep_ranking(gid, int(args))
+    elif command == "my_rank":
+        await manager.get_my_rank(gid, uid)
+    elif command == "my_chart":
+        await manager.get_my_chart(gid, uid)
+    elif command == "group_chart":
+        await manager.get_group_chart(gid)
+    elif command == "group_config":
+        manager.get_group_config(gid)
+    elif command == "morning_config":
+        manager.morning_config(gid, params[0], int(params[1]), int(params[2]))
+    elif command == "morning_switch":
+        manager.morning_switch(gid, params[0], params[1] == "True")
+    elif command == "night_config":
+        manager.night_config(gid, params[0], int(params[1]), int(params[2]))
+    elif command == "night_switch":
+        manager.night_switch(gid, params[0], params[1] == "True")
+    elif command == "set_timezone":
+        manager.set_timezone(gid, args)
+
+
+async def run(args: Namespace, morning_path: Path, session: str, end: Optional[str]) -> Dict[str, Any]:
+    # Modules of the plugin are importable only once it's loaded
+    from nonebot_plugin_morning.clock import VirtualClock
+    from nonebot_plugin_morning.data_source import MorningManager
+    from nonebot_plugin_morning.model import GroupRecord
+    from nonebot_plugin_morning.trace import TraceRecorder
+
+    class Collector(TraceRecorder):
+        '''
+            Keep the outcomes in memory as they are, ids of the snapshot and the trace are anonymized already.
+        '''
+
+        def __init__(self):
+            self.lines: List[TraceLine] = []
+
+        def record(self, command: str, gid: str, uid: str, now_ms: int, outcome: str, args: str = "") -> None:
+            self.lines.append((now_ms, command, gid, uid, outcome, args))
+
+    trace: List[TraceLine] = read_trace(args.trace_dir / f"{session}.log")
+    # Moved to each recorded command before it's handled
+    clock = VirtualClock(int(session) / 1000)
+
+    manager = MorningManager()
+    manager.set_clock(clock)
+    collector = Collector()
+    start: float = perf_counter()
+    await manager.load_data()
+    load_s: float = perf_counter() - start
+    manager.set_trace(collector)
+
+    latencies: Dict[str, List[int]] = dict()
+    start = perf_counter()
+    for now_ms, command, gid, uid, _, command_args in trace:
+        clock.set(now_ms / 1000)
+        begin: int = perf_counter_ns()
+        await handle(manager, command, gid, uid, command_args)
+        latencies.setdefault(command, []).append(perf_counter_ns() - begin)
+    elapsed: float = perf_counter() - start
+    manager.set_trace(None)
+
+    outcomes: List[Dict[str, Any]] = [
+        {"line": n + 1, "command": recorded[1], "gid": recorded[2], "uid": recorded[3],
+         "recorded": recorded[4], "replayed": replayed[4]}
+        for n, (recorded, replayed) in enumerate(zip(trace, collector.lines)) if recorded[4] != replayed[4]
+    ]
+
+    state: Optional[Dict[str, Any]] = None
+    if end is not None:
+        snapshot: Dict[str, Any] = json.loads((args.trace_dir / f"{end}.json").read_text(encoding="utf-8"))
+        replayed: Dict[str, Any] = await manager.snapshot()
+        # Decoded and encoded again, so that both are compared in the current format
+        expected: Dict[str, Any] = {gid: GroupRecord.from_dict(group).to_dict() for gid, group in snapshot["data"].items()}
+        actual: Dict[str, Any] = {gid: GroupRecord.from_dict(group).to_dict() for gid, group in replayed.items()}
+        differed: List[str] = sorted(gid for gid in expected.keys() | actual.keys() if expected.get(gid) != actual.get(gid))
+        state = {"end": end, "groups": len(expected), "differed": len(differed), "differed_groups": differed[:args.max_diffs]}
+
+    await manager.close()
+
+    return {
+        "meta": {"session": session, "backend": args.backend, "commands": len(trace),
+                 "span_s": (trace[-1][0] - trace[0][0]) / 1000 if trace else 0},
+        "load_s": load_s,
+        "replay": {"elapsed_s": elapsed, "throughput_per_s": len(trace) / elapsed if elapsed else None},
+        "latency": {command: summarize(samples) for command, samples in latencies.items()},
+        # Commands without an outcome replayed mean the handler stopped recording one
+        "outcomes": {"differed": len(outcomes), "missing": len(trace) - len(collector.lines),
+                     "diffs": outcomes[:args.max_diffs]},
+        "state": state,
+        "peak_rss_bytes": peak_rss()
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser(prog="python -m benchmarks.replay", description=__doc__)
+    parser.add_argument("trace_dir", type=Path, help="directory of the trace, morning_path/trace")
+    parser.add_argument("--session", help="session to replay, the latest complete one if absent")
+    parser.add_argument("--backend", choices=["json", "sqlite", "eventlog", "sharded"], default="json")
+    parser.add_argument("--max-diffs", type=int, default=20, help="differences listed at most")
+    parser.add_argument("--output", type=Path, help="JSON file of the results, stdout if absent")
+    args: Namespace = parser.parse_args()
+
+    session, end = find_session(args.trace_dir, args.session)
+    snapshot: Dict[str, Any] = json.loads((args.trace_dir / f"{session}.json").read_text(encoding="utf-8"))
+
+    # The snapshot becomes the data and the config of a plugin in a temporary directory
+    morning_path: Path = Path(tempfile.mkdtemp(prefix="morning_replay_"))
+    (morning_path / "config.json").write_text(json.dumps(snapshot["config"], ensure_ascii=False), encoding="utf-8")
+    (morning_path / "morning.json").write_text(
+        json.dumps({"version": snapshot["version"], **snapshot["data"]}, ensure_ascii=False), encoding="utf-8")
+    load_plugin(morning_path, args.backend)
+
+    try:
+        result: Dict[str, Any] = asyncio.run(run(args, morning_path, session, end))
+    finally:
+        shutil.rmtree(morning_path, ignore_errors=True)
+
+    output: str = json.dumps(result, indent=4, ensure_ascii=False)
+    if args.output:
+        args.output.write_text(output, encoding="utf-8")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+'''
+    Simulate weeks of activity of a synthetic population under a virtual clock: every user says good-night in the
+    evening and good-morning the next morning, with queries of routines mixed in, while a boundary dispatcher rolls
+    the groups over at the start of every counting day and week and writes the data back periodically.
+    Report the wall time, throughput, latency of commands and rollovers, and whether the rolled data is consistent.
+'''
+from argparse import ArgumentParser, Namespace
+from datetime import datetime, timedelta
+from pathlib import Path
+from time import perf_counter, perf_counter_ns
+from typing import Any, Dict, List, Tuple
+import asyncio
+import json
+import random
+import shutil
+import tempfile
+from .bench import peak_rss, summarize
+from .plugin import load_plugin
+
+
+async def run(args: Namespace, morning_path: Path) -> Dict[str, Any]:
+    # Modules of the plugin are importable only once it's loaded
+    from nonebot_plugin_morning.clock import BoundaryDispatcher, VirtualClock
+    from nonebot_plugin_morning.config import default_config
+    from nonebot_plugin_morning.data_source import MorningManager
+    from nonebot_plugin_morning.model import DATA_VERSION
+    from .datagen import GROUP_BASE, USER_BASE
+
+    rng = random.Random(args.seed)
+    # Noon of a Monday, in the middle of the default windows of good-morning and good-night
+    start: datetime = datetime(2026, 1, 5, 12).astimezone()
+    clock = VirtualClock(start.timestamp())
+
+    # An empty population under the default config
+    (morning_path / "config.json").write_text(json.dumps(default_config.dict()), encoding="utf-8")
+    (morning_path / "morning.json").write_text(json.dumps({"version": DATA_VERSION}), encoding="utf-8")
+
+    manager = MorningManager()
+    manager.set_clock(clock)
+    await manager.load_data()
+
+    dispatcher = BoundaryDispatcher(manager, clock)
+    if args.save_interval > 0:
+        dispatcher.every(args.save_interval, manager.flush)
+    gids: List[str] = [str(GROUP_BASE + i) for i in range(args.groups)]
+    for gid in gids:
+        dispatcher.watch(gid)
+
+    latencies: Dict[str, List[int]] = dict()
+    dispatch_ns: int = 0
+    sent: int = 0
+    wall: float = perf_counter()
+
+    for day in range(args.weeks * 7):
+        # From noon to noon: good-nights of the evening, then good-mornings of the next morning
+        noon: datetime = start + timedelta(days=day)
+        events: List[Tuple[float, str, str, str]] = []
+        for gid in gids:
+            for j in range(args.users):
+                if rng.random() >= args.activity:
+                    continue
+
+                uid: str = str(USER_BASE + j)
+                night: datetime = noon + timedelta(hours=10, seconds=rng.randrange(int(3.5 * 3600)))
+                events.append((night.timestamp(), "night", gid, uid))
+                events.append(((noon + timedelta(hours=18, minutes=30, seconds=rng.randrange(3 * 3600))).timestamp(),
+                               "morning", gid, uid))
+                if rng.random() < args.query_ratio:
+                    events.append((noon.timestamp() + rng.randrange(24 * 3600), rng.choice(["my_routine", "group_routine"]), gid, uid))
+        events.sort()
+
+        for now, command, gid, uid in events:
+            begin: int = perf_counter_ns()
+            await dispatcher.run_until(now)
+            dispatch_ns += perf_counter_ns() - begin
+
+            begin = perf_counter_ns()
+            if command == "night":
+                await manager.get_night_msg(gid, uid, "群友")
+            elif command == "morning":
+                await manager.get_morning_msg(gid, uid, "群友")
+            elif command == "my_routine":
+                await manager.get_my_routine(gid, uid)
+            else:
+                await manager.get_group_routine(gid)
+            latencies.setdefault(command, []).append(perf_counter_ns() - begin)
+        sent += len(events)
+
+    end: datetime = start + timedelta(weeks=args.weeks)
+    begin = perf_counter_ns()
+    await dispatcher.run_until(end.timestamp())
+    dispatch_ns += perf_counter_ns() - begin
+    wall = perf_counter() - wall
+
+    # Every group and user must have been rolled over to the last day and week by the dispatcher,
+    # and every good-morning/night has been accepted under the default config
+    day_now: int = manager._day(gids[0], manager._now(gids[0]))
+    week_now: int = manager._week(gids[0], manager._now(gids[0]))
+    stale_groups: int = 0
+    stale_users: int = 0
+    counted: Dict[str, int] = {"night": 0, "morning": 0}
+    for gid in gids:
+        group = manager._morning[gid]
+        stale_groups += group.counters.day != day_now or group.counters.week != week_now
+        for user in group.users.values():
+            stale_users += user.week != week_now
+            counted["night"] += user.night_count
+            counted["morning"] += user.morning_count
+
+    await manager.close()
+
+    return {
+        "meta": {"backend": args.backend, "groups": args.groups, "users": args.users, "weeks": args.weeks,
+                 "activity": args.activity, "query_ratio": args.query_ratio, "save_interval_s": args.save_interval,
+                 "seed": args.seed},
+        "wall_s": wall,
+        "commands": sent,
+        "throughput_per_s": sent / wall,
+        "simulated_days_per_s": args.weeks * 7 / wall,
+        "latency": {command: summarize(samples) for command, samples in latencies.items()},
+        "dispatch_s": dispatch_ns / 1e9,
+        "rollovers": {"day": dispatcher.day_rollovers, "week": dispatcher.week_rollovers},
+        "checks": {
+            "stale_groups": stale_groups,
+            "stale_users": stale_users,
+            "rejected_nights": len(latencies.get("night", [])) - counted["night"],
+            "rejected_mornings": len(latencies.get("morning", [])) - counted["morning"]
+        },
+        "peak_rss_bytes": peak_rss()
+    }
+
+
+def main() -> None:
+    parser = ArgumentParser(prog="python -m benchmarks.simulate", description=__doc__)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--users", type=int, default=100, help="users per group")
+    parser.add_argument("--weeks", type=int, default=8)
+    parser.add_argument("--activity", type=float, default=1.0, help="chance of a user to be active on a day")
+    parser.add_argument("--query-ratio", type=float, default=0.1, help="queries of routines per active user per day")
+    parser.add_argument("--save-interval", type=float, default=0, help="simulated seconds between write-backs, 0 to write back only at the end")
+    parser.add_argument("--backend", choices=["json", "sqlite", "eventlog", "sharded"], default="json")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--path", type=Path, help="directory of the data, a temporary one if absent")
+    parser.add_argument("--output", type=Path, help="JSON file of the results, stdout if absent")
+    args: Namespace = parser.parse_args()
+
+    morning_path: Path = args.path if args.path else Path(tempfile.mkdtemp(prefix="morning_sim_"))
+    load_plugin(morning_path, args.backend)
+
+    try:
+        result: Dict[str, Any] = asyncio.run(run(args, morning_path))
+    finally:
+        if not args.path:
+            shutil.rmtree(morning_path, ignore_errors=True)
+
+    output: str = json.dumps(result, indent=4)
+    if args.output:
+        args.output.write_text(output, encoding="utf-8")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,26 +1,48 @@
-from typing import List
+import asyncio
+from datetime import datetime
+from pathlib import Path
+from time import perf_counter
+from typing import Dict, List, Type
 from nonebot.log import logger
 from nonebot.plugin import PluginMetadata
-from nonebot import on_command, on_regex
+from nonebot import on_command, on_notice, on_regex
 from nonebot.matcher import Matcher
+from nonebot.message import run_postprocessor, run_preprocessor
 from nonebot.permission import SUPERUSER
-from nonebot.adapters.onebot.v11 import Bot, GROUP, GROUP_OWNER, GROUP_ADMIN, Message, MessageSegment, GroupMessageEvent
+from nonebot.adapters.onebot.v11 import Bot, GROUP, GROUP_OWNER, GROUP_ADMIN, Message, MessageSegment, GroupMessageEvent, \
+    NoticeEvent, GroupDecreaseNoticeEvent, ActionFailed
 from nonebot.params import Depends, CommandArg, RegexMatched, ArgStr
-from .config import driver
+try:
+    from nonebot.drivers import HTTPServerSetup, Request, Response, URL
+except ImportError:
+    HTTPServerSetup = None
+from .config import driver, morning_config
 from .data_source import morning_manager
+from .member_cache import member_cache
+from .metrics import command_duration, metrics
+from .profiler import profiler
+from .render import chart_available, render_cache
+from .utils import format_duration
 
 __morning_version__ = "v0.3.2"
-__morning_usages__ = f'''
+__morning_usages__ = '''
 [早安] 早安/哦哈哟/おはよう
 [晚安] 晚安/哦呀斯密/おやすみ
 [我的作息] 看看自己的作息
 [群友作息] 看看群友的作息
+[我的作息图/群友作息图] 作息的图片版本
+[本周睡觉大王] 看看本周目前谁睡得最久
+[睡眠排行 (N)] 本周睡眠时长前N名，默认前10名
+[我的排名] 看看自己本周的睡眠排名
+[今日早起榜] 今天最早早安的群友
+[今日晚睡榜] 今天最晚晚安的群友
 [早晚安设置] 查看当前配置
 ------- 设置 -------
 [早安开启/关闭 xx] 开启/关闭早安的某个配置
 [早安设置 xx x] 设置早安配置的数值
 [晚安开启/关闭 xx] 开启/关闭晚安的某个配置
-[晚安设置 xx x] 设置晚安配置的数值'''.strip()
+[晚安设置 xx x] 设置晚安配置的数值
+[早晚安时区 xx] 设置本群的时区，如Asia/Shanghai'''.strip()
 
 __plugin_meta__ = PluginMetadata(
     name="おはよう！",
@@ -39,11 +61,51 @@ night = on_command(cmd="晚安", aliases={"哦呀斯密", "おやすみ"}, permi
 # Routine
 my_routine = on_command(cmd="我的作息", permission=GROUP, priority=12)
 group_routine = on_command(cmd="群友作息", permission=GROUP, priority=12)
+my_chart = on_command(cmd="我的作息图", permission=GROUP, priority=12)
+group_chart = on_command(cmd="群友作息图", permission=GROUP, priority=12)
+
+# Ranking of sleeping time of this week
+sleeping_king = on_command(cmd="本周睡觉大王", permission=GROUP, priority=12)
+sleep_ranking = on_command(cmd="睡眠排行", aliases={"睡觉排行"}, permission=GROUP, priority=12)
+my_rank = on_command(cmd="我的排名", permission=GROUP, priority=12)
+
+# Daily boards
+early_board = on_command(cmd="今日早起榜", permission=GROUP, priority=12)
+late_board = on_command(cmd="今日晚睡榜", permission=GROUP, priority=12)
 
 # Settings
 configure = on_command(cmd="早安设置", aliases={"晚安设置", "早晚安设置"}, permission=GROUP, priority=11, block=True)
 morning_setting = on_regex(pattern=r"^早安(开启|关闭|设置)( (时限|多重起床|超级亢奋)(( \d{1,2}){1,2})?)?$", permission=SUPERUSER | GROUP_OWNER | GROUP_ADMIN, priority=10, block=True)
 night_setting = on_regex(pattern=r"^晚安(开启|关闭|设置)( (时限|优质睡眠|深度睡眠)(( \d{1,2}){1,2})?)?$", permission=SUPERUSER | GROUP_OWNER | GROUP_ADMIN, priority=10, block=True)
+timezone_setting = on_command(cmd="早晚安时区", permission=SUPERUSER | GROUP_OWNER | GROUP_ADMIN, priority=10, block=True)
+profile_command = on_command(cmd="早晚安性能分析", aliases={"早晚安 profile", "早晚安profile"}, permission=SUPERUSER, priority=10, block=True)
+
+# Label of each command in the metrics
+_command_labels: Dict[Type[Matcher], str] = {
+    morning: "morning", night: "night",
+    my_routine: "my_routine", group_routine: "group_routine", my_chart: "my_chart", group_chart: "group_chart",
+    sleeping_king: "sleeping_king", sleep_ranking: "sleep_ranking", my_rank: "my_rank",
+    early_board: "early_board", late_board: "late_board",
+    configure: "configure", morning_setting: "morning_setting", night_setting: "night_setting",
+    timezone_setting: "timezone_setting"
+}
+
+
+async def _get_nickname(bot: Bot, gid: int, uid: int) -> str:
+    try:
+        mem_info = await member_cache.get(bot, gid, uid)
+    except ActionFailed:
+        # The member may have left the group
+        return str(uid)
+
+    return mem_info["card"] if mem_info["card"] else mem_info["nickname"]
+
+
+async def _member_changed(event: NoticeEvent) -> bool:
+    return isinstance(event, GroupDecreaseNoticeEvent) or event.notice_type == "group_card"
+
+# Invalidate the cached member info
+member_notice = on_notice(rule=_member_changed, priority=12)
 
 
 @morning.handle()
@@ -54,7 +116,7 @@ async def good_morning(bot: Bot, matcher: Matcher, event: GroupMessageEvent, arg
 
     uid = event.user_id
     gid = event.group_id
-    mem_info = await bot.call_api("get_group_member_info", group_id=gid, user_id=uid)
+    mem_info = await member_cache.get(bot, gid, uid)
 
     sex = mem_info["sex"]
     if sex == "male":
@@ -64,7 +126,7 @@ async def good_morning(bot: Bot, matcher: Matcher, event: GroupMessageEvent, arg
     else:
         sex_str = "群友"
 
-    msg = morning_manager.get_morning_msg(str(gid), str(uid), sex_str)
+    msg = await morning_manager.get_morning_msg(str(gid), str(uid), sex_str)
     await matcher.finish(message=msg, at_sender=True)
 
 
@@ -76,7 +138,7 @@ async def good_night(bot: Bot, matcher: Matcher, event: GroupMessageEvent, args:
 
     uid: int = event.user_id
     gid: int = event.group_id
-    mem_info = await bot.call_api("get_group_member_info", group_id=gid, user_id=uid)
+    mem_info = await member_cache.get(bot, gid, uid)
 
     sex = mem_info["sex"]
     if sex == "male":
@@ -86,7 +148,7 @@ async def good_night(bot: Bot, matcher: Matcher, event: GroupMessageEvent, args:
     else:
         sex_str = "群友"
 
-    msg = morning_manager.get_night_msg(str(gid), str(uid), sex_str)
+    msg = await morning_manager.get_night_msg(str(gid), str(uid), sex_str)
     await matcher.finish(message=msg, at_sender=True)
 
 
@@ -95,28 +157,152 @@ async def _(matcher: Matcher, event: GroupMessageEvent):
     gid = str(event.group_id)
     uid = str(event.user_id)
 
-    msg = morning_manager.get_my_routine(gid, uid)
+    msg = await morning_manager.get_my_routine(gid, uid)
     await matcher.finish(message=msg, at_sender=True)
 
 
 @group_routine.handle()
 async def _(bot: Bot, matcher: Matcher, event: GroupMessageEvent):
     gid = event.group_id
-    morning_count, night_count, uid = morning_manager.get_group_routine(str(gid))
+    morning_count, night_count, uid = await morning_manager.get_group_routine(str(gid))
     msg: str = f"今天已经有{morning_count}位群友早安了，{night_count}位群友晚安了~"
 
     if uid:
-        mem_info = await bot.call_api("get_group_member_info", group_id=gid, user_id=int(uid))
+        mem_info = await member_cache.get(bot, gid, int(uid))
         nickname: str = mem_info["card"] if mem_info["card"] else mem_info["nickname"]
         msg += f"\n上周睡觉大王是群友：{nickname}，再接再厉～"
 
     await matcher.finish(MessageSegment.text(msg))
 
 
+@my_chart.handle()
+async def _(matcher: Matcher, event: GroupMessageEvent):
+    if not chart_available():
+        await matcher.finish("未安装Pillow，无法生成作息图~")
+
+    png = await morning_manager.get_my_chart(str(event.group_id), str(event.user_id))
+    if png is None:
+        await matcher.finish("你本周还没有早晚安过呢！暂无数据~", at_sender=True)
+
+    await matcher.finish(MessageSegment.image(png), at_sender=True)
+
+
+@group_chart.handle()
+async def _(bot: Bot, matcher: Matcher, event: GroupMessageEvent):
+    if not chart_available():
+        await matcher.finish("未安装Pillow，无法生成作息图~")
+
+    gid = event.group_id
+    png = await morning_manager.get_group_chart(str(gid))
+    if png is None:
+        await matcher.finish("本周还没有群友睡过觉呢~")
+
+    # Bars of the chart are labeled by rank
+    ranking = await morning_manager.get_sleep_ranking(str(gid), 10)
+    nicknames: List[str] = await asyncio.gather(*[_get_nickname(bot, gid, int(uid)) for uid, _ in ranking])
+    legend: str = "，".join(f"#{i} {nickname}" for i, nickname in enumerate(nicknames, 1))
+
+    await matcher.finish(MessageSegment.image(png) + MessageSegment.text(legend))
+
+
+@sleeping_king.handle()
+async def _(bot: Bot, matcher: Matcher, event: GroupMessageEvent):
+    gid = event.group_id
+    ranking = await morning_manager.get_sleep_ranking(str(gid), 1)
+
+    if not ranking:
+        await matcher.finish("本周还没有群友睡过觉呢~")
+
+    uid, weekly_sleep = ranking[0]
+    nickname: str = await _get_nickname(bot, gid, int(uid))
+    await matcher.finish(f"本周目前的睡觉大王是群友：{nickname}，已经睡了{format_duration(weekly_sleep)}！")
+
+
+@sleep_ranking.handle()
+async def _(bot: Bot, matcher: Matcher, event: GroupMessageEvent, args: Message = CommandArg()):
+    arg: str = args.extract_plain_text().strip()
+    n: int = min(int(arg), 20) if arg.isdigit() and int(arg) > 0 else 10
+
+    gid = event.group_id
+    ranking = await morning_manager.get_sleep_ranking(str(gid), n)
+
+    if not ranking:
+        await matcher.finish("本周还没有群友睡过觉呢~")
+
+    nicknames: List[str] = await asyncio.gather(*[_get_nickname(bot, gid, int(uid)) for uid, _ in ranking])
+    msg: str = "本周睡眠排行："
+    for i, ((_, weekly_sleep), nickname) in enumerate(zip(ranking, nicknames), 1):
+        msg += f"\n{i}. {nickname}：{format_duration(weekly_sleep)}"
+
+    await matcher.finish(msg)
+
+
+@my_rank.handle()
+async def _(matcher: Matcher, event: GroupMessageEvent):
+    gid = str(event.group_id)
+    uid = str(event.user_id)
+
+    rank = await morning_manager.get_my_rank(gid, uid)
+    if rank is None:
+        await matcher.finish("你本周还没有睡过觉呢！暂无排名~", at_sender=True)
+
+    place, weekly_sleep, total = rank
+    await matcher.finish(f"你本周睡了{format_duration(weekly_sleep)}，在{total}位群友中排第{place}名！", at_sender=True)
+
+
+@early_board.handle()
+async def _(bot: Bot, matcher: Matcher, event: GroupMessageEvent):
+    gid = event.group_id
+    early_risers, _ = await morning_manager.get_daily_boards(str(gid))
+
+    if not early_risers:
+        await matcher.finish("今天还没有群友早安呢~")
+
+    nicknames: List[str] = await asyncio.gather(*[_get_nickname(bot, gid, int(uid)) for uid, _ in early_risers])
+    tz = morning_manager.get_timezone(str(gid))
+    msg: str = "今日早起榜："
+    for i, ((_, get_up_time), nickname) in enumerate(zip(early_risers, nicknames), 1):
+        msg += f"\n{i}. {nickname}：{datetime.fromtimestamp(get_up_time, tz).strftime('%H:%M:%S')}"
+
+    await matcher.finish(msg)
+
+
+@late_board.handle()
+async def _(bot: Bot, matcher: Matcher, event: GroupMessageEvent):
+    gid = event.group_id
+    _, late_sleepers = await morning_manager.get_daily_boards(str(gid))
+
+    if not late_sleepers:
+        await matcher.finish("今天还没有群友晚安呢~")
+
+    nicknames: List[str] = await asyncio.gather(*[_get_nickname(bot, gid, int(uid)) for uid, _ in late_sleepers])
+    tz = morning_manager.get_timezone(str(gid))
+    msg: str = "今日晚睡榜："
+    for i, ((_, sleep_time), nickname) in enumerate(zip(late_sleepers, nicknames), 1):
+        msg += f"\n{i}. {nickname}：{datetime.fromtimestamp(sleep_time, tz).strftime('%H:%M:%S')}"
+
+    await matcher.finish(msg)
+
+
+@member_notice.handle()
+async def _(event: NoticeEvent):
+    member_cache.invalidate(getattr(event, "group_id"), getattr(event, "user_id"))
+
+
 @configure.handle()
 async def _(matcher: Matcher, event: GroupMessageEvent):
     gid = str(event.group_id)
-    msg = morning_manager.get_group_config()
+    msg = morning_manager.get_group_config(gid)
+    await matcher.finish(msg)
+
+
+@timezone_setting.handle()
+async def _(matcher: Matcher, event: GroupMessageEvent, args: Message = CommandArg()):
+    name: str = args.extract_plain_text().strip()
+    if not name:
+        await matcher.finish("请输入时区，形如：早晚安时区 Asia/Shanghai")
+
+    msg = morning_manager.set_timezone(str(event.group_id), name)
     await matcher.finish(msg)
 
 
@@ -262,12 +448,13 @@ async def _(event: GroupMessageEvent, matcher: Matcher):
     else:
         _param2 = 0
 
+    gid = str(event.group_id)
     if _op_type == "设置":
-        msg = morning_manager.morning_config(_item, _param1, _param2)
+        msg = morning_manager.morning_config(gid, _item, _param1, _param2)
     elif _op_type == "开启":
-        msg = morning_manager.morning_switch(_item, True)
+        msg = morning_manager.morning_switch(gid, _item, True)
     else:
-        msg = morning_manager.morning_switch(_item, False)
+        msg = morning_manager.morning_switch(gid, _item, False)
 
     await morning_setting.finish(msg)
 
@@ -354,32 +541,99 @@ async def _(event: GroupMessageEvent, matcher: Matcher):
     else:
         _param2 = 0
 
+    gid = str(event.group_id)
     if _op_type == "设置":
-        msg = morning_manager.night_config(_item, _param1, _param2)
+        msg = morning_manager.night_config(gid, _item, _param1, _param2)
     elif _op_type == "开启":
-        msg = morning_manager.night_switch(_item, True)
+        msg = morning_manager.night_switch(gid, _item, True)
     else:
-        msg = morning_manager.night_switch(_item, False)
+        msg = morning_manager.night_switch(gid, _item, False)
 
     await night_setting.finish(msg)
 
 
-# 每日最早晚安时间，重置昨日早晚安计数
-@driver.on_startup
-async def daily_refresh():
-    morning_manager.daily_scheduler()
-    logger.info("每日早晚安定时刷新任务已启动！")
+# Latency of the commands, and the profile while profiling. Matchers of other plugins pass through at the cost of a lookup
+@run_preprocessor
+async def _(matcher: Matcher):
+    if type(matcher) in _command_labels:
+        matcher.state["_morning_start"] = perf_counter()
+        if profiler.enter():
+            matcher.state["_morning_profiled"] = True
 
 
-# 每周一最晚晚安时间统计部分周数据
-@driver.on_startup
-async def monday_weekly_night_refresh():
-    morning_manager.weekly_night_scheduler()
-    logger.info("每周晚安定时刷新任务已启动！")
+@run_postprocessor
+async def _(matcher: Matcher):
+    start = matcher.state.pop("_morning_start", None)
+    if start is not None:
+        command_duration.observe(perf_counter() - start, _command_labels[type(matcher)])
+
+    if matcher.state.pop("_morning_profiled", False):
+        profiler.exit()
+
+
+metrics.collect("morning_cache_hits_total", "Lookups served by the caches", "counter",
+                lambda: {("member_info",): member_cache.hits, ("render",): render_cache.hits}, ("cache",))
+metrics.collect("morning_cache_misses_total", "Lookups missing the caches", "counter",
+                lambda: {("member_info",): member_cache.misses, ("render",): render_cache.misses}, ("cache",))
+metrics.collect("morning_cache_joined_total", "Lookups waiting for the same one in flight of the caches", "counter",
+                lambda: {("member_info",): member_cache.joined, ("render",): render_cache.joined}, ("cache",))
+
+# Metrics are served over HTTP by drivers serving HTTP such as FastAPI, or replied to superusers otherwise
+setup_http_server = getattr(driver, "setup_http_server", None)
+if HTTPServerSetup is not None and setup_http_server is not None:
+    async def _metrics_endpoint(request: Request) -> Response:
+        return Response(200, headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}, content=metrics.render())
+
+    setup_http_server(HTTPServerSetup(URL(morning_config.morning_metrics_path), "GET", "morning_metrics", _metrics_endpoint))
+else:
+    metrics_command = on_command(cmd="早晚安指标", permission=SUPERUSER, priority=10, block=True)
+
+    @metrics_command.handle()
+    async def _(matcher: Matcher):
+        await matcher.finish(metrics.render(buckets=False))
+
 
+@profile_command.handle()
+async def _(matcher: Matcher, args: Message = CommandArg()):
+    arg: str = args.extract_plain_text().strip()
+    if arg and not arg.isdigit() or not 1 <= int(arg or 60) <= 600:
+        await matcher.finish("性能分析时长应为1至600秒~")
 
-# 每周一最晚早安时间，统计上周睡眠时间、早安并重置
+    seconds: int = int(arg or 60)
+
+    # Started before replying, so that another command meanwhile finds it running rather than starting it again
+    if not profiler.start():
+        await matcher.finish("正在进行性能分析，请稍后再试~")
+
+    try:
+        await matcher.send(f"开始性能分析，{seconds}秒后回复结果~")
+    except BaseException:
+        profiler.stop()
+        raise
+
+    result = await morning_manager.profile(seconds)
+    if result is None:
+        await matcher.finish(f"{seconds}秒内没有早晚安命令或定时任务运行，未生成分析结果~")
+
+    path, stats = result
+    # (file, line, function) -> (primitive calls, calls, own time, cumulative time, callers)
+    top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:10]
+    msg: str = f"性能分析结果已保存至{path}，累计耗时前10的函数："
+    for (file, line, func), (_, calls, _, cumulative, _) in top:
+        msg += f"\n{cumulative * 1000:.1f}ms {calls}次 {Path(file).name}:{line}({func})"
+
+    await matcher.finish(msg)
+
+
+# 载入数据并定时写回
 @driver.on_startup
-async def weekly_refresh():
-    morning_manager.weekly_sleep_time_scheduler()
-    logger.info("每周睡眠时间定时刷新任务已启动！")
+async def load_data():
+    await morning_manager.load_data()
+    morning_manager.save_scheduler()
+    logger.info("早晚安数据已载入，定时写回任务已启动！")
+
+
+# 关闭时写回数据
+@driver.on_shutdown
+async def save_data():
+    await morning_manager.close()
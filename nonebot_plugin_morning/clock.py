@@ -0,0 +1,76 @@
+import heapq
+import itertools
+from typing import Awaitable, Callable, Iterator, List, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from .data_source import MorningManager
+
+Job = Callable[[], Awaitable[None]]
+
+
+class VirtualClock:
+    '''
+        Epoch time that only moves when told, to be set by MorningManager.set_clock() in a simulation or a replay.
+    '''
+
+    def __init__(self, start: float):
+        self._now: float = start
+
+    def __call__(self) -> float:
+        return self._now
+
+    def set(self, epoch: float) -> None:
+        self._now = epoch
+
+    def advance(self, seconds: float) -> None:
+        self._now += seconds
+
+
+class BoundaryDispatcher:
+    '''
+        Step a virtual clock through the starts of the counting days and weeks of the watched groups, rolling each
+        group over at once there, and through the periodic jobs, e.g. writing back the data, all in time order.
+        A simulation interleaves its commands with run_until(), so that a month passes in seconds.
+    '''
+
+    def __init__(self, manager: "MorningManager", clock: VirtualClock):
+        self._manager: "MorningManager" = manager
+        self._clock: VirtualClock = clock
+        # (epoch time, gid) of the next boundary of each watched group
+        self._boundaries: List[Tuple[float, str]] = []
+        # (epoch time, order of registration, interval, job). The order is unique, so jobs themselves are never compared
+        self._jobs: List[Tuple[float, int, float, Job]] = []
+        self._order: Iterator[int] = itertools.count()
+
+        self.day_rollovers: int = 0
+        self.week_rollovers: int = 0
+
+    def watch(self, gid: str) -> None:
+        heapq.heappush(self._boundaries, (self._manager.next_boundary(gid), gid))
+
+    def every(self, seconds: float, job: Job) -> None:
+        heapq.heappush(self._jobs, (self._clock() + seconds, next(self._order), seconds, job))
+
+    async def run_until(self, epoch: float) -> None:
+        '''
+            Fire the boundaries and the jobs due until the epoch time, each at its own time, then move the clock to it.
+        '''
+        while True:
+            boundary: float = self._boundaries[0][0] if self._boundaries else epoch + 1
+            job: float = self._jobs[0][0] if self._jobs else epoch + 1
+            if min(boundary, job) > epoch:
+                break
+
+            if boundary <= job:
+                _, gid = heapq.heappop(self._boundaries)
+                self._clock.set(boundary)
+                day_rolled, week_rolled = await self._manager.roll_over(gid)
+                self.day_rollovers += day_rolled
+                self.week_rollovers += week_rolled
+                heapq.heappush(self._boundaries, (self._manager.next_boundary(gid), gid))
+            else:
+                _, order, seconds, func = heapq.heappop(self._jobs)
+                self._clock.set(job)
+                await func()
+                heapq.heappush(self._jobs, (job + seconds, order, seconds, func))
+
+        self._clock.set(epoch)
@@ -1,18 +1,133 @@
 from nonebot import get_driver
 from nonebot.log import logger
 from pathlib import Path
-from pydantic import BaseModel, Extra
-from typing import Dict, Union
+from pydantic import BaseModel, Extra, Field
+from typing import Dict, Literal, Optional, Union
 try:
     import ujson as json
 except ModuleNotFoundError:
     import json
 from .utils import morning_json_update
+from .model import DATA_VERSION
 
 
 class PluginConfig(BaseModel, extra=Extra.ignore):
     morning_path: Path = Path(__file__).parent / "resource"
-
+    # Interval in seconds of writing back the in-memory data
+    morning_save_interval: int = 60
+    # Storage backend of morning data under morning_path: "json" for morning.json, "sqlite" for morning.db,
+    # "eventlog" for an append-only event log with snapshots in events/, "sharded" for one JSON file per group in groups/
+    morning_storage: Literal["json", "sqlite", "eventlog", "sharded"] = "json"
+    # Size in bytes of the event log to be compacted into a snapshot
+    morning_log_compact_size: int = 4 << 20
+    # Max entries and seconds to live of the cached group member info
+    morning_member_cache_size: int = 4096
+    morning_member_cache_ttl: int = 600
+    # Number of users on the daily boards of the earliest risers and the latest sleepers
+    morning_board_size: int = 5
+    # Days of sleep history kept for each user
+    morning_history_days: int = 90
+    # Max routine charts kept in memory, more are spilled to morning_path/cache, and max charts kept there
+    morning_render_cache_size: int = 64
+    morning_render_spill_size: int = 1024
+    # Record the handled commands with anonymized ids under morning_path/trace, to be replayed by benchmarks.replay
+    morning_trace: bool = False
+    # Size in bytes of the log of a trace session, and number of the latest sessions kept
+    morning_trace_max_bytes: int = 16 << 20
+    morning_trace_sessions: int = 4
+    # Route of the metrics in the Prometheus text format, served if the driver serves HTTP such as FastAPI
+    morning_metrics_path: str = "/morning/metrics"
+
+
+class IntimeSetting(BaseModel):
+    enable: bool
+    early_time: int = Field(ge=0, le=24)
+    late_time: int = Field(ge=0, le=24)
+
+
+class IntervalSetting(BaseModel):
+    enable: bool
+    interval: int = Field(ge=0, le=24)
+
+
+class MorningSettings(BaseModel):
+    morning_intime: IntimeSetting
+    multi_get_up: IntervalSetting
+    super_get_up: IntervalSetting
+
+
+class NightSettings(BaseModel):
+    night_intime: IntimeSetting
+    good_sleep: IntervalSetting
+    deep_sleep: IntervalSetting
+
+
+class GroupSettings(BaseModel):
+    '''
+        Overrides of the settings for a group, settings absent follow the global ones
+    '''
+    morning: Dict[str, Union[IntimeSetting, IntervalSetting]] = {}
+    night: Dict[str, Union[IntimeSetting, IntervalSetting]] = {}
+    timezone: Optional[str] = None
+
+
+class MorningConfig(BaseModel):
+    '''
+        Config of config.json
+    '''
+    morning: MorningSettings
+    night: NightSettings
+    # IANA name of the timezone of the time settings, None for the local time of the bot
+    timezone: Optional[str] = None
+    # Overrides of each group
+    groups: Dict[str, GroupSettings] = {}
+
+    def for_group(self, gid: str) -> "MorningConfig":
+        '''
+            Merge the overrides of a group into the global settings.
+        '''
+        overrides: GroupSettings = self.groups[gid]
+
+        return MorningConfig.parse_obj({
+            "morning": {**self.morning.dict(), **{k: v.dict() for k, v in overrides.morning.items()}},
+            "night": {**self.night.dict(), **{k: v.dict() for k, v in overrides.night.items()}},
+            "timezone": overrides.timezone if overrides.timezone is not None else self.timezone
+        })
+
+
+# Initial default config, global for all groups, overridden by the groups in "groups"
+default_config: MorningConfig = MorningConfig.parse_obj({
+    "morning": {
+        "morning_intime": {
+            "enable": True,
+            "early_time": 6,
+            "late_time": 12
+        },
+        "multi_get_up": {
+            "enable": False,
+            "interval": 6
+        },
+        "super_get_up": {
+            "enable": False,
+            "interval": 3
+        }
+    },
+    "night": {
+        "night_intime": {
+            "enable": True,
+            "early_time": 21,
+            "late_time": 6
+        },
+        "good_sleep": {
+            "enable": True,
+            "interval": 6
+        },
+        "deep_sleep": {
+            "enable": False,
+            "interval": 3
+        }
+    }
+})
 
 driver = get_driver()
 morning_config: PluginConfig = PluginConfig.parse_obj(driver.config.dict())
@@ -25,43 +140,9 @@ async def _() -> None:
 
     config_json_path: Path = morning_config.morning_path / "config.json"
 
-    # Initial default config, global for all groups
-    _config: Dict[str, Dict[str, Dict[str, Union[bool, int]]]] = {
-        "morning": {
-            "morning_intime": {
-                "enable": True,
-                "early_time": 6,
-                "late_time": 12
-            },
-            "multi_get_up": {
-                "enable": False,
-                "interval": 6
-            },
-            "super_get_up": {
-                "enable": False,
-                "interval": 3
-            }
-        },
-        "night": {
-            "night_intime": {
-                "enable": True,
-                "early_time": 21,
-                "late_time": 6
-            },
-            "good_sleep": {
-                "enable": True,
-                "interval": 6
-            },
-            "deep_sleep": {
-                "enable": False,
-                "interval": 3
-            }
-        }
-    }
-
     if not config_json_path.exists():
         with open(config_json_path, 'w', encoding='utf-8') as f:
-            json.dump(_config, f, ensure_ascii=False, indent=4)
+            json.dump(default_config.dict(), f, ensure_ascii=False, indent=4)
 
         logger.info("Initialized the config.json of Morning plugin")
     else:
@@ -81,7 +162,7 @@ async def _() -> None:
                 except KeyError:
                     # Write the initial value if error occurred
                     with open(config_json_path, 'w', encoding='utf-8') as f:
-                        json.dump(_config, f, ensure_ascii=False, indent=4)
+                        json.dump(default_config.dict(), f, ensure_ascii=False, indent=4)
                 
                     logger.info("Initialized the config.json")
 
@@ -105,6 +186,6 @@ async def _() -> None:
 
         else:
             with open(new_data_path, 'w', encoding='utf-8') as f:
-                json.dump(dict(), f, ensure_ascii=False, indent=4)
+                json.dump({"version": DATA_VERSION}, f, ensure_ascii=False, indent=4)
 
             logger.warning("旧版数据文件不存在，已重新创建数据文件！")
@@ -2,133 +2,216 @@ from nonebot import require
 from nonebot.log import logger
 from nonebot.adapters.onebot.v11 import MessageSegment
 from calendar import MONDAY
-from typing import Union, List, Dict, Optional, Tuple
+from typing import Any, AsyncIterator, Callable, Union, List, Dict, NamedTuple, Optional, Set, Tuple, TypeVar
 from pathlib import Path
-from datetime import datetime, time
+from datetime import datetime, time, timezone, tzinfo
+from concurrent.futures import ThreadPoolExecutor
+from pydantic import ValidationError
+from time import monotonic, perf_counter, time as epoch_time
+import asyncio
+import cProfile
+import pstats
 import random
-from .config import morning_config
+import sys
+from .config import morning_config, default_config, GroupSettings, MorningConfig, IntimeSetting, IntervalSetting
+from .history import DAY, SleepStats, night_of
+from .metrics import load_duration, metrics, rollovers, save_duration, user_rollovers
+from .model import DATA_VERSION, GroupRecord, UserRecord
+from .profiler import profiler
+from .render import RenderKey, bedtime_hour, render_cache, render_routine
+from .storage import Event, GroupData, MorningStorage, create_storage
+from .trace import TraceRecorder
 from .utils import *
 
 require("nonebot_plugin_apscheduler")
 from nonebot_plugin_apscheduler import scheduler
-from apscheduler.jobstores.base import JobLookupError
+
+_T = TypeVar("_T")
+
+# Seconds at least between two checks of config.json for modifications by hand, it's read on every command
+CONFIG_CHECK_INTERVAL: float = 1.0
+
+
+class Boundaries(NamedTuple):
+    '''
+        Config deciding where the counting days and weeks of the groups start, as of a version of config.json.
+    '''
+    config: MorningConfig
+    group_configs: Dict[str, MorningConfig]
+    timezone: Optional[tzinfo]
+    group_timezones: Dict[str, Optional[tzinfo]]
+
+    def of(self, gid: str) -> Tuple[int, int, Optional[tzinfo]]:
+        '''
+            Hours when the counting days and weeks of a group start, and its timezone.
+        '''
+        config: MorningConfig = self.group_configs.get(gid, self.config)
+        night: IntimeSetting = config.night.night_intime
+        morning: IntimeSetting = config.morning.morning_intime
+
+        return night.early_time if night.enable else 0, morning.late_time if morning.enable else 0, \
+            self.group_timezones.get(gid, self.timezone)
+
+    def periods(self, gid: str, epoch: float) -> Tuple[int, int]:
+        '''
+            Indexes of the counting day and week of a time in a group.
+        '''
+        day_hour, week_hour, tz = self.of(gid)
+        now_time: datetime = datetime.fromtimestamp(epoch, tz) if tz is not None else datetime.fromtimestamp(epoch).astimezone()
+
+        return day_index(now_time, day_hour), week_index(now_time, week_hour)
+
 
 class MorningManager:
     def __init__(self):
-        self._morning: Dict[str, Dict[str, Dict[str, Dict[str, Union[str, int, datetime, List[int]]]]]] = dict()
-        self._morning_path: Path = morning_config.morning_path / "morning.json"
-
-        self._config: Dict[str, Dict[str, Dict[str, Dict[str, Union[bool, int]]]]] = dict()
+        self._morning: Dict[str, GroupRecord] = dict()
+        self._storage: MorningStorage = create_storage(
+            morning_config.morning_path, morning_config.morning_storage, morning_config.morning_log_compact_size)
+        # Whether recorded events are being replayed, they must not be recorded again
+        self._replaying: bool = False
+        # Users (or "group_count") of groups modified since the last flush, written back by the save scheduler
+        self._dirty: Dict[str, Set[str]] = dict()
+        # Events accepted since the last flush
+        self._events: List[Event] = []
+        # All storage I/O runs in this thread, one call at a time, off the event loop
+        self._writer: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="morning_writer")
+        # Created in load_data() inside the running event loop
+        self._flush_lock: Optional[asyncio.Lock] = None
+        # Per-group locks serializing the read-check-update of handlers and refreshing jobs on a group.
+        # Refreshing jobs are coroutines run in the event loop by the scheduler, never in its thread pool
+        self._group_locks: Dict[str, asyncio.Lock] = dict()
+
+        self._config: MorningConfig = default_config.copy(deep=True)
         self._config_path: Path = morning_config.morning_path / "config.json"
-
-    def _init_group_data(self, gid: str) -> None:
+        # Modified time of config.json when it was parsed last time, and monotonic time when it was checked last time
+        self._config_mtime: float = 0
+        self._config_checked: float = -CONFIG_CHECK_INTERVAL
+        # Config of the groups with overrides, merged with the global one
+        self._group_configs: Dict[str, MorningConfig] = dict()
+        # Timezones of the global config and of the groups with overrides, None for the local time of the bot
+        self._timezone: Optional[tzinfo] = None
+        self._group_timezones: Dict[str, Optional[tzinfo]] = dict()
+        # Whether config.json has been applied, the data has been rolled over under it since then
+        self._config_applied: bool = False
+        # Changes of the boundaries of days and weeks since startup, for rebasing the groups a lazy storage hasn't loaded.
+        # Loaded groups are rebased at once. Groups rebased but not loaded map to the number of changes applied to them,
+        # and the changes up to _rebased_changes have been applied to all of them
+        self._boundary_changes: List[Tuple[float, Boundaries, Boundaries]] = []
+        self._rebased: Dict[str, int] = dict()
+        self._rebased_changes: int = 0
+
+        # Source of the epoch time of now, a virtual clock when replaying
+        self._clock: Callable[[], float] = epoch_time
+        # Recorder of the handled commands, None if tracing is disabled
+        self._trace: Optional[TraceRecorder] = None
+        # Profile of the storage calls in the writer thread while profiling
+        self._writer_profile: Optional[cProfile.Profile] = None
+
+        metrics.collect("morning_storage_bytes_written_total", "Bytes written back to the storage", "counter",
+                        lambda: {(): self._storage.bytes_written})
+        metrics.collect("morning_groups_loaded", "Groups loaded in memory", "gauge", lambda: {(): len(self._morning)})
+
+    async def _init_group_data(self, gid: str) -> None:
         '''
-            Initialize group data.
+            Initialize group data. Load it from the storage first if the storage loads groups on demand.
+            Called with the lock of the group held.
         '''
-        self._load_data()
+        if gid not in self._morning and self._storage.lazy:
+            group: Optional[GroupData] = await self._io(self._storage.load_group, gid)
+            if group is not None:
+                self._morning[gid] = GroupRecord.from_dict(group)
+                if self._rebase_changes(gid, self._morning[gid], self._rebased.pop(gid, 0)):
+                    self._mark_dirty(gid)
 
         if gid not in self._morning:
-            self._morning.update({
-                gid: {
-                    "group_count": {
-                        "daily": {
-                            # Daily good-morning count of groups, REFRESH at the late time of good-morning everyday
-                            "good_morning": 0,
-                            # Daily good-night count of groups, REFRESH at the late time of good-night everyday
-                            "good_night": 0
-                        },
-                        "weekly": {
-                            # Sleeping king of group of last week, REFRESH at the late time of good-morning every Monday
-                            "sleeping_king": ""
-                        }
-                    }
-                }
-            })
-
-            self._save_data()
+            self._morning[gid] = GroupRecord()
+            self._mark_dirty(gid, "group_count")
 
     # ------------------------------ Config ------------------------------ #
-    def get_group_config(self) -> MessageSegment:
+    def get_group_config(self, gid: str) -> MessageSegment:
         '''
-            Return the current configurations.
+            Return the current configurations of a group.
         '''
-        msg: str = "早安晚安设置如下："
-        self._load_config()
+        config: MorningConfig = self._group_config(gid)
+        now_time: datetime = self._now(gid)
+        msg: str = "本群的早安晚安设置如下：" if gid in self._group_configs else "早安晚安设置如下："
+        msg += f"\n时区：{config.timezone if config.timezone is not None else 'Bot所在时区'}"
 
         # Morning config
         msg += "\n是否要求规定时间内起床："
-        morning_intime = self._config["morning"]["morning_intime"]["enable"]
+        morning_intime = config.morning.morning_intime.enable
         
         if morning_intime:
-            msg += "是\n - 最早允许起床时间：" + str(self._config["morning"]['morning_intime']["early_time"]) + "点\n - 最晚允许起床时间：" + str(
-                self._config["morning"]["morning_intime"]["late_time"]) + "点"
+            msg += "是\n - 最早允许起床时间：" + str(config.morning.morning_intime.early_time) + "点\n - 最晚允许起床时间：" + str(
+                config.morning.morning_intime.late_time) + "点"
         else:
             msg += "否"
 
         msg += "\n是否允许连续多次起床："
-        multi_get_up = self._config["morning"]["multi_get_up"]["enable"]
+        multi_get_up = config.morning.multi_get_up.enable
         
         if multi_get_up:
             msg += "是"
         else:
             msg += "否\n - 允许的最短起床间隔：" + \
-                str(self._config["morning"]["multi_get_up"]["interval"]) + "小时"
+                str(config.morning.multi_get_up.interval) + "小时"
 
         msg += "\n是否允许超级亢奋（即睡眠时长很短）："
-        super_get_up = self._config["morning"]["super_get_up"]["enable"]
+        super_get_up = config.morning.super_get_up.enable
         
         if super_get_up:
             msg += "是"
         else:
             msg += "否\n - 允许的最短睡觉时长：" + \
-                str(self._config["morning"]["super_get_up"]["interval"]) + "小时"
+                str(config.morning.super_get_up.interval) + "小时"
 
         # Night config
         msg += "\n是否要求规定时间内睡觉："
-        night_intime = self._config["night"]["night_intime"]["enable"]
+        night_intime = config.night.night_intime.enable
         
         if night_intime:
-            msg += "是\n - 最早允许睡觉时间：" + str(self._config["night"]["night_intime"]["early_time"]) + \
+            msg += "是\n - 最早允许睡觉时间：" + str(config.night.night_intime.early_time) + \
                 "点\n - 最晚允许睡觉时间：第二天早上" + \
-                str(self._config["night"]["night_intime"]["late_time"]) + "点"
+                str(config.night.night_intime.late_time) + "点"
         else:
             msg += "否"
 
         msg += "\n是否开启优质睡眠："
-        good_sleep = self._config["night"]["good_sleep"]["enable"]
+        good_sleep = config.night.good_sleep.enable
         
         if good_sleep:
             msg += "是"
         else:
             msg += "否\n - 允许的最短优质睡眠：" + \
-                str(self._config["night"]["good_sleep"]["interval"]) + "小时"
+                str(config.night.good_sleep.interval) + "小时"
 
         msg += "\n是否允许深度睡眠（即清醒时长很短）："
-        deep_sleep = self._config["night"]["deep_sleep"]["enable"]
+        deep_sleep = config.night.deep_sleep.enable
         
         if deep_sleep:
             msg += "是"
         else:
             msg += "否\n - 允许的最短清醒时长：" + \
-                str(self._config["night"]["deep_sleep"]["interval"]) + "小时"
+                str(config.night.deep_sleep.interval) + "小时"
 
-        return MessageSegment.text(msg)
+        return self._traced("group_config", gid, "", now_time, "ok", msg)
 
-    def _change_enable(self, day_or_night: str, _setting: str, new_state: bool) -> str:
+    def _change_enable(self, gid: str, day_or_night: str, _setting: str, new_state: bool) -> str:
         '''
-            Change and save the new state of a setting.
+            Change and save the new state of a setting of a group.
         '''
-        self._load_config()
-        self._config[day_or_night][_setting]["enable"] = new_state
+        self._load_config(force=True)
+        self._override_setting(gid, day_or_night, _setting).enable = new_state
         self._save_config()
 
         return "配置更新成功！"
 
-    def _change_set_time(self, _day_or_night: str, _setting: str, _interval_or_early_time: int, _late_time: Optional[int] = None) -> str:
+    def _change_set_time(self, gid: str, _day_or_night: str, _setting: str, _interval_or_early_time: int, _late_time: Optional[int] = None) -> str:
         '''
-            Change the interval of a setting.
+            Change the interval of a setting of a group.
         '''
-        self._load_config()
+        self._load_config(force=True)
+        setting: Union[IntimeSetting, IntervalSetting] = self._override_setting(gid, _day_or_night, _setting)
 
         if _setting == "morning_intime" or _setting == "night_intime":
             if not isinstance(_late_time, int):
@@ -137,33 +220,33 @@ class MorningManager:
             early_time: int = _interval_or_early_time
             late_time: int = _late_time
 
-            self._config[_day_or_night][_setting]["early_time"] = early_time
-            self._config[_day_or_night][_setting]["late_time"] = late_time
+            setting.early_time = early_time
+            setting.late_time = late_time
         else:
             interval: int = _interval_or_early_time
-            self._config[_day_or_night][_setting]["interval"] = interval
+            setting.interval = interval
 
         msg: str = "配置更新成功！"
 
         # Some settings are True in default
         if _setting == "morning_intime" or _setting == "night_intime" or _setting == "good_sleep" \
-                and self._config[_day_or_night][_setting]["enable"] == False:
-            self._config[_day_or_night][_setting]["enable"] = True
+                and setting.enable == False:
+            setting.enable = True
             msg += "且此项设置已启用！"
 
         # Some settings are False in default
         if _setting == "multi_get_up" or _setting == "super_get_up" or _setting == "deep_sleep" \
-                and self._config[_day_or_night][_setting]["enable"] == True:
-            self._config[_day_or_night][_setting]["enable"] = False
+                and setting.enable == True:
+            setting.enable = False
             msg += "且此项设置已禁用！"
 
         self._save_config()
 
         return msg
 
-    def morning_config(self, _mor_setting: str, param1: int, param2: int) -> MessageSegment:
+    def morning_config(self, gid: str, _mor_setting: str, param1: int, param2: int) -> MessageSegment:
         '''
-            Configurations about morning.
+            Configurations about morning of a group.
         '''
         _setting: str = mor_switcher[_mor_setting]
         if _setting == "morning_intime":
@@ -174,63 +257,30 @@ class MorningManager:
                 msg = "错误！您设置的时间未在0-24之间，要求：0 <= 时间 <= 24"
             else:
                 msg = self._change_set_time(
-                    "morning", _setting, early_time, late_time)
-
-                # Change the data of daily good-morning/night scheduler and weekly sleeping time scheduler
-                self.daily_scheduler(early_time)
-                self.weekly_sleep_time_scheduler(late_time)
+                    gid, "morning", _setting, early_time, late_time)
         else:
             interval: int = param1
 
             if interval < 0 or interval > 24:
                 msg = "错误！您设置的时间间隔未在0-24之间，要求：0 <= 时间 <= 24"
             else:
-                msg = self._change_set_time("morning", _setting, interval)
+                msg = self._change_set_time(gid, "morning", _setting, interval)
 
-        return MessageSegment.text(msg)
+        outcome: str = "ok" if msg.startswith("配置更新成功") else "failed"
+        return self._traced("morning_config", gid, "", self._now(gid), outcome, msg, f"{_mor_setting}#{param1}#{param2}")
 
-    def morning_switch(self, _mor_setting: str, new_state: bool) -> MessageSegment:
+    def morning_switch(self, gid: str, _mor_setting: str, new_state: bool) -> MessageSegment:
         '''
-            Enable/Disable of morning settings.
+            Enable/Disable of morning settings of a group.
         '''
         _setting: str = mor_switcher[_mor_setting]
-        msg: str = self._change_enable("morning", _setting, new_state)
-
-        # Change the status of daily good-morning/night schedulers and weekly sleeping time scheduler
-        if _setting == "morning_intime":
-            # Remove the schedulers
-            if not new_state:
-                try:
-                    scheduler.remove_job("weekly_sleep_time_scheduler")
-                    logger.info(f"每周睡眠时间定时刷新任务已关闭！")
-
-                except JobLookupError as e:
-                    logger.warning(f"每周睡眠时间定时刷新任务移除失败: {e}")
-                    msg += "\n每周睡眠时间定时刷新任务移除失败"
+        msg: str = self._change_enable(gid, "morning", _setting, new_state)
 
-                try:
-                    scheduler.remove_job("daily_scheduler")
-                    logger.info(f"每日早晚安定时刷新任务已关闭！")
+        return self._traced("morning_switch", gid, "", self._now(gid), "ok", msg, f"{_mor_setting}#{new_state}")
 
-                except JobLookupError as e:
-                    logger.warning(f"每日早晚安定时刷新任务移除失败: {e}")
-                    msg += "\n每日早晚安定时刷新任务移除失败"
-
-            # Add the schedulers if they don't exist
-            else:
-                if not scheduler.get_job("weekly_sleep_time_scheduler"):
-                    self.weekly_sleep_time_scheduler()
-                    logger.info("每周睡眠时间定时刷新任务已启动！")
-
-                if not scheduler.get_job("daily_scheduler"):
-                    self.daily_scheduler()
-                    logger.info("每日早晚安定时刷新任务已启动！")
-
-        return MessageSegment.text(msg)
-
-    def night_config(self, _nig_setting: str, param1: int, param2: int) -> MessageSegment:
+    def night_config(self, gid: str, _nig_setting: str, param1: int, param2: int) -> MessageSegment:
         '''
-            Configurations about night.
+            Configurations about night of a group.
         '''
         _setting: str = nig_switcher[_nig_setting]
         if _setting == "night_intime":
@@ -241,516 +291,1105 @@ class MorningManager:
                 msg = "错误！您设置的时间未在0-24之间，要求：0 <= 时间 <= 24"
             else:
                 msg = self._change_set_time(
-                    "night", _setting, early_time, late_time)
+                    gid, "night", _setting, early_time, late_time)
         else:
             interval: int = param1
 
             if interval < 0 or interval > 24:
                 msg = "错误！您设置的时间间隔未在0-24之间，要求：0 <= 时间 <= 24"
             else:
-                msg = self._change_set_time("night", _setting, interval, None)
+                msg = self._change_set_time(gid, "night", _setting, interval, None)
 
-        return MessageSegment.text(msg)
+        outcome: str = "ok" if msg.startswith("配置更新成功") else "failed"
+        return self._traced("night_config", gid, "", self._now(gid), outcome, msg, f"{_nig_setting}#{param1}#{param2}")
 
-    def night_switch(self, _nig_setting: str, new_state: bool) -> MessageSegment:
+    def night_switch(self, gid: str, _nig_setting: str, new_state: bool) -> MessageSegment:
         '''
-            Enable/Disable of night settings.
+            Enable/Disable of night settings of a group.
         '''
         _setting: str = nig_switcher[_nig_setting]
-        msg: str = self._change_enable("night", _setting, new_state)
+        msg: str = self._change_enable(gid, "night", _setting, new_state)
 
-        return MessageSegment.text(msg)
+        return self._traced("night_switch", gid, "", self._now(gid), "ok", msg, f"{_nig_setting}#{new_state}")
+
+    def set_timezone(self, gid: str, name: str) -> MessageSegment:
+        '''
+            Set the timezone of a group by its IANA name, all time settings of the group are in this timezone.
+        '''
+        try:
+            get_timezone(name)
+        except ValueError as e:
+            msg: str = f"配置更新失败：{e}，时区形如Asia/Shanghai"
+            return self._traced("set_timezone", gid, "", self._now(gid), "invalid", msg, name)
+
+        self._load_config(force=True)
+        self._config.groups.setdefault(gid, GroupSettings()).timezone = name
+        self._save_config()
+
+        return self._traced("set_timezone", gid, "", self._now(gid), "ok", f"配置更新成功！本群时区已设置为{name}", name)
 
     # ------------------------------ Morning Judgement ------------------------------ #
     def _morning_and_update(self, gid: str, uid: str, now_time: datetime) -> Tuple[str, Union[str, int]]:
         '''
             Morning & update data.
         '''
-        self._load_data()
+        now_ts: int = int(now_time.timestamp())
+        group: GroupRecord = self._morning[gid]
+        user: UserRecord = group.users[uid]
+
+        week: int = self._week(gid, now_time)
+        self._roll_group(gid, now_time, week)
+        self._roll_user(user, week)
 
         # 起床并写数据
-        sleep_time: datetime = datetime.strptime(self._morning[gid][uid]["daily"]["night_time"], "%Y-%m-%d %H:%M:%S")
-        in_sleep: timedelta = now_time - sleep_time
-        _, hours, minutes, seconds = total_seconds2tuple_time(int(in_sleep.total_seconds()))
+        in_sleep: int = now_ts - user.night_time
+        _, hours, minutes, seconds = total_seconds2tuple_time(in_sleep)
 
         # 睡觉时间小于24小时就同时给出睡眠时长，记录；否则隔日
         in_sleep_tmp: str = ""
 
-        if in_sleep.days > 0:
+        if in_sleep >= 24 * 3600:
             in_sleep_tmp = ""
         else:
             in_sleep_tmp = f"{hours}时{minutes}分{seconds}秒"
-            self._morning[gid][uid]["weekly"]["weekly_sleep"] = sleeptime_update(self._morning[gid][uid]["weekly"]["weekly_sleep"], in_sleep)
-            self._morning[gid][uid]["total"]["total_sleep"] = sleeptime_update(self._morning[gid][uid]["total"]["total_sleep"], in_sleep)
+            user.weekly_sleep += in_sleep
+            user.total_sleep += in_sleep
+            user.history.append(user.night_time, in_sleep, morning_config.morning_history_days * 24 * 3600)
+            group.ranking.update(uid, user.weekly_sleep)
 
         # Daily morning time
-        self._morning[gid][uid]["daily"]["morning_time"] = now_time
+        user.morning_time = now_ts
         # Weekly morning count add
-        self._morning[gid][uid]["weekly"]["weekly_morning_count"] += 1
+        user.weekly_morning_count += 1
         # Total morning count add
-        self._morning[gid][uid]["total"]["morning_count"] += 1
+        user.morning_count += 1
 
-        lastweek_emt: Union[int, str] = self._morning[gid][uid]["weekly"]["lastweek_earliest_morning_time"]
-
-        # If it is integer, it means no data
-        if isinstance(lastweek_emt, int):
-            self._morning[gid][uid]["weekly"]["lastweek_earliest_morning_time"] = now_time
+        if user.lastweek_earliest_morning_time is None:
+            user.lastweek_earliest_morning_time = now_ts
         else:
             # If weekly morning time is later than daily's, update
-            if not is_later(self._morning[gid][uid]["daily"]["morning_time"], self._morning[gid][uid]["weekly"]["lastweek_earliest_morning_time"]):
-                self._morning[gid][uid]["weekly"]["lastweek_earliest_morning_time"] = now_time
+            if not is_later(now_ts, user.lastweek_earliest_morning_time, now_time.tzinfo):
+                user.lastweek_earliest_morning_time = now_ts
 
         # 判断是今天第几个起床的
-        self._morning[gid]["group_count"]["daily"]["good_morning"] += 1
+        group.counters.good_morning += 1
+        group.counters.add_riser(uid, now_ts, morning_config.morning_board_size)
 
-        self._save_data()
+        self._mark_dirty(gid, uid, "group_count")
 
-        return self._morning[gid]["group_count"]["daily"]["good_morning"], in_sleep_tmp if in_sleep_tmp != "" else 0
+        return group.counters.good_morning, in_sleep_tmp if in_sleep_tmp != "" else 0
 
-    def get_morning_msg(self, gid: str, uid: str, sex_str: str) -> MessageSegment:
+    async def get_morning_msg(self, gid: str, uid: str, sex_str: str) -> MessageSegment:
         '''
             Return good-morning info.
         '''
-        self._load_config()
-
-        # 若开启规定时间早安，则判断该时间是否允许早安
-        now_time: datetime = datetime.now()
-        if self._config["morning"]["morning_intime"]["enable"]:
-            _early_time: int = self._config["morning"]["morning_intime"]["early_time"]
-            _late_time: int = self._config["morning"]["morning_intime"]["late_time"]
-
-            if not is_MorTimeinRange(_early_time, _late_time, now_time):
-                msg = f"现在不能早安哦，可以早安的时间为{_early_time}时到{_late_time}时~"
-                return MessageSegment.text(msg)
-
-        self._init_group_data(gid)
-
-        # 当数据里有过这个人的信息
-        if uid in self._morning[gid]:
-            # 判断是否隔日
-            last_sleep_time: datetime = datetime.strptime(self._morning[gid][uid]["daily"]["night_time"], "%Y-%m-%d %H:%M:%S")
-            if last_sleep_time - now_time < timedelta(hours=24):
-
-                # 若关闭连续多次早安，则判断在设定时间内是否多次早安
-                if not self._config["morning"]["multi_get_up"]["enable"] and self._morning[gid][uid]["daily"]["morning_time"] != 0:
-                    interval: int = self._config["morning"]["multi_get_up"]["interval"]
-                    morning_time: datetime = datetime.strptime(self._morning[gid][uid]["daily"]["morning_time"], "%Y-%m-%d %H:%M:%S")
-
-                    if now_time - morning_time < timedelta(hours=interval):
-                        msg = f"{interval}小时内你已经早安过了哦~"
-                        return MessageSegment.text(msg)
-
-                # 若关闭超级亢奋，则判断睡眠时长是否小于设定时间
-                if not self._config["morning"]["super_get_up"]["enable"]:
-                    interval: int = self._config["morning"]["super_get_up"]["interval"]
-                    night_time: datetime = datetime.strptime(self._morning[gid][uid]["daily"]["night_time"], "%Y-%m-%d %H:%M:%S")
-
-                    if now_time - night_time < timedelta(hours=interval):
-                        msg = "你可猝死算了吧？现在不能早安哦~"
-                        return MessageSegment.text(msg)
-            # 有信息但是隔日
+        async with self._group_lock(gid):
+            config: MorningConfig = self._group_config(gid)
+
+            # 若开启规定时间早安，则判断该时间是否允许早安
+            now_time: datetime = self._now(gid)
+            now_ts: int = int(now_time.timestamp())
+            if config.morning.morning_intime.enable:
+                _early_time: int = config.morning.morning_intime.early_time
+                _late_time: int = config.morning.morning_intime.late_time
+
+                if not is_MorTimeinRange(_early_time, _late_time, now_time):
+                    msg = f"现在不能早安哦，可以早安的时间为{_early_time}时到{_late_time}时~"
+                    return self._traced("morning", gid, uid, now_time, "out_of_time", msg)
+
+            await self._init_group_data(gid)
+            user: Optional[UserRecord] = self._morning[gid].users.get(uid)
+
+            # 当数据里有过这个人的信息
+            if user is not None and user.night_time is not None:
+                # 判断是否隔日
+                if user.night_time - now_ts < 24 * 3600:
+
+                    # 若关闭连续多次早安，则判断在设定时间内是否多次早安
+                    if not config.morning.multi_get_up.enable and user.morning_time is not None:
+                        interval: int = config.morning.multi_get_up.interval
+
+                        if now_ts - user.morning_time < interval * 3600:
+                            msg = f"{interval}小时内你已经早安过了哦~"
+                            return self._traced("morning", gid, uid, now_time, "multi_get_up", msg)
+
+                    # 若关闭超级亢奋，则判断睡眠时长是否小于设定时间
+                    if not config.morning.super_get_up.enable:
+                        interval: int = config.morning.super_get_up.interval
+
+                        if now_ts - user.night_time < interval * 3600:
+                            msg = "你可猝死算了吧？现在不能早安哦~"
+                            return self._traced("morning", gid, uid, now_time, "super_get_up", msg)
+                # 有信息但是隔日
+                else:
+                    msg = random.choice(morning_prompt)
+                    return self._traced("morning", gid, uid, now_time, "over_a_day", msg)
+
+            # 否则说明：他还没睡过觉；即便如此，还是回复早安！
             else:
                 msg = random.choice(morning_prompt)
-                return MessageSegment.text(msg)
-
-        # 否则说明：他还没睡过觉；即便如此，还是回复早安！
-        else:
-            msg = random.choice(morning_prompt)
-            return MessageSegment.text(msg)
-
-        # 当前面条件均符合的时候，允许早安
-        num, in_sleep = self._morning_and_update(gid, uid, now_time)
-        if isinstance(in_sleep, str):
-            msg = f"早安成功！你的睡眠时长为{in_sleep}，\n你是今早第{num}个起床的{sex_str}！"
-        else:
-            msg = random.choice(morning_prompt)
-
-        return MessageSegment.text(msg)
+                return self._traced("morning", gid, uid, now_time, "no_night", msg)
+
+            # 当前面条件均符合的时候，允许早安
+            num, in_sleep = self._morning_and_update(gid, uid, now_time)
+            self._record_event("morning", gid, uid, now_time)
+            if isinstance(in_sleep, str):
+                msg = f"早安成功！你的睡眠时长为{in_sleep}，\n你是今早第{num}个起床的{sex_str}！"
+                return self._traced("morning", gid, uid, now_time, f"ok#{num}", msg)
+            else:
+                msg = random.choice(morning_prompt)
+                return self._traced("morning", gid, uid, now_time, f"ok_no_sleep#{num}", msg)
 
     # ------------------------------ Night Judgement ------------------------------ #
     def _night_and_update(self, gid: str, uid: str, now_time: datetime) -> Tuple[str, Union[str, int]]:
         '''
             Good night & update.
         '''
-        self._load_data()
+        now_ts: int = int(now_time.timestamp())
+
+        group: GroupRecord = self._morning[gid]
+        user: Optional[UserRecord] = group.users.get(uid)
+
+        week: int = self._week(gid, now_time)
+        self._roll_group(gid, now_time, week)
 
         # 没有晚安数据，则创建
-        if uid not in self._morning[gid]:
-            self._morning[gid].update({
-                uid: {
-                    "daily": {
-                        "morning_time": 0,
-                        "night_time": now_time
-                    },
-                    "weekly": {
-                        # Weekly good-morning count, RESET at the late time of good-morning every Monday
-                        "weekly_morning_count": 0,
-                        # Weekly good-night count, RESET at 0 A.M. every Monday
-                        "weekly_night_count": 1,
-                        # Weekly sleeping time, list of days/hrs/mins/secs, RESET at the late time of good-morning every Monday
-                        "weekly_sleep": [0, 0, 0, 0],
-                        # Good-morning count of last week, REFRESH at the late time of good-morning every Monday
-                        "lastweek_morning_count": 0,
-                        # Good-night count of last week, REFRESH at 0 A.M. every Monday
-                        "lastweek_night_count": 0,
-                        # Sleeping time of last week, list of days/hrs/mins/secs, REFRESH at the late time of good-morning every Monday
-                        "lastweek_sleep": [0, 0, 0, 0],
-                        # Earliest good-morning time of last week, REFRESH at a new daily good-morning time in
-                        "lastweek_earliest_morning_time": 0,
-                        # Latest good-night time of last week, REFRESH at a new daily good-night time in
-                        "lastweek_latest_night_time": 0
-                    },
-                    "total": {
-                        # Total good-morning count, never RESET
-                        "morning_count": 0,
-                        # Total good-night count, never RESET
-                        "night_count": 1,
-                        # Total sleeping time, list of days/hrs/mins/secs, REFRESH at every valid good-morning
-                        "total_sleep": [0, 0, 0, 0]
-                    }
-                }
-            })
-
-            self._morning[gid][uid]["weekly"]["lastweek_latest_night_time"] = self._morning[gid][uid]["daily"]["night_time"]
+        if user is None:
+            user = group.users[uid] = UserRecord(now_ts)
+            user.week = week
+            user.weekly_night_count = 1
+            user.night_count = 1
+            user.lastweek_latest_night_time = user.night_time
 
         # 若有就更新数据
         else:
+            self._roll_user(user, week)
             # Daily night time
-            self._morning[gid][uid]["daily"]["night_time"] = now_time
+            user.night_time = now_ts
             # Weekly night count add
-            self._morning[gid][uid]["weekly"]["weekly_night_count"] += 1
+            user.weekly_night_count += 1
             # Total night count add
-            self._morning[gid][uid]["total"]["night_count"] += 1
-
-            lastweek_lnt: Union[int, str] = self._morning[gid][uid]["weekly"]["lastweek_latest_night_time"]
+            user.night_count += 1
 
-            # If lastweek_lnt is integer, it means no data
-            if isinstance(lastweek_lnt, int):
-                self._morning[gid][uid]["weekly"]["lastweek_latest_night_time"] = now_time
+            if user.lastweek_latest_night_time is None:
+                user.lastweek_latest_night_time = now_ts
             else:
                 # If daily sleep time is later than weekly's, update
-                if is_later(self._morning[gid][uid]["daily"]["night_time"], self._morning[gid][uid]["weekly"]["lastweek_latest_night_time"]):
-                    self._morning[gid][uid]["weekly"]["lastweek_latest_night_time"] = now_time
+                if is_later(now_ts, user.lastweek_latest_night_time, now_time.tzinfo):
+                    user.lastweek_latest_night_time = now_ts
 
-        # 当上次起床时间非0，计算清醒时长
+        # 当有上次起床时间，计算清醒时长
         in_day_tmp: str = ""
-        if self._morning[gid][uid]["daily"].get("morning_time", 0) != 0:
-            get_up_time: datetime = datetime.strptime(self._morning[gid][uid]["daily"]["morning_time"], "%Y-%m-%d %H:%M:%S")
-            in_day: timedelta = now_time - get_up_time
-            _, hours, minutes, seconds = total_seconds2tuple_time(int(in_day.total_seconds()))
+        if user.morning_time is not None:
+            in_day: int = now_ts - user.morning_time
+            _, hours, minutes, seconds = total_seconds2tuple_time(in_day)
 
-            if in_day.days > 0:
+            if in_day >= 24 * 3600:
                 in_day_tmp = ""
             else:
                 in_day_tmp = f"{hours}时{minutes}分{seconds}秒"
 
         # 判断是今天第几个睡觉的
-        self._morning[gid]["group_count"]["daily"]["good_night"] += 1
+        group.counters.good_night += 1
+        group.counters.add_sleeper(uid, now_ts, morning_config.morning_board_size)
 
-        self._save_data()
+        self._mark_dirty(gid, uid, "group_count")
 
-        return self._morning[gid]["group_count"]["daily"]["good_night"], in_day_tmp if in_day_tmp != "" else 0
+        return group.counters.good_night, in_day_tmp if in_day_tmp != "" else 0
 
-    def get_night_msg(self, gid: str, uid: str, sex_str: str) -> MessageSegment:
+    async def get_night_msg(self, gid: str, uid: str, sex_str: str) -> MessageSegment:
         '''
             Return good-night info.
         '''
-        self._load_config()
+        async with self._group_lock(gid):
+            config: MorningConfig = self._group_config(gid)
 
-        # 若开启规定时间晚安，则判断该时间是否允许晚安
-        now_time: datetime = datetime.now()
-        if self._config["night"]["night_intime"]["enable"]:
-            _early_time: int = self._config["night"]["night_intime"]["early_time"]
-            _late_time: int = self._config["night"]["night_intime"]["late_time"]
+            # 若开启规定时间晚安，则判断该时间是否允许晚安
+            now_time: datetime = self._now(gid)
+            now_ts: int = int(now_time.timestamp())
+            if config.night.night_intime.enable:
+                _early_time: int = config.night.night_intime.early_time
+                _late_time: int = config.night.night_intime.late_time
 
-            if not is_NigTimeinRange(_early_time, _late_time, now_time):
-                msg = f"现在不能晚安哦，可以晚安的时间为{_early_time}时到第二天早上{_late_time}时~"
-                return MessageSegment.text(msg)
+                if not is_NigTimeinRange(_early_time, _late_time, now_time):
+                    msg = f"现在不能晚安哦，可以晚安的时间为{_early_time}时到第二天早上{_late_time}时~"
+                    return self._traced("night", gid, uid, now_time, "out_of_time", msg)
 
-        self._init_group_data(gid)
+            await self._init_group_data(gid)
 
-        # 当数据里有过这个人的信息就判断:
-        if uid in self._morning[gid]:
+            user: Optional[UserRecord] = self._morning[gid].users.get(uid)
 
-            # 若开启优质睡眠，则判断在设定时间内是否多次晚安
-            if self._config["night"]["good_sleep"]["enable"]:
-                interval: int = self._config["night"]["good_sleep"]["interval"]
-                night_time: datetime = datetime.strptime(self._morning[gid][uid]["daily"]["night_time"], "%Y-%m-%d %H:%M:%S")
+            # 当数据里有过这个人的信息就判断:
+            if user is not None:
 
-                if now_time - night_time < timedelta(hours=interval):
-                    msg = f"{interval}小时内你已经晚安过了哦~"
-                    return MessageSegment.text(msg)
+                # 若开启优质睡眠，则判断在设定时间内是否多次晚安
+                if config.night.good_sleep.enable and user.night_time is not None:
+                    interval: int = config.night.good_sleep.interval
 
-            # 若关闭深度睡眠，则判断不在睡觉的时长是否小于设定时长
-            if isinstance(self._morning[gid][uid]["daily"]["morning_time"], str):
-                if not self._config["night"]["deep_sleep"]["enable"]:
-                    interval: int = self._config["night"]["deep_sleep"]["interval"]
-                    morning_time: datetime = datetime.strptime(self._morning[gid][uid]["daily"]["morning_time"], "%Y-%m-%d %H:%M:%S")
+                    if now_ts - user.night_time < interval * 3600:
+                        msg = f"{interval}小时内你已经晚安过了哦~"
+                        return self._traced("night", gid, uid, now_time, "good_sleep", msg)
 
-                    if now_time - morning_time < timedelta(hours=interval):
-                        msg = "睡这么久还不够？现在不能晚安哦~"
-                        return MessageSegment.text(msg)
+                # 若关闭深度睡眠，则判断不在睡觉的时长是否小于设定时长
+                if user.morning_time is not None:
+                    if not config.night.deep_sleep.enable:
+                        interval: int = config.night.deep_sleep.interval
 
-        # 当数据里没有这个人或者前面条件均符合的时候，允许晚安
-        num, in_day = self._night_and_update(gid, uid, now_time)
-        if isinstance(in_day, int):
-            msg = f"晚安成功！你是今晚第{num}个睡觉的{sex_str}！"
-        else:
-            msg = f"晚安成功！你今天的清醒时长为{in_day}，\n你是今晚第{num}个睡觉的{sex_str}！"
+                        if now_ts - user.morning_time < interval * 3600:
+                            msg = "睡这么久还不够？现在不能晚安哦~"
+                            return self._traced("night", gid, uid, now_time, "deep_sleep", msg)
 
-        return MessageSegment.text(msg)
+            # 当数据里没有这个人或者前面条件均符合的时候，允许晚安
+            num, in_day = self._night_and_update(gid, uid, now_time)
+            self._record_event("night", gid, uid, now_time)
+            if isinstance(in_day, int):
+                msg = f"晚安成功！你是今晚第{num}个睡觉的{sex_str}！"
+            else:
+                msg = f"晚安成功！你今天的清醒时长为{in_day}，\n你是今晚第{num}个睡觉的{sex_str}！"
+
+            return self._traced("night", gid, uid, now_time, f"ok#{num}", msg)
 
     # ------------------------------ Routine ------------------------------ #
-    def get_my_routine(self, gid: str, uid: str) -> MessageSegment:
+    async def get_my_routine(self, gid: str, uid: str) -> MessageSegment:
         '''
             Get user's routine.
             If on Monday and now is later than the latest time of good-morning of Monday, good-morning/night count of last week & sleeping time will be included.
             Else, add weekly info of current week.
         '''
-        self._init_group_data(gid)
+        async with self._group_lock(gid):
+            await self._init_group_data(gid)
 
-        now_time: datetime = datetime.now()
-        today: int = now_time.weekday()
+            now_time: datetime = self._now(gid)
+            today: int = now_time.weekday()
 
-        if uid in self._morning[gid]:
-            # Daily info
-            get_up_time: str = self._morning[gid][uid]["daily"]["morning_time"]
-            sleep_time: str = self._morning[gid][uid]["daily"]["night_time"]
+            user: Optional[UserRecord] = self._morning[gid].users.get(uid)
 
-            # Total info
-            morning_count: int = self._morning[gid][uid]["total"]["morning_count"]
-            night_count: int = self._morning[gid][uid]["total"]["night_count"]
-            total_sleep: List[int] = self._morning[gid][uid]["total"]["total_sleep"]
+            if user is not None:
+                # Weekly data is rolled over lazily, the user may not show up in this week yet
+                if self._roll_user(user, self._week(gid, now_time)):
+                    self._mark_dirty(gid, uid)
 
-            msg: str = "你的作息数据如下："
-            msg += f"\n最近一次早安时间为{get_up_time}"
-            msg += f"\n最近一次晚安时间为{sleep_time}"
+                # Daily info
+                get_up_time: str = format_time(user.morning_time, now_time.tzinfo)
+                sleep_time: str = format_time(user.night_time, now_time.tzinfo)
 
-            week_list: List[str] = ["一", "二", "三", "四", "五", "六", "日"]
+                # Total info
+                morning_count: int = user.morning_count
+                night_count: int = user.night_count
+                total_sleep: int = user.total_sleep
 
-            # When on Monday and now time is later than the latest time of good-morning
-            if today == MONDAY:
-                hour: int = self.get_refresh_time("morning", "late_time")
+                msg: str = "你的作息数据如下："
+                msg += f"\n最近一次早安时间为{get_up_time}"
+                msg += f"\n最近一次晚安时间为{sleep_time}"
 
-                if hour != -1 and is_later_oclock(now_time, hour):
-                    lastweek_morning_count: int = self._morning[gid][uid]["weekly"]["lastweek_morning_count"]
-                    lastweek_night_count: int = self._morning[gid][uid]["weekly"]["lastweek_night_count"]
-                    lastweek_sleep: List[int] = self._morning[gid][uid]["weekly"]["lastweek_sleep"]
-
-                    lastweek_lnt_date: datetime = datetime.strptime(
-                        self._morning[gid][uid]["weekly"]["lastweek_latest_night_time"], "%Y-%m-%d %H:%M:%S")
-                    lastweek_lnt: time = lastweek_lnt_date.time()
-                    latest_day: int = lastweek_lnt_date.weekday()
-
-                    lastweek_emt_date: datetime = datetime.strptime(
-                        self._morning[gid][uid]["weekly"]["lastweek_earliest_morning_time"], "%Y-%m-%d %H:%M:%S")
-                    lastweek_emt: time = lastweek_emt_date.time()
-                    earliest_day: int = lastweek_emt_date.weekday()
-
-                    msg += f"\n上周早安了{lastweek_morning_count}次"
-                    msg += f"\n上周晚安了{lastweek_night_count}次"
-                    msg += f"\n上周睡眠时间为{lastweek_sleep[0]}天{lastweek_sleep[1]}时{lastweek_sleep[2]}分{lastweek_sleep[3]}秒"
-                    msg += f"\n上周最晚晚安时间是周{week_list[latest_day]} {lastweek_lnt}"
-                    if random.random() > 0.5:
-                        msg += f"，{random.choice(the_latest_night_prompt)}"
-
-                    msg += f"\n上周最早早安时间是周{week_list[earliest_day]} {lastweek_emt}"
-                    if random.random() > 0.5:
-                        msg += f"，{random.choice(the_earliest_morning_prompt)}"
-
-            # Not on Monday, add weekly info
-            else:
-                weekly_morning_count: int = self._morning[gid][uid]["weekly"]["weekly_morning_count"]
-                weekly_night_count: int = self._morning[gid][uid]["weekly"]["weekly_night_count"]
+                week_list: List[str] = ["一", "二", "三", "四", "五", "六", "日"]
 
-                msg += f"\n本周早安了{weekly_morning_count}次"
-                msg += f"\n本周晚安了{weekly_night_count}次"
+                # When on Monday and now time is later than the latest time of good-morning
+                if today == MONDAY:
+                    hour: int = self.get_refresh_time("morning", "late_time", gid)
 
-            msg += f"\n一共早安了{morning_count}次"
-            msg += f"\n一共晚安了{night_count}次"
-            msg += f"\n一共睡眠了{total_sleep[0]}天{total_sleep[1]}时{total_sleep[2]}分{total_sleep[3]}秒"
+                    if hour != -1 and is_later_oclock(now_time, hour):
+                        lastweek_morning_count: int = user.lastweek_morning_count
+                        lastweek_night_count: int = user.lastweek_night_count
+                        lastweek_sleep: int = user.lastweek_sleep
 
-        else:
-            msg: str = "你本周还没有早晚安过呢！暂无数据~"
+                        msg += f"\n上周早安了{lastweek_morning_count}次"
+                        msg += f"\n上周晚安了{lastweek_night_count}次"
+                        msg += f"\n上周睡眠时间为{format_duration(lastweek_sleep)}"
 
-        return MessageSegment.text(msg)
+                        if user.lastweek_latest_night_time is not None:
+                            lastweek_lnt_date: datetime = datetime.fromtimestamp(user.lastweek_latest_night_time, now_time.tzinfo)
+                            lastweek_lnt: time = lastweek_lnt_date.time()
+                            latest_day: int = lastweek_lnt_date.weekday()
+
+                            msg += f"\n上周最晚晚安时间是周{week_list[latest_day]} {lastweek_lnt}"
+                            if random.random() > 0.5:
+                                msg += f"，{random.choice(the_latest_night_prompt)}"
 
-    def get_group_routine(self, gid: str) -> Tuple[int, int, Optional[str]]:
+                        if user.lastweek_earliest_morning_time is not None:
+                            lastweek_emt_date: datetime = datetime.fromtimestamp(user.lastweek_earliest_morning_time, now_time.tzinfo)
+                            lastweek_emt: time = lastweek_emt_date.time()
+                            earliest_day: int = lastweek_emt_date.weekday()
+
+                            msg += f"\n上周最早早安时间是周{week_list[earliest_day]} {lastweek_emt}"
+                            if random.random() > 0.5:
+                                msg += f"，{random.choice(the_earliest_morning_prompt)}"
+
+                # Not on Monday, add weekly info
+                else:
+                    weekly_morning_count: int = user.weekly_morning_count
+                    weekly_night_count: int = user.weekly_night_count
+
+                    msg += f"\n本周早安了{weekly_morning_count}次"
+                    msg += f"\n本周晚安了{weekly_night_count}次"
+
+                msg += f"\n一共早安了{morning_count}次"
+                msg += f"\n一共晚安了{night_count}次"
+                msg += f"\n一共睡眠了{format_duration(total_sleep)}"
+                msg += self._history_stats(user, now_time)
+
+            else:
+                msg: str = "你本周还没有早晚安过呢！暂无数据~"
+                return self._traced("my_routine", gid, uid, now_time, "no_data", msg)
+
+            return self._traced("my_routine", gid, uid, now_time, "ok", msg)
+
+    async def get_group_routine(self, gid: str) -> Tuple[int, int, Optional[str]]:
         '''
             Get group's routine: daily good-morning/night count.
             If on Monday and now is later than the latest time of good-morning of Monday, add sleeping king of last week.
         '''
-        self._init_group_data(gid)
+        async with self._group_lock(gid):
+            await self._init_group_data(gid)
+
+            now_time: datetime = self._now(gid)
+            today: int = now_time.weekday()
+
+            group: GroupRecord = self._roll_group(gid, now_time)
+            morning_count: int = group.counters.good_morning
+            night_count: int = group.counters.good_night
+
+            if today == MONDAY:
+                uid: str = ""
+                hour: int = self.get_refresh_time("morning", "late_time", gid)
+
+                if hour != -1 and is_later_oclock(now_time, hour):
+                    uid = group.counters.sleeping_king
+
+                # Ids are only recorded anonymized, the outcome tells whether there is a sleeping king
+                self._trace_command("group_routine", gid, "", now_time, f"ok#{morning_count}#{night_count}#{'king' if uid else ''}")
+                return morning_count, night_count, uid if uid != "" else None
+
+            self._trace_command("group_routine", gid, "", now_time, f"ok#{morning_count}#{night_count}#")
+            return morning_count, night_count, None
+
+    async def get_daily_boards(self, gid: str) -> Tuple[List[Tuple[str, int]], List[Tuple[str, int]]]:
+        '''
+            Get the boards of today: the earliest risers earliest first, and the latest sleepers latest first.
+        '''
+        async with self._group_lock(gid):
+            await self._init_group_data(gid)
+
+            now_time: datetime = self._now(gid)
+            group: GroupRecord = self._roll_group(gid, now_time)
+            early_risers: List[Tuple[str, int]] = list(group.counters.early_risers)
+            late_sleepers: List[Tuple[str, int]] = group.counters.late_sleepers[::-1]
+
+            self._trace_command("daily_boards", gid, "", now_time, f"ok#{len(early_risers)}#{len(late_sleepers)}")
+            return early_risers, late_sleepers
+
+    async def get_sleep_ranking(self, gid: str, n: int) -> List[Tuple[str, int]]:
+        '''
+            Get the top-N users of the group and their sleeping times of this week, longest first.
+            The first one is the sleeping king of this week so far.
+        '''
+        async with self._group_lock(gid):
+            await self._init_group_data(gid)
+
+            now_time: datetime = self._now(gid)
+            ranking: List[Tuple[str, int]] = self._roll_group(gid, now_time).ranking.top(n)
+
+            self._trace_command("sleep_ranking", gid, "", now_time, f"ok#{len(ranking)}", str(n))
+            return ranking
+
+    async def get_my_rank(self, gid: str, uid: str) -> Optional[Tuple[int, int, int]]:
+        '''
+            Get the rank of the user by sleeping time of this week, the sleeping time and the number of ranked users.
+            None if the user hasn't slept this week.
+        '''
+        async with self._group_lock(gid):
+            await self._init_group_data(gid)
+
+            now_time: datetime = self._now(gid)
+            group: GroupRecord = self._roll_group(gid, now_time)
+            rank: Optional[int] = group.ranking.rank(uid)
+            if rank is None:
+                self._trace_command("my_rank", gid, uid, now_time, "none")
+                return None
+
+            self._trace_command("my_rank", gid, uid, now_time, f"ok#{rank}#{len(group.ranking)}")
+            return rank, group.users[uid].weekly_sleep, len(group.ranking)
+
+    # ------------------------------ Charts ------------------------------ #
+    async def get_my_chart(self, gid: str, uid: str) -> Optional[bytes]:
+        '''
+            Get the PNG chart of the user's sleeps of the last 7 nights, None if there is no data.
+            The chart is cached until the user says good-morning/night again, or a new night begins.
+        '''
+        async with self._group_lock(gid):
+            await self._init_group_data(gid)
+
+            now_time: datetime = self._now(gid)
+            user: Optional[UserRecord] = self._morning[gid].users.get(uid)
+            if user is None:
+                self._trace_command("my_chart", gid, uid, now_time, "none")
+                return None
+
+            self._trace_command("my_chart", gid, uid, now_time, "ok")
+            utc_offset: int = int(now_time.utcoffset().total_seconds())
+            night: int = night_of(int(now_time.timestamp()), utc_offset)
+            key: RenderKey = (gid, uid, (night, user.morning_count, user.night_count))
+
+        async def render() -> bytes:
+            async with self._group_lock(gid):
+                sleeps: List[Tuple[int, int]] = self._morning[gid].users[uid].history.since(
+                    (night - 7) * DAY - utc_offset + DAY // 2)
+
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self._render_chart, "My sleep of the last 7 nights", night, utc_offset, sleeps, None)
+
+        return await render_cache.get(key, render)
+
+    async def get_group_chart(self, gid: str) -> Optional[bytes]:
+        '''
+            Get the PNG chart of the top sleepers of this week and the bedtimes of the group of the last 7 nights.
+            None if nobody has slept this week. The chart is cached until anyone says good-morning/night again.
+        '''
+        async with self._group_lock(gid):
+            await self._init_group_data(gid)
+
+            now_time: datetime = self._now(gid)
+            group: GroupRecord = self._roll_group(gid, now_time)
+            if not len(group.ranking):
+                self._trace_command("group_chart", gid, "", now_time, "none")
+                return None
+
+            self._trace_command("group_chart", gid, "", now_time, "ok")
+            utc_offset: int = int(now_time.utcoffset().total_seconds())
+            night: int = night_of(int(now_time.timestamp()), utc_offset)
+            counters = group.counters
+            key: RenderKey = (gid, "", (night, counters.week, counters.day, counters.good_morning, counters.good_night))
+
+        async def render() -> bytes:
+            async with self._group_lock(gid):
+                group: GroupRecord = self._morning[gid]
+                ranking: List[Tuple[str, int]] = group.ranking.top(10)
+                since: int = (night - 7) * DAY - utc_offset + DAY // 2
+                sleeps: List[Tuple[int, int]] = [
+                    sleep for user in group.users.values() for sleep in user.history.since(since)]
+
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self._render_chart, "Sleep of the group this week", night, utc_offset, sleeps, ranking)
+
+        return await render_cache.get(key, render)
+
+    @staticmethod
+    def _render_chart(title: str, night: int, utc_offset: int, sleeps: List[Tuple[int, int]],
+                      ranking: Optional[List[Tuple[str, int]]]) -> bytes:
+        '''
+            Render the sleeping hours of the last 7 nights, or of the top sleepers if ranking is given, over the bedtimes.
+        '''
+        nights: List[int] = list(range(night - 6, night + 1))
+        # Night n begins on the evening of day n - 1
+        night_labels: List[str] = [datetime.fromtimestamp((n - 1) * DAY, timezone.utc).strftime("%m-%d") for n in nights]
+
+        points: List[Tuple[int, float]] = []
+        hours: List[float] = [0.0] * len(nights)
+        for start, duration in sleeps:
+            i: int = night_of(start, utc_offset) - nights[0]
+            if 0 <= i < len(nights):
+                points.append((i, bedtime_hour((start + utc_offset) % DAY)))
+                hours[i] += duration / 3600
 
-        now_time: datetime = datetime.now()
-        today: int = now_time.weekday()
+        if ranking is None:
+            return render_routine(title, night_labels, hours, night_labels, points)
 
-        morning_count: int = self._morning[gid]["group_count"]["daily"]["good_morning"]
-        night_count: int = self._morning[gid]["group_count"]["daily"]["good_night"]
+        return render_routine(title, [f"#{i}" for i in range(1, len(ranking) + 1)],
+                              [weekly_sleep / 3600 for _, weekly_sleep in ranking], night_labels, points)
 
-        if today == MONDAY:
-            uid: str = ""
-            hour: int = self.get_refresh_time("morning", "late_time")
+    def _history_stats(self, user: UserRecord, now_time: datetime) -> str:
+        '''
+            Statistics of the sleep history of the recent 7/30/90 days within the retention.
+        '''
+        msg: str = ""
+        now_ts: int = int(now_time.timestamp())
+        utc_offset: int = int(now_time.utcoffset().total_seconds())
 
-            if hour != -1 and is_later_oclock(now_time, hour):
-                uid = self._morning[gid]["group_count"]["weekly"]["sleeping_king"]
+        for days in (7, 30, 90):
+            if days > morning_config.morning_history_days:
+                break
 
-            return morning_count, night_count, uid if uid != "" else None
+            stats: Optional[SleepStats] = user.history.stats(now_ts, days, utc_offset)
+            if stats is None:
+                break
 
-        return morning_count, night_count, None
+            msg += f"\n近{days}天记录了{stats.nights}次睡眠，平均睡眠{format_duration(stats.average)}，" \
+                f"中位数{format_duration(stats.median)}，入睡时间波动±{stats.bedtime_std // 60}分钟"
+
+        if msg:
+            stats = user.history.stats(now_ts, morning_config.morning_history_days, utc_offset)
+            msg += f"\n已连续{stats.current_streak}晚记录睡眠，最长连续{stats.longest_streak}晚"
+
+        return msg
 
     # ------------------------------ Utils ------------------------------ #
-    def _save_data(self) -> None:
-        with open(self._morning_path, 'w', encoding='utf-8') as f:
-            json.dump(self._morning, f, ensure_ascii=False, indent=4, cls=DateTimeEncoder)
+    def _traced(self, command: str, gid: str, uid: str, now_time: datetime, outcome: str, msg: str, args: str = "") -> MessageSegment:
+        '''
+            Record the outcome of a handled command replying msg, return the reply.
+        '''
+        self._trace_command(command, gid, uid, now_time, outcome, args)
+
+        return MessageSegment.text(msg)
+
+    def _trace_command(self, command: str, gid: str, uid: str, now_time: datetime, outcome: str, args: str = "") -> None:
+        '''
+            Record the outcome of a handled command if tracing is enabled, along with its arguments other than the ids.
+        '''
+        if self._trace is not None:
+            self._trace.record(command, gid, uid, int(now_time.timestamp() * 1000), outcome, args)
+
+    def set_clock(self, clock: Callable[[], float]) -> None:
+        '''
+            Replace the source of the epoch time of now, e.g. by a virtual clock when replaying a trace or simulating.
+        '''
+        self._clock = clock
+
+    def set_trace(self, trace: Optional[TraceRecorder]) -> None:
+        '''
+            Replace the recorder of the handled commands, None to disable tracing.
+        '''
+        self._trace = trace
+
+    def _roll_group(self, gid: str, now_time: datetime, week: Optional[int] = None) -> GroupRecord:
+        '''
+            Roll the counters of a group over to the counting day and week of now_time before reading them.
+            Counts of a past day read as zero. The week of now_time may be given if it's known already.
+        '''
+        group: GroupRecord = self._morning[gid]
+        day_rolled: bool = group.counters.roll_day(self._day(gid, now_time))
+        week_rolled: bool = group.roll_week(week if week is not None else self._week(gid, now_time))
+
+        if day_rolled or week_rolled:
+            self._mark_dirty(gid, "group_count")
+            if day_rolled:
+                rollovers.inc("day")
+            if week_rolled:
+                rollovers.inc("week")
+
+        return group
+
+    def _roll_user(self, user: UserRecord, week: int) -> bool:
+        '''
+            Roll the weekly data of a user over to the week. Return True if it has been modified.
+        '''
+        if user.roll_week(week):
+            user_rollovers.inc()
+            return True
+
+        return False
+
+    def _rebase(self, group: GroupRecord, old: Tuple[int, int], new: Tuple[int, int]) -> bool:
+        '''
+            Re-stamp a group and its users from the counting day and week of now under the old boundaries
+            to the ones under the new boundaries, so that they keep counting in the same day and week.
+            Data of a past day or week is rolled over under the old boundaries first. Return True if it has been modified.
+        '''
+        if old == new:
+            return False
+
+        (old_day, old_week), (new_day, new_week) = old, new
+        group.counters.roll_day(old_day)
+        group.roll_week(old_week)
+        group.counters.day = new_day
+        group.counters.week = new_week
+
+        for user in group.users.values():
+            user.roll_week(old_week)
+            user.week = new_week
+
+        return True
+
+    def _rebase_changes(self, gid: str, group: GroupRecord, applied: int) -> bool:
+        '''
+            Rebase a group not loaded at the boundary changes on the changes not applied to it yet.
+        '''
+        rebased: bool = False
+        for epoch, old, new in self._boundary_changes[max(applied, self._rebased_changes):]:
+            rebased = self._rebase(group, old.periods(gid, epoch), new.periods(gid, epoch)) or rebased
+
+        return rebased
+
+    def _group_lock(self, gid: str) -> asyncio.Lock:
+        '''
+            Get the lock of a group, different groups proceed in parallel.
+        '''
+        lock: Optional[asyncio.Lock] = self._group_locks.get(gid)
+        if lock is None:
+            lock = self._group_locks[gid] = asyncio.Lock()
+
+        return lock
+
+    def _mark_dirty(self, gid: str, *keys: str) -> None:
+        '''
+            Mark users (or "group_count") of a group as modified, all of the group if no key is given.
+            They will be written back at the next flush.
+        '''
+        self._dirty.setdefault(gid, set()).update(keys if keys else self._morning[gid].keys())
+
+    def _record_event(self, kind: str, gid: str, uid: str, now_time: datetime) -> None:
+        '''
+            Record an accepted good-morning/night to be written into the storage at the next flush,
+            for the storages persisting the events to replay them on top of the persisted data.
+        '''
+        if not self._replaying:
+            self._events.append((kind, gid, uid, now_time))
+
+    async def _apply_event(self, kind: str, gid: str, uid: str, now_time: datetime) -> None:
+        '''
+            Apply a recorded event again on the loaded data, in the timezone of the group.
+        '''
+        now_time = now_time.astimezone(self.get_timezone(gid))
+        if kind == "morning":
+            await self._init_group_data(gid)
+            self._morning_and_update(gid, uid, now_time)
+        elif kind == "night":
+            await self._init_group_data(gid)
+            self._night_and_update(gid, uid, now_time)
+
+    async def _io(self, func: Callable[..., _T], *args: Any) -> _T:
+        '''
+            Run a blocking storage call in the writer thread.
+        '''
+        if self._writer_profile is not None:
+            return await asyncio.get_running_loop().run_in_executor(self._writer, self._writer_profile.runcall, func, *args)
+
+        return await asyncio.get_running_loop().run_in_executor(self._writer, func, *args)
+
+    async def load_data(self) -> None:
+        '''
+            Load all data into memory, replaying the events recorded after it. Called once at startup, the data stays resident afterwards.
+        '''
+        self._flush_lock = asyncio.Lock()
+        await self._load_data()
+
+        self._replaying = True
+        try:
+            events: List[Event] = await self._io(lambda: list(self._storage.pending_events()))
+            for kind, gid, uid, now_time in events:
+                await self._apply_event(kind, gid, uid, now_time)
+        finally:
+            self._replaying = False
+
+        if self._storage.version < DATA_VERSION:
+            await self._migrate_data()
+
+        if morning_config.morning_trace:
+            self._trace = TraceRecorder(
+                morning_config.morning_path / "trace", morning_config.morning_trace_max_bytes, morning_config.morning_trace_sessions)
+            async with self._flush_lock:
+                await self._begin_trace()
+
+    async def _migrate_data(self) -> None:
+        '''
+            Rewrite all groups persisted in an older data format. They have been decoded into the current format when loaded.
+        '''
+        version: int = self._storage.version
+
+        async for gid, group in self._walk_groups():
+            now_time: datetime = self._now(gid)
+            day: int = self._day(gid, now_time)
+            week: int = self._week(gid, now_time)
+
+            # Daily counts before format version 5 were kept up to date by the daily refreshing job, so they belong to today
+            if group.counters.day is None:
+                group.counters.day = day
+
+            # Weekly data before format version 4 was kept up to date by the weekly refreshing jobs, so it belongs to this week
+            for user in group.users.values():
+                if user.week is None:
+                    user.week = week
+
+            if group.counters.week is None:
+                group.counters.week = week
+                group.rebuild_ranking()
+
+        async with self._flush_lock:
+            await self._save_data()
+
+        logger.info(f"早晚安数据格式已由版本{version}更新至版本{DATA_VERSION}！")
+
+    async def flush(self) -> None:
+        '''
+            Write back the data if any group has been modified since the last flush.
+            Only one write runs at a time, modifications made meanwhile are coalesced into the next one.
+        '''
+        async with self._flush_lock:
+            if self._rebased_changes < len(self._boundary_changes):
+                await self._rebase_unloaded()
+
+            if self._dirty or self._events:
+                await self._save_data()
+
+            if self._trace is not None:
+                if self._trace.full:
+                    await self._begin_trace()
+                else:
+                    self._trace.flush()
+
+    async def close(self) -> None:
+        '''
+            Write back the modified data and release the storage.
+        '''
+        try:
+            await self.flush()
+            if self._trace is not None:
+                # The last snapshot ends the last session
+                async with self._flush_lock:
+                    await self._begin_trace(new_log=False)
+        finally:
+            self._trace = None
+            await self._io(self._storage.close)
+            self._writer.shutdown()
+
+    async def profile(self, seconds: float) -> Optional[Tuple[Path, pstats.Stats]]:
+        '''
+            Profile the handlers and the jobs for a while, along with the storage I/O in the writer thread.
+            The profiler may have been started by the caller already, to claim it before awaiting anything.
+            The stats are written into morning_path/profile as a pstats file. None if nothing has run meanwhile.
+        '''
+        # Since Python 3.12 only one profile may be enabled at a time, so the writer thread isn't profiled on its own there
+        writer_profile: Optional[cProfile.Profile] = cProfile.Profile() if sys.version_info < (3, 12) else None
+        profiler.start()
+        self._writer_profile = writer_profile
+
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            self._writer_profile = None
+            loop_profile: Optional[cProfile.Profile] = profiler.stop()
+
+        # The writer thread is profiled call by call, it's empty if no storage call has run
+        profiles: List[cProfile.Profile] = [
+            p for p in (loop_profile, writer_profile) if p is not None and (p is loop_profile or p.getstats())]
+        if not profiles:
+            return None
+
+        stats = pstats.Stats(profiles[0])
+        for p in profiles[1:]:
+            stats.add(p)
+
+        path: Path = morning_config.morning_path / "profile" / f"{int(self._clock())}.pstats"
+
+        def dump() -> None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            stats.dump_stats(path)
+
+        await self._io(dump)
+
+        return path, stats
+
+    async def snapshot(self) -> Dict[str, GroupData]:
+        '''
+            Copy all data, including the groups not loaded yet.
+        '''
+        return await self._io(self._complete_groups, {gid: group.to_dict() for gid, group in self._morning.items()})
+
+    def _complete_groups(self, groups: Dict[str, GroupData]) -> Dict[str, GroupData]:
+        '''
+            Add the groups not loaded yet into a copy of the loaded ones, run in the writer thread.
+            Groups not loaded are never modified, so they are read as they were when the copy was made.
+        '''
+        if self._storage.lazy:
+            for gid in self._storage.group_ids():
+                if gid not in groups:
+                    group: Optional[GroupData] = self._storage.load_group(gid)
+                    if group is not None:
+                        groups[gid] = group
+
+        return groups
+
+    async def _begin_trace(self, new_log: bool = True) -> None:
+        '''
+            Begin a trace session with a snapshot of the data, which ends the last session as well.
+            The copy of the data and the switch of the log are made at once, called with the flush lock held.
+        '''
+        # The config in effect is the one in config.json, which may have been edited by hand
+        self._load_config(force=True)
+        groups: Dict[str, GroupData] = {gid: group.to_dict() for gid, group in self._morning.items()}
+        session: str = self._trace.begin(int(self._clock() * 1000), new_log)
+        trace: TraceRecorder = self._trace
+
+        def write() -> None:
+            trace.write_snapshot(session, DATA_VERSION, self._config.dict(), self._complete_groups(groups))
+
+        await self._io(write)
+
+    async def _save_data(self) -> None:
+        '''
+            Hand over copies of the modified groups to the writer thread, so the event loop can keep modifying them.
+            Only the modified items are copied if the storage saves them alone.
+        '''
+        dirty: Dict[str, Set[str]] = self._dirty
+        events: List[Event] = self._events
+        self._dirty = dict()
+        self._events = []
+
+        start: float = perf_counter()
+        groups: Dict[str, GroupData] = {
+            gid: self._morning[gid].to_dict(keys if self._storage.partial else None) for gid, keys in dirty.items()}
+        try:
+            await self._io(self._storage.save, groups, dirty, events)
+        except BaseException:
+            # Nothing is lost if the write fails, e.g. on a full disk: it's retried along with what has been modified meanwhile
+            for gid, keys in dirty.items():
+                self._dirty.setdefault(gid, set()).update(keys)
+            self._events[:0] = events
+            raise
+
+        save_duration.observe(perf_counter() - start)
 
     def _save_config(self) -> None:
         with open(self._config_path, 'w', encoding='utf-8') as f:
-            json.dump(self._config, f, ensure_ascii=False, indent=4)
+            json.dump(self._config.dict(), f, ensure_ascii=False, indent=4)
 
-    def _load_data(self) -> None:
-        with open(self._morning_path, "r", encoding="utf-8") as f:
-            self._morning = json.load(f)
+        self._config_mtime = self._config_path.stat().st_mtime
+        self._apply_config(self._config)
 
-    def _load_config(self) -> None:
-        with open(self._config_path, "r", encoding="utf-8") as f:
-            self._config = json.load(f)
+    async def _load_data(self) -> None:
+        start: float = perf_counter()
+        data: Dict[str, GroupData] = await self._io(self._storage.load)
+        self._morning = {gid: GroupRecord.from_dict(group) for gid, group in data.items()}
+        load_duration.observe(perf_counter() - start)
 
-    def get_refresh_time(self, _time: str, key: str) -> int:
+    def _load_config(self, force: bool = False) -> None:
         '''
-            Get the time given the specific type(day or night) and key.
-            If group id is NOT in specific, return default config
+            Reload the config only if config.json has been modified since it was parsed last time.
+            Unless forced, config.json is checked at most once per CONFIG_CHECK_INTERVAL, so that commands don't stat it repeatedly.
+            An invalid config.json is rejected and the current config is kept.
+        '''
+        now: float = monotonic()
+        if not force and now - self._config_checked < CONFIG_CHECK_INTERVAL:
+            return
+
+        self._config_checked = now
+        try:
+            mtime: float = self._config_path.stat().st_mtime
+        except OSError as e:
+            logger.warning(f"config.json 读取失败，沿用当前配置: {e}")
+            return
+
+        if mtime == self._config_mtime:
+            return
+
+        self._config_mtime = mtime
+        try:
+            with open(self._config_path, "r", encoding="utf-8") as f:
+                self._apply_config(MorningConfig.parse_obj(json.load(f)))
+        except (ValueError, ValidationError) as e:
+            logger.warning(f"config.json 配置有误，已忽略此次修改: {e}")
+
+    def _apply_config(self, config: MorningConfig) -> None:
+        '''
+            Take a config in use after merging the overrides of groups and resolving the timezones.
+            Overrides are validated against the settings they are merged into, an invalid config raises and changes nothing.
+        '''
+        group_configs: Dict[str, MorningConfig] = {gid: config.for_group(gid) for gid in config.groups}
+        timezone: Optional[tzinfo] = get_timezone(config.timezone)
+        group_timezones: Dict[str, Optional[tzinfo]] = {
+            gid: get_timezone(group_config.timezone) for gid, group_config in group_configs.items()}
+
+        old: Boundaries = Boundaries(self._config, self._group_configs, self._timezone, self._group_timezones)
+        self._config = config
+        self._group_configs = group_configs
+        self._timezone = timezone
+        self._group_timezones = group_timezones
+
+        # The config in effect before the first one applied is only the default, which nothing has been stamped under
+        if self._config_applied:
+            self._rebase_groups(old, Boundaries(config, group_configs, timezone, group_timezones))
+        self._config_applied = True
+
+    def _rebase_groups(self, old: Boundaries, new: Boundaries) -> None:
+        '''
+            Rebase the groups whose counting days or weeks start elsewhere since a change of the config, e.g. of the timezone,
+            the earliest time of good-night or the latest time of good-morning. Otherwise the days and weeks the groups are
+            stamped with would no longer match the ones of now, and rollovers would be skipped or repeated.
+        '''
+        if all(old.of(gid) == new.of(gid) for gid in {"", *old.group_configs, *new.group_configs}):
+            return
+
+        epoch: float = self._clock()
+        for gid, group in self._morning.items():
+            if self._rebase(group, old.periods(gid, epoch), new.periods(gid, epoch)):
+                self._mark_dirty(gid)
+
+        # Groups not loaded are rebased in the background by the next flush, or when they are loaded before that
+        if self._storage.lazy:
+            self._boundary_changes.append((epoch, old, new))
+
+    def get_timezone(self, gid: str) -> Optional[tzinfo]:
+        '''
+            Get the timezone of a group, None for the local time of the bot.
+        '''
+        self._load_config()
+
+        return self._group_timezones.get(gid, self._timezone)
+
+    def _now(self, gid: str) -> datetime:
+        '''
+            Now in the timezone of a group. Always aware, so that the UTC offset of the group is known.
+        '''
+        tz: Optional[tzinfo] = self.get_timezone(gid)
+
+        return datetime.fromtimestamp(self._clock(), tz) if tz is not None else datetime.fromtimestamp(self._clock()).astimezone()
+
+    def _group_config(self, gid: str) -> MorningConfig:
+        '''
+            Get the config of a group, the global one if the group overrides nothing.
         '''
         self._load_config()
 
-        return self._config[_time][f"{_time}_intime"][key] if self._config[_time][f"{_time}_intime"]["enable"] else -1
+        return self._group_configs.get(gid, self._config)
+
+    def _get_setting(self, day_or_night: str, _setting: str, gid: Optional[str] = None) -> Union[IntimeSetting, IntervalSetting]:
+        '''
+            Get a setting given the type(morning or night) and its key, of a group if group id is given.
+        '''
+        config: MorningConfig = self._group_configs.get(gid, self._config) if gid is not None else self._config
+
+        return getattr(getattr(config, day_or_night), _setting)
 
-    # ------------------------------ Refreshing Jobs ------------------------------ #
-    def group_daily_refresh(self) -> None:
+    def _override_setting(self, gid: str, day_or_night: str, _setting: str) -> Union[IntimeSetting, IntervalSetting]:
         '''
-            Reset good-morning/night count of groups of yesterday at the earliest time of daily good-night.
+            Get the override of a setting of a group to be modified, copied from its current setting if absent.
         '''
-        self._load_data()
+        overrides: Dict[str, Union[IntimeSetting, IntervalSetting]] = getattr(
+            self._config.groups.setdefault(gid, GroupSettings()), day_or_night)
 
-        for gid in self._morning:
-            self._morning[gid]["group_count"]["daily"]["good_morning"] = 0
-            self._morning[gid]["group_count"]["daily"]["good_night"] = 0
+        if _setting not in overrides:
+            overrides[_setting] = self._get_setting(day_or_night, _setting, gid).copy()
 
-        self._save_data()
-        logger.info("每日早晚安已刷新！")
+        return overrides[_setting]
 
-    def weekly_night_refresh(self) -> None:
+    def _day(self, gid: str, now_time: datetime) -> int:
         '''
-            1. Refresh good-night count of last week at 0 A.M. every Monday.
-            2. Reset weekly good-night count at 0 A.M. every Monday.
+            Index of the counting day of a time in a group.
+            A counting day starts at the earliest time of good-night, or 0 A.M. if it's disabled.
         '''
-        self._load_data()
+        hour: int = self.get_refresh_time("night", "early_time", gid)
 
-        for gid in self._morning:
-            for uid, user_items in self._morning[gid].items():
-                # Remember to jump over the key "group_count"
-                if uid == "group_count":
-                    continue
+        return day_index(now_time, hour if hour != -1 else 0)
 
-                user_items["weekly"]["lastweek_night_count"] = user_items["weekly"]["weekly_night_count"]
-                user_items["weekly"]["weekly_night_count"] = 0
+    def _week(self, gid: str, now_time: datetime) -> int:
+        '''
+            Index of the week of a time in a group.
+            A week starts at the latest time of good-morning on Monday, or 0 A.M. if it's disabled.
+        '''
+        hour: int = self.get_refresh_time("morning", "late_time", gid)
 
-        self._save_data()
+        return week_index(now_time, hour if hour != -1 else 0)
 
-    def weekly_sleep_time_refresh(self) -> None:
+    def get_refresh_time(self, _time: str, key: str, gid: Optional[str] = None) -> int:
         '''
-            1. Refresh sleeping time & good-morning count of last week.
-            2. Refresh the sleeping king UID of each groups.
-            3. Reset weekly sleeping time & good-morning count.
+            Get the time given the specific type(day or night) and key.
+            If group id is NOT in specific, return default config
         '''
-        self._load_data()
+        self._load_config()
 
-        for gid in self._morning:
-            _max_sleep_time: List[int] = [0, 0, 0, 0]
-            _sleeping_king_uid: str = ""
+        intime: IntimeSetting = self._get_setting(_time, f"{_time}_intime", gid)
 
-            for uid, user_items in self._morning[gid].items():
-                # Remember to jump over the key "group_count"
-                if uid == "group_count":
+        return getattr(intime, key) if intime.enable else -1
+
+    # ------------------------------ Jobs ------------------------------ #
+    async def _walk_groups(self) -> AsyncIterator[Tuple[str, GroupRecord]]:
+        '''
+            Walk all groups, e.g. for migrating the data format. Loaded groups are marked modified after being visited,
+            groups not loaded yet are streamed from the storage and written back one by one.
+        '''
+        visited: List[str] = list(self._morning)
+        for gid in visited:
+            async with self._group_lock(gid):
+                yield gid, self._morning[gid]
+                self._mark_dirty(gid)
+
+        for gid in set(await self._io(self._storage.group_ids)).difference(visited):
+            async with self._group_lock(gid):
+                # The group may have been loaded by a handler meanwhile
+                if gid in self._morning:
+                    yield gid, self._morning[gid]
+                    self._mark_dirty(gid)
                     continue
 
-                user_items["weekly"]["lastweek_morning_count"] = user_items["weekly"]["weekly_morning_count"]
-                user_items["weekly"]["lastweek_sleep"] = user_items["weekly"]["weekly_sleep"]
+                group: Optional[GroupData] = await self._io(self._storage.load_group, gid)
+                if group is not None:
+                    record: GroupRecord = GroupRecord.from_dict(group)
+                    yield gid, record
+                    await self._io(self._storage.save, {gid: record.to_dict()}, {gid: set(record.keys())}, [])
+
+    def next_boundary(self, gid: str) -> float:
+        '''
+            Epoch time of the next start of a counting day or week in a group, where its data rolls over.
+        '''
+        now_time: datetime = self._now(gid)
+        day_hour: int = self.get_refresh_time("night", "early_time", gid)
+        week_hour: int = self.get_refresh_time("morning", "late_time", gid)
 
-                user_items["weekly"]["weekly_morning_count"] = 0
-                user_items["weekly"]["weekly_sleep"] = [0, 0, 0, 0]
+        return min(next_day_start(now_time, day_hour if day_hour != -1 else 0),
+                   next_week_start(now_time, week_hour if week_hour != -1 else 0)).timestamp()
 
-                # Compare sleeping times, day > hrs > mins > secs
-                if user_items["weekly"]["lastweek_sleep"] > _max_sleep_time:
-                    _max_sleep_time = user_items["weekly"]["lastweek_sleep"]
-                    _sleeping_king_uid = uid
+    async def roll_over(self, gid: str) -> Tuple[bool, bool]:
+        '''
+            Roll a group and all its users over to the counting day and week of now at once, as the refreshing jobs did,
+            rather than on their next access. Return whether the day and the week of the group rolled over.
+        '''
+        async with self._group_lock(gid):
+            await self._init_group_data(gid)
 
-            self._morning[gid]["group_count"]["weekly"]["sleeping_king"] = _sleeping_king_uid
+            now_time: datetime = self._now(gid)
+            week: int = self._week(gid, now_time)
+            group: GroupRecord = self._morning[gid]
+            day: Optional[int] = group.counters.day
+            last_week: Optional[int] = group.counters.week
+            self._roll_group(gid, now_time, week)
 
-        self._save_data()
-        logger.info("每周睡眠时间、每周早安已刷新！")
+            for uid, user in group.users.items():
+                if self._roll_user(user, week):
+                    self._mark_dirty(gid, uid)
 
-    def daily_scheduler(self, oclock: Optional[int] = None) -> None:
+            return group.counters.day != day, group.counters.week != last_week
+
+    async def _rebase_unloaded(self) -> None:
         '''
-            Run the scheduler for refreshing daily good-morning/night counts. Replace the existing scheduler.
+            Rebase the persisted groups not loaded on the boundary changes, and write them back one by one.
+            Called with the flush lock held.
         '''
-        if isinstance(oclock, int):
-            _oclock = oclock
-        else:
-            _oclock = self.get_refresh_time("night", "early_time")
-
-        if _oclock != -1:
-            scheduler.add_job(
-                self.group_daily_refresh,
-                "cron",
-                id="daily_scheduler",
-                replace_existing=True,
-                hour=_oclock,
-                minute=0,
-                misfire_grace_time=60
-            )
-
-    def weekly_night_scheduler(self) -> None:
-        '''
-            Run the schedulers for refreshing the weekly good-night time. Replace the existing schedulers.
-        '''
-        oclock: int = self.get_refresh_time("night", "late_time")
-        _night_early_oclock: int = self.get_refresh_time("night", "early_time")
-
-        if oclock != -1:
-            # From Monday to Sunday: 0~6
-            day_of_week: str = "0" if oclock < _night_early_oclock else "6"
-            scheduler.add_job(
-                func=self.weekly_night_refresh,
-                trigger="cron",
-                id=f"weekly_night_scheduler_default",
-                replace_existing=True,
-                hour=oclock,
-                minute=0,
-                day_of_week=day_of_week,
-                misfire_grace_time=60
-            )
-
-    def weekly_sleep_time_scheduler(self, oclock: Optional[int] = None) -> None:
-        '''
-            Run the scheduler for refreshing the weekly sleeping time. Replace the existing scheduler.
-        '''
-        if isinstance(oclock, int):
-            _oclock = oclock
-        else:
-            _oclock = self.get_refresh_time("morning", "late_time")
-
-        if _oclock != -1:
-            scheduler.add_job(
-                self.weekly_sleep_time_refresh,
-                "cron",
-                id="weekly_sleep_time_scheduler",
-                replace_existing=True,
-                hour=_oclock,
-                minute=0,
-                day_of_week="0",
-                misfire_grace_time=60
-            )
+        changes: int = len(self._boundary_changes)
+        for gid in await self._io(self._storage.group_ids):
+            async with self._group_lock(gid):
+                applied: int = self._rebased.get(gid, 0)
+                if gid in self._morning or applied >= changes:
+                    continue
+
+                group: Optional[GroupData] = await self._io(self._storage.load_group, gid)
+                if group is not None:
+                    record: GroupRecord = GroupRecord.from_dict(group)
+                    if self._rebase_changes(gid, record, applied):
+                        await self._io(self._storage.save, {gid: record.to_dict()}, {gid: set(record.keys())}, [])
+                    self._rebased[gid] = changes
+
+        self._rebased.clear()
+        self._rebased_changes = changes
+
+    async def _save_job(self) -> None:
+        profiled: bool = profiler.enter()
+        try:
+            await self.flush()
+        finally:
+            if profiled:
+                profiler.exit()
+
+    def save_scheduler(self) -> None:
+        '''
+            Run the scheduler for writing back the modified data periodically.
+        '''
+        scheduler.add_job(
+            self._save_job,
+            "interval",
+            id="morning_save_scheduler",
+            replace_existing=True,
+            seconds=morning_config.morning_save_interval,
+            misfire_grace_time=60
+        )
 
 
 morning_manager = MorningManager()
@@ -0,0 +1,142 @@
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+import statistics
+try:
+    import numpy as np
+except ModuleNotFoundError:
+    np = None
+
+DAY: int = 24 * 3600
+
+
+def night_of(epoch: int, utc_offset: int) -> int:
+    '''
+        Index of the night of a time. A night runs from noon to noon, so going to bed at 23:00 and at 01:00 is on the same night.
+        Night n begins on the evening of day n - 1 since 1970-01-01.
+    '''
+    return (epoch + utc_offset + DAY // 2) // DAY
+
+
+class SleepStats(NamedTuple):
+    nights: int
+    # Average and median sleeping time in seconds
+    average: int
+    median: int
+    # Standard deviation of the time of going to bed in seconds
+    bedtime_std: int
+    # Consecutive nights with sleep ending last night, and the longest ones
+    current_streak: int
+    longest_streak: int
+
+
+class SleepHistory:
+    '''
+        Completed night-to-morning sleeps of a user, as columns of 64-bit integers ordered by time:
+        epoch seconds of going to bed and sleeping time in seconds.
+    '''
+    __slots__ = ("start", "duration")
+
+    def __init__(self):
+        self.start: array = array("q")
+        self.duration: array = array("q")
+
+    def __len__(self) -> int:
+        return len(self.start)
+
+    @classmethod
+    def from_dict(cls, items: Optional[Dict[str, List[int]]]) -> "SleepHistory":
+        history = cls()
+        if items:
+            history.start.fromlist(items["start"])
+            history.duration.fromlist(items["duration"])
+
+        return history
+
+    def to_dict(self) -> Dict[str, List[int]]:
+        return {
+            "start": self.start.tolist(),
+            "duration": self.duration.tolist()
+        }
+
+    def append(self, start: int, duration: int, retention: int) -> None:
+        '''
+            Record a sleep and drop the sleeps older than the retention in seconds.
+        '''
+        self.start.append(start)
+        self.duration.append(duration)
+
+        expired: int = bisect_left(self.start, start - retention)
+        if expired:
+            del self.start[:expired]
+            del self.duration[:expired]
+
+    def since(self, start: int) -> List[Tuple[int, int]]:
+        '''
+            Sleeps going to bed since a time, as (start, duration).
+        '''
+        first: int = bisect_left(self.start, start)
+
+        return list(zip(self.start[first:], self.duration[first:]))
+
+    def stats(self, now_ts: int, days: int, utc_offset: int) -> Optional[SleepStats]:
+        '''
+            Statistics of the sleeps going to bed in the last days, None if there is none.
+            - utc_offset: offset in seconds of the local time, for the time of going to bed and the nights
+        '''
+        first: int = bisect_left(self.start, now_ts - days * DAY)
+        if first == len(self.start):
+            return None
+
+        # Shift the times so that nights start at 0, see night_of()
+        shift: int = utc_offset + DAY // 2
+        last_night: int = night_of(now_ts, utc_offset) - 1
+
+        if np is not None:
+            return self._stats_numpy(first, shift, last_night)
+
+        starts: List[int] = [t + shift for t in self.start[first:]]
+        durations: List[int] = self.duration[first:].tolist()
+        nights: List[int] = sorted(set(t // DAY for t in starts))
+
+        return SleepStats(
+            len(durations),
+            int(statistics.fmean(durations)),
+            int(statistics.median(durations)),
+            int(statistics.pstdev([t % DAY for t in starts])),
+            *self._streaks(nights, last_night)
+        )
+
+    def _stats_numpy(self, first: int, shift: int, last_night: int) -> SleepStats:
+        starts: Any = np.frombuffer(self.start, dtype=np.int64)[first:] + shift
+        durations: Any = np.frombuffer(self.duration, dtype=np.int64)[first:]
+        nights: Any = np.unique(starts // DAY)
+
+        # Lengths of the runs of consecutive nights
+        breaks: Any = np.flatnonzero(np.diff(nights) != 1) + 1
+        runs: Any = np.diff(np.concatenate(([0], breaks, [nights.size])))
+
+        return SleepStats(
+            int(durations.size),
+            int(durations.mean()),
+            int(np.median(durations)),
+            int((starts % DAY).std()),
+            int(runs[-1]) if nights[-1] >= last_night else 0,
+            int(runs.max())
+        )
+
+    @staticmethod
+    def _streaks(nights: List[int], last_night: int) -> List[int]:
+        '''
+            Current and longest runs of consecutive nights, given the sorted distinct nights.
+        '''
+        longest: int = 0
+        run: int = 0
+        for i, night in enumerate(nights):
+            run = run + 1 if i > 0 and night == nights[i - 1] + 1 else 1
+            longest = max(longest, run)
+
+        # The current run counts only if it reaches last night, or tonight if already slept
+        current: int = run if nights and nights[-1] >= last_night else 0
+
+        return [current, longest]
@@ -0,0 +1,96 @@
+import asyncio
+from collections import OrderedDict
+from time import monotonic, perf_counter
+from typing import Any, Dict, Tuple
+from nonebot.adapters.onebot.v11 import Bot
+from .config import morning_config
+from .metrics import member_info_duration
+
+MemberInfo = Dict[str, Any]
+
+
+class MemberInfoCache:
+    '''
+        Bounded LRU cache with TTL of get_group_member_info, keyed by (gid, uid).
+        Concurrent lookups of the same member share one API call, they are counted as joined rather than hits.
+    '''
+
+    def __init__(self, maxsize: int, ttl: int):
+        self._maxsize: int = maxsize
+        self._ttl: int = ttl
+        # (gid, uid) -> (expiring time, member info)
+        self._cache: "OrderedDict[Tuple[int, int], Tuple[float, MemberInfo]]" = OrderedDict()
+        self._pending: Dict[Tuple[int, int], "asyncio.Future[MemberInfo]"] = dict()
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.joined: int = 0
+
+    async def get(self, bot: Bot, gid: int, uid: int) -> MemberInfo:
+        '''
+            Get the member info from the cache, or call the API if it's missing or expired.
+        '''
+        key: Tuple[int, int] = (gid, uid)
+        item = self._cache.get(key)
+
+        if item is not None and item[0] > monotonic():
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+        # Wait for the lookup of the same member in flight
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.joined += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # The caller making the lookup has been cancelled rather than this one, so look it up again
+                if not pending.cancelled():
+                    raise
+
+                return await self.get(bot, gid, uid)
+
+        self.misses += 1
+        future: "asyncio.Future[MemberInfo]" = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+
+        start: float = perf_counter()
+        try:
+            mem_info: MemberInfo = await bot.call_api("get_group_member_info", group_id=gid, user_id=uid)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case no one else is waiting
+            future.exception()
+            raise
+        else:
+            member_info_duration.observe(perf_counter() - start)
+            # Not cached if the member has been invalidated meanwhile, the info may be older than the change
+            if self._pending.get(key) is future:
+                self._put(key, mem_info)
+            future.set_result(mem_info)
+            return mem_info
+        finally:
+            if self._pending.get(key) is future:
+                del self._pending[key]
+
+    def invalidate(self, gid: int, uid: int) -> None:
+        '''
+            Drop the cached member info, e.g. when the member changed the group card or left the group.
+            A lookup in flight is dropped as well, so its result isn't cached and later lookups call the API again.
+        '''
+        self._cache.pop((gid, uid), None)
+        self._pending.pop((gid, uid), None)
+
+    def _put(self, key: Tuple[int, int], mem_info: MemberInfo) -> None:
+        self._cache[key] = (monotonic() + self._ttl, mem_info)
+        self._cache.move_to_end(key)
+
+        while len(self._cache) > self._maxsize:
+            self._cache.popitem(last=False)
+
+
+member_cache = MemberInfoCache(morning_config.morning_member_cache_size, morning_config.morning_member_cache_ttl)
@@ -0,0 +1,150 @@
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+Labels = Tuple[str, ...]
+Metric = Union["Counter", "Histogram", "Collected"]
+
+# Upper bounds in seconds of the latency buckets, from sub-millisecond memory work to slow API calls and saves
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs: List[str] = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    '''
+        Monotonic count, one per combination of label values.
+    '''
+    type: str = "counter"
+
+    def __init__(self, name: str, help: str, labels: Labels = ()):
+        self.name: str = name
+        self.help: str = help
+        self.labels: Labels = labels
+        self._values: Dict[Labels, float] = dict()
+
+    def inc(self, *labels: str, value: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + value
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, labels)} {value}" for labels, value in self._values.items()]
+
+
+class Histogram:
+    '''
+        Distribution of durations in seconds over fixed buckets, one per combination of label values.
+        An observation is a bisection and two additions, cheap enough for every handled command.
+    '''
+    type: str = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Labels = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name: str = name
+        self.help: str = help
+        self.labels: Labels = labels
+        self._buckets: Tuple[float, ...] = buckets
+        # Labels -> observations per bucket, the last one beyond all bounds, and their sum
+        self._counts: Dict[Labels, List[int]] = dict()
+        self._sums: Dict[Labels, float] = dict()
+
+    def observe(self, seconds: float, *labels: str) -> None:
+        counts: Optional[List[int]] = self._counts.get(labels)
+        if counts is None:
+            counts = self._counts[labels] = [0] * (len(self._buckets) + 1)
+            self._sums[labels] = 0.0
+
+        counts[bisect_left(self._buckets, seconds)] += 1
+        self._sums[labels] += seconds
+
+    def samples(self) -> List[str]:
+        lines: List[str] = []
+        for labels, counts in self._counts.items():
+            cumulative: int = 0
+            for bound, count in zip(self._buckets, counts):
+                cumulative += count
+                bucket: str = _format_labels(self.labels, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+
+            cumulative += counts[-1]
+            bucket = _format_labels(self.labels, labels, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{bucket} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, labels)} {self._sums[labels]}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, labels)} {cumulative}")
+
+        return lines
+
+
+class Collected:
+    '''
+        Value read from elsewhere when the metrics are rendered, e.g. the hits of a cache counted by the cache itself,
+        so that nothing is added to the hot path.
+    '''
+
+    def __init__(self, name: str, help: str, type: str, labels: Labels, collect: Callable[[], Dict[Labels, float]]):
+        self.name: str = name
+        self.help: str = help
+        self.type: str = type
+        self.labels: Labels = labels
+        self._collect: Callable[[], Dict[Labels, float]] = collect
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labels, labels)} {value}" for labels, value in self._collect().items()]
+
+
+class MetricsRegistry:
+    '''
+        Metrics of the plugin, rendered in the Prometheus text exposition format.
+    '''
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = dict()
+
+    def counter(self, name: str, help: str, labels: Labels = ()) -> Counter:
+        return self._register(Counter(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Labels = ()) -> Histogram:
+        return self._register(Histogram(name, help, labels))
+
+    def collect(self, name: str, help: str, type: str, collect: Callable[[], Dict[Labels, float]], labels: Labels = ()) -> Collected:
+        return self._register(Collected(name, help, type, labels, collect))
+
+    def render(self, buckets: bool = True) -> str:
+        '''
+            Render all metrics. Without buckets, histograms only keep their sums and counts, short enough for a chat message.
+        '''
+        lines: List[str] = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(sample for sample in metric.samples() if buckets or not sample.startswith(f"{metric.name}_bucket"))
+
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+
+        return metric
+
+
+metrics = MetricsRegistry()
+
+command_duration: Histogram = metrics.histogram(
+    "morning_command_duration_seconds", "Time to handle a command, including the calls of bot APIs", ("command",))
+load_duration: Histogram = metrics.histogram(
+    "morning_load_duration_seconds", "Time to load the data from the storage at startup")
+save_duration: Histogram = metrics.histogram(
+    "morning_save_duration_seconds", "Time to write back the modified data to the storage")
+member_info_duration: Histogram = metrics.histogram(
+    "morning_member_info_duration_seconds", "Time of the calls of get_group_member_info missing the cache")
+rollovers: Counter = metrics.counter(
+    "morning_rollovers_total", "Counting days and weeks of groups rolled over", ("period",))
+user_rollovers: Counter = metrics.counter(
+    "morning_user_rollovers_total", "Weekly data of users rolled over")
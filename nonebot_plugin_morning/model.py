@@ -0,0 +1,368 @@
+from bisect import bisect_left, insort
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from .history import SleepHistory
+
+# Version of the persisted data format:
+# 1: times as "%Y-%m-%d %H:%M:%S" strings, 0 if no data
+# 2: times as epoch seconds, null if no data
+# 3: sleeping times as seconds instead of lists of days/hrs/mins/secs
+# 4: weekly data stamped with the week it belongs to, rolled over lazily
+# 5: daily group counters stamped with the day they belong to, reset lazily
+DATA_VERSION: int = 5
+
+# Time of a good-morning/night in epoch seconds, None if no data
+TimeValue = Optional[int]
+
+
+def decode_time(value: Any) -> TimeValue:
+    '''
+        Decode a persisted time, accepting the strings and the 0 for no data of format version 1.
+    '''
+    if isinstance(value, str):
+        return int(datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp())
+
+    return value if value else None
+
+
+def decode_duration(value: Any) -> int:
+    '''
+        Decode a persisted duration in seconds, accepting the list of days/hrs/mins/secs of format version 1 and 2.
+    '''
+    if isinstance(value, list):
+        days, hours, minutes, seconds = value
+        return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+    return value
+
+
+class UserRecord:
+    '''
+        Routine data of a user in a group, codec of the user item of morning.json
+    '''
+    __slots__ = (
+        "morning_time",
+        "night_time",
+        "weekly_morning_count",
+        "weekly_night_count",
+        "weekly_sleep",
+        "lastweek_morning_count",
+        "lastweek_night_count",
+        "lastweek_sleep",
+        "lastweek_earliest_morning_time",
+        "lastweek_latest_night_time",
+        "morning_count",
+        "night_count",
+        "total_sleep",
+        "week",
+        "history"
+    )
+
+    def __init__(self, night_time: TimeValue = None):
+        # Daily good-morning/night time
+        self.morning_time: TimeValue = None
+        self.night_time: TimeValue = night_time
+        # Week the weekly data belongs to, None if not stamped yet (data before format version 4)
+        self.week: Optional[int] = None
+        # Weekly good-morning count, RESET in a new week
+        self.weekly_morning_count: int = 0
+        # Weekly good-night count, RESET in a new week
+        self.weekly_night_count: int = 0
+        # Weekly sleeping time in seconds, RESET in a new week
+        self.weekly_sleep: int = 0
+        # Good-morning count of last week, REFRESH in a new week
+        self.lastweek_morning_count: int = 0
+        # Good-night count of last week, REFRESH in a new week
+        self.lastweek_night_count: int = 0
+        # Sleeping time of last week in seconds, REFRESH in a new week
+        self.lastweek_sleep: int = 0
+        # Earliest good-morning time of last week, REFRESH at a new daily good-morning time in
+        self.lastweek_earliest_morning_time: TimeValue = None
+        # Latest good-night time of last week, REFRESH at a new daily good-night time in
+        self.lastweek_latest_night_time: TimeValue = None
+        # Total good-morning/night count, never RESET
+        self.morning_count: int = 0
+        self.night_count: int = 0
+        # Total sleeping time in seconds, REFRESH at every valid good-morning
+        self.total_sleep: int = 0
+        # Sleeps of the recent days, APPENDED at every valid good-morning
+        self.history: SleepHistory = SleepHistory()
+
+    @classmethod
+    def from_dict(cls, items: Dict[str, Dict[str, Any]]) -> "UserRecord":
+        daily: Dict[str, Any] = items["daily"]
+        weekly: Dict[str, Any] = items["weekly"]
+        total: Dict[str, Any] = items["total"]
+
+        record = cls(decode_time(daily["night_time"]))
+        record.morning_time = decode_time(daily.get("morning_time"))
+        record.weekly_morning_count = weekly["weekly_morning_count"]
+        record.weekly_night_count = weekly["weekly_night_count"]
+        record.weekly_sleep = decode_duration(weekly["weekly_sleep"])
+        record.lastweek_morning_count = weekly["lastweek_morning_count"]
+        record.lastweek_night_count = weekly["lastweek_night_count"]
+        record.lastweek_sleep = decode_duration(weekly["lastweek_sleep"])
+        record.lastweek_earliest_morning_time = decode_time(weekly["lastweek_earliest_morning_time"])
+        record.lastweek_latest_night_time = decode_time(weekly["lastweek_latest_night_time"])
+        record.week = weekly.get("week")
+        record.morning_count = total["morning_count"]
+        record.night_count = total["night_count"]
+        record.total_sleep = decode_duration(total["total_sleep"])
+        record.history = SleepHistory.from_dict(items.get("history"))
+
+        return record
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            "daily": {
+                "morning_time": self.morning_time,
+                "night_time": self.night_time
+            },
+            "weekly": {
+                "week": self.week,
+                "weekly_morning_count": self.weekly_morning_count,
+                "weekly_night_count": self.weekly_night_count,
+                "weekly_sleep": self.weekly_sleep,
+                "lastweek_morning_count": self.lastweek_morning_count,
+                "lastweek_night_count": self.lastweek_night_count,
+                "lastweek_sleep": self.lastweek_sleep,
+                "lastweek_earliest_morning_time": self.lastweek_earliest_morning_time,
+                "lastweek_latest_night_time": self.lastweek_latest_night_time
+            },
+            "total": {
+                "morning_count": self.morning_count,
+                "night_count": self.night_count,
+                "total_sleep": self.total_sleep
+            },
+            "history": self.history.to_dict()
+        }
+
+    def roll_week(self, week: int) -> bool:
+        '''
+            Roll the weekly data over into last week's if it belongs to an earlier week.
+            Return True if the record has been modified.
+        '''
+        if self.week is None:
+            self.week = week
+            return True
+
+        if self.week >= week:
+            return False
+
+        # Nothing was recorded last week if the data is older
+        last_week: bool = self.week == week - 1
+        self.lastweek_morning_count = self.weekly_morning_count if last_week else 0
+        self.lastweek_night_count = self.weekly_night_count if last_week else 0
+        self.lastweek_sleep = self.weekly_sleep if last_week else 0
+
+        self.weekly_morning_count = 0
+        self.weekly_night_count = 0
+        self.weekly_sleep = 0
+        self.week = week
+
+        return True
+
+
+class GroupCounters:
+    '''
+        Counters of a group, codec of the "group_count" item of morning.json
+    '''
+    __slots__ = ("day", "good_morning", "good_night", "early_risers", "late_sleepers", "sleeping_king", "week")
+
+    def __init__(self):
+        # Counting day the daily counts belong to, None if not stamped yet (data before format version 5)
+        self.day: Optional[int] = None
+        # Daily good-morning count of groups, RESET in a new counting day
+        self.good_morning: int = 0
+        # Daily good-night count of groups, RESET in a new counting day
+        self.good_night: int = 0
+        # First users saying good-morning and last users saying good-night with the times, earliest first, RESET in a new counting day
+        self.early_risers: List[Tuple[str, int]] = []
+        self.late_sleepers: List[Tuple[str, int]] = []
+        # Sleeping king of group of last week, REFRESH in a new week
+        self.sleeping_king: str = ""
+        # Week the weekly data belongs to, None if not stamped yet (data before format version 4)
+        self.week: Optional[int] = None
+
+    @classmethod
+    def from_dict(cls, items: Dict[str, Dict[str, Any]]) -> "GroupCounters":
+        counters = cls()
+        counters.day = items["daily"].get("day")
+        counters.good_morning = items["daily"]["good_morning"]
+        counters.good_night = items["daily"]["good_night"]
+        counters.early_risers = [(uid, t) for uid, t in items["daily"].get("early_risers", [])]
+        counters.late_sleepers = [(uid, t) for uid, t in items["daily"].get("late_sleepers", [])]
+        counters.sleeping_king = items["weekly"]["sleeping_king"]
+        counters.week = items["weekly"].get("week")
+
+        return counters
+
+    def to_dict(self) -> Dict[str, Dict[str, Any]]:
+        return {
+            "daily": {
+                "day": self.day,
+                "good_morning": self.good_morning,
+                "good_night": self.good_night,
+                "early_risers": [list(item) for item in self.early_risers],
+                "late_sleepers": [list(item) for item in self.late_sleepers]
+            },
+            "weekly": {
+                "week": self.week,
+                "sleeping_king": self.sleeping_king
+            }
+        }
+
+    def roll_day(self, day: int) -> bool:
+        '''
+            Reset the daily counts if they belong to another counting day.
+            Return True if the counters have been modified.
+        '''
+        if self.day == day:
+            return False
+
+        if self.day is not None:
+            self.good_morning = 0
+            self.good_night = 0
+            self.early_risers = []
+            self.late_sleepers = []
+
+        self.day = day
+
+        return True
+
+    def add_riser(self, uid: str, now_ts: int, size: int) -> None:
+        '''
+            Put a good-morning on the board of the earliest risers if it's not full. Good-mornings come in order of time.
+        '''
+        if len(self.early_risers) < size and all(item[0] != uid for item in self.early_risers):
+            self.early_risers.append((uid, now_ts))
+
+    def add_sleeper(self, uid: str, now_ts: int, size: int) -> None:
+        '''
+            Put a good-night on the board of the latest sleepers, dropping the earliest one if it's full.
+            Good-nights come in order of time, so the new one is always the latest.
+        '''
+        self.late_sleepers = [item for item in self.late_sleepers if item[0] != uid]
+        self.late_sleepers.append((uid, now_ts))
+        if len(self.late_sleepers) > size:
+            del self.late_sleepers[0]
+
+
+class SleepRanking:
+    '''
+        Users of a group ranked by their sleeping time of this week, longest first.
+        Derived from the users when a group is loaded, never persisted.
+    '''
+    __slots__ = ("_keys", "_sleep")
+
+    def __init__(self):
+        # Sorted (-weekly sleeping time, uid)
+        self._keys: List[Tuple[int, str]] = []
+        self._sleep: Dict[str, int] = dict()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def update(self, uid: str, weekly_sleep: int) -> None:
+        '''
+            Move a user to the place of the new weekly sleeping time.
+        '''
+        old: Optional[int] = self._sleep.get(uid)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, (-old, uid))]
+
+        insort(self._keys, (-weekly_sleep, uid))
+        self._sleep[uid] = weekly_sleep
+
+    def top(self, n: int) -> List[Tuple[str, int]]:
+        '''
+            Top-N users and their weekly sleeping times.
+        '''
+        return [(uid, -neg_sleep) for neg_sleep, uid in self._keys[:n]]
+
+    def rank(self, uid: str) -> Optional[int]:
+        '''
+            Rank of a user starting from 1, None if the user hasn't slept this week.
+        '''
+        weekly_sleep: Optional[int] = self._sleep.get(uid)
+        if weekly_sleep is None:
+            return None
+
+        return bisect_left(self._keys, (-weekly_sleep, uid)) + 1
+
+    def clear(self) -> None:
+        self._keys.clear()
+        self._sleep.clear()
+
+
+class GroupRecord:
+    '''
+        Counters and users of a group, codec of a group item of morning.json
+    '''
+    __slots__ = ("counters", "users", "ranking")
+
+    def __init__(self):
+        self.counters: GroupCounters = GroupCounters()
+        self.users: Dict[str, UserRecord] = dict()
+        self.ranking: SleepRanking = SleepRanking()
+
+    @classmethod
+    def from_dict(cls, items: Dict[str, Dict[str, Dict[str, Any]]]) -> "GroupRecord":
+        group = cls()
+        for key, value in items.items():
+            if key == "group_count":
+                group.counters = GroupCounters.from_dict(value)
+            else:
+                group.users[key] = UserRecord.from_dict(value)
+
+        group.rebuild_ranking()
+
+        return group
+
+    def to_dict(self, keys: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        '''
+            Items of the group, only the ones of the given keys ("group_count" or uids) if any.
+        '''
+        if keys is not None:
+            return {key: self.counters.to_dict() if key == "group_count" else self.users[key].to_dict() for key in keys}
+
+        items: Dict[str, Dict[str, Dict[str, Any]]] = {"group_count": self.counters.to_dict()}
+        for uid, user in self.users.items():
+            items[uid] = user.to_dict()
+
+        return items
+
+    def rebuild_ranking(self) -> None:
+        '''
+            Rank the users who have slept in the week of the group.
+        '''
+        self.ranking.clear()
+        for uid, user in self.users.items():
+            if user.week == self.counters.week and user.weekly_sleep > 0:
+                self.ranking.update(uid, user.weekly_sleep)
+
+    def roll_week(self, week: int) -> bool:
+        '''
+            Crown the sleeping king of last week if the weekly data belongs to an earlier week.
+            Return True if the counters have been modified.
+        '''
+        counters: GroupCounters = self.counters
+        if counters.week is None:
+            counters.week = week
+            return True
+
+        if counters.week >= week:
+            return False
+
+        king: List[Tuple[str, int]] = self.ranking.top(1)
+        counters.sleeping_king = king[0][0] if king and counters.week == week - 1 else ""
+        counters.week = week
+        self.ranking.clear()
+
+        return True
+
+    def keys(self) -> List[str]:
+        '''
+            Keys of the group item in morning.json: "group_count" and uids.
+        '''
+        return ["group_count", *self.users]
@@ -0,0 +1,71 @@
+import cProfile
+from typing import Optional
+
+
+class HandlerProfiler:
+    '''
+        cProfile of the event loop thread, enabled only while a handler or a job of the plugin is running.
+        Concurrent handlers share it: it's enabled by the first one entering and disabled by the last one leaving,
+        so the tasks they wait on meanwhile are profiled as well. While not started, enter() is a single comparison.
+    '''
+
+    def __init__(self):
+        self._profile: Optional[cProfile.Profile] = None
+        # Handlers and jobs running, and whether the profile has been enabled at all
+        self._depth: int = 0
+        self._used: bool = False
+
+    @property
+    def running(self) -> bool:
+        return self._profile is not None
+
+    def start(self) -> bool:
+        '''
+            Start profiling. Return False if it's running already, checked and started at once so that only one caller may start it.
+        '''
+        if self._profile is not None:
+            return False
+
+        self._profile = cProfile.Profile()
+        self._depth = 0
+        self._used = False
+
+        return True
+
+    def enter(self) -> bool:
+        '''
+            A handler or a job begins. Return True if it's profiled, then exit() must be called once it ends.
+        '''
+        if self._profile is None:
+            return False
+
+        self._depth += 1
+        if self._depth == 1:
+            self._profile.enable()
+            self._used = True
+
+        return True
+
+    def exit(self) -> None:
+        # The profiling may have been stopped while the handler was running
+        if self._profile is None:
+            return
+
+        self._depth -= 1
+        if self._depth == 0:
+            self._profile.disable()
+
+    def stop(self) -> Optional[cProfile.Profile]:
+        '''
+            Stop profiling, return the profile or None if nothing has run meanwhile.
+        '''
+        profile: Optional[cProfile.Profile] = self._profile
+        if profile is not None and self._depth > 0:
+            profile.disable()
+
+        self._profile = None
+
+        return profile if self._used else None
+
+
+profiler = HandlerProfiler()
@@ -0,0 +1,261 @@
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional, Tuple
+from .config import morning_config
+try:
+    from PIL import Image, ImageDraw
+except ModuleNotFoundError:
+    Image = None
+
+# (gid, uid or "" for the group, data version)
+RenderKey = Tuple[str, str, Hashable]
+
+WIDTH: int = 640
+PANEL_HEIGHT: int = 240
+MARGIN: int = 40
+BACKGROUND: Tuple[int, int, int] = (255, 255, 255)
+GRID: Tuple[int, int, int] = (225, 225, 225)
+TEXT: Tuple[int, int, int] = (60, 60, 60)
+BAR: Tuple[int, int, int] = (99, 140, 219)
+POINT: Tuple[int, int, int] = (230, 126, 80)
+
+# Range of the bedtime panel: 18:00 to 06:00 of the next day
+BEDTIME_FROM: int = 18
+BEDTIME_TO: int = 30
+
+
+def chart_available() -> bool:
+    return Image is not None
+
+
+def bedtime_hour(time_of_day: int) -> float:
+    '''
+        Hour of going to bed on the bedtime axis, the early morning counts as the night before.
+    '''
+    hour: float = time_of_day / 3600
+    return hour + 24 if hour < 12 else hour
+
+
+def render_routine(title: str, bar_labels: List[str], bars: List[float], point_labels: List[str],
+                   points: List[Tuple[int, float]]) -> bytes:
+    '''
+        Draw a bar chart of sleeping hours over a scatter of bedtimes, return the PNG bytes.
+        - bars: sleeping hours of each bar label
+        - points: index of the point label and bedtime hour in [BEDTIME_FROM, BEDTIME_TO]
+    '''
+    image = Image.new("RGB", (WIDTH, PANEL_HEIGHT * 2 + MARGIN), BACKGROUND)
+    draw = ImageDraw.Draw(image)
+    draw.text((MARGIN, MARGIN // 3), title, fill=TEXT)
+
+    # Sleeping hours
+    top: int = MARGIN
+    bottom: int = PANEL_HEIGHT
+    max_hours: float = max([12.0, *bars])
+    slot: float = (WIDTH - 2 * MARGIN) / max(len(bars), 1)
+
+    for hours in range(0, int(max_hours) + 1, 4):
+        y: float = bottom - (bottom - top) * hours / max_hours
+        draw.line((MARGIN, y, WIDTH - MARGIN, y), fill=GRID)
+        draw.text((MARGIN - 24, y - 6), f"{hours}h", fill=TEXT)
+
+    for i, (label, hours) in enumerate(zip(bar_labels, bars)):
+        x0: float = MARGIN + slot * i + slot * 0.2
+        x1: float = MARGIN + slot * (i + 1) - slot * 0.2
+        draw.rectangle((x0, bottom - (bottom - top) * hours / max_hours, x1, bottom), fill=BAR)
+        draw.text((x0, bottom + 4), label, fill=TEXT)
+
+    # Bedtimes
+    top = PANEL_HEIGHT + MARGIN
+    bottom = PANEL_HEIGHT * 2
+    span: int = BEDTIME_TO - BEDTIME_FROM
+    slot = (WIDTH - 2 * MARGIN) / max(len(point_labels), 1)
+
+    for hour in range(BEDTIME_FROM, BEDTIME_TO + 1, 3):
+        y = top + (bottom - top) * (hour - BEDTIME_FROM) / span
+        draw.line((MARGIN, y, WIDTH - MARGIN, y), fill=GRID)
+        draw.text((MARGIN - 36, y - 6), f"{hour % 24:02d}:00", fill=TEXT)
+
+    for i, label in enumerate(point_labels):
+        draw.text((MARGIN + slot * i + slot * 0.2, bottom + 4), label, fill=TEXT)
+
+    for i, hour in points:
+        hour = min(max(hour, BEDTIME_FROM), BEDTIME_TO)
+        x = MARGIN + slot * (i + 0.5)
+        y = top + (bottom - top) * (hour - BEDTIME_FROM) / span
+        draw.ellipse((x - 4, y - 4, x + 4, y + 4), fill=POINT)
+
+    buffer = BytesIO()
+    image.save(buffer, format="PNG")
+
+    return buffer.getvalue()
+
+
+class RenderCache:
+    '''
+        Bounded LRU of rendered charts keyed by (gid, uid, data version). The data version changes only
+        when the owner of the chart says good-morning/night, so a chart is rendered once per version.
+        Evicted charts spill to disk and are read back on a miss. Only the latest version of a chart is kept,
+        on disk at most spill_size charts, the ones spilled earliest are deleted first.
+        Concurrent lookups of the same chart share one rendering, they are counted as joined rather than hits.
+    '''
+
+    def __init__(self, maxsize: int, spill_dir: Path, spill_size: int):
+        self._maxsize: int = maxsize
+        self._spill_dir: Path = spill_dir
+        self._spill_size: int = spill_size
+        self._cache: "OrderedDict[RenderKey, bytes]" = OrderedDict()
+        # Cached version of each chart
+        self._versions: Dict[Tuple[str, str], Hashable] = dict()
+        self._pending: Dict[RenderKey, "asyncio.Future[bytes]"] = dict()
+        # (gid, uid) -> file of the spilled chart, in order of spilling. Files left by the last run are indexed on first use.
+        # Disk access runs in the thread pool, guarded by the lock
+        self._spilled: "OrderedDict[Tuple[str, str], Path]" = OrderedDict()
+        self._indexed: bool = False
+        self._disk_lock: threading.Lock = threading.Lock()
+
+        self.hits: int = 0
+        self.misses: int = 0
+        self.joined: int = 0
+
+    async def get(self, key: RenderKey, render: Callable[[], Awaitable[bytes]]) -> bytes:
+        '''
+            Get the chart from the cache, or render it if it's missing in memory and on disk.
+            The data of the chart is only gathered by render() on a miss.
+        '''
+        png: Optional[bytes] = self._cache.get(key)
+        if png is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return png
+
+        # Wait for the rendering of the same chart in flight
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.joined += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                # The caller rendering the chart has been cancelled rather than this one, so get it again
+                if not pending.cancelled():
+                    raise
+
+                return await self.get(key, render)
+
+        self.misses += 1
+        loop = asyncio.get_running_loop()
+        future: "asyncio.Future[bytes]" = loop.create_future()
+        self._pending[key] = future
+
+        try:
+            png = await loop.run_in_executor(None, self._load, key)
+            if png is None:
+                png = await render()
+
+            spilled: List[Tuple[RenderKey, bytes]] = self._put(key, png)
+            if spilled:
+                await loop.run_in_executor(None, self._spill, spilled)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved in case no one else is waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(png)
+            return png
+        finally:
+            del self._pending[key]
+
+    def _put(self, key: RenderKey, png: bytes) -> List[Tuple[RenderKey, bytes]]:
+        '''
+            Put a chart into memory replacing its older version, return the evicted charts.
+        '''
+        owner: Tuple[str, str] = key[:2]
+        old_version = self._versions.get(owner)
+        if old_version is not None and old_version != key[2]:
+            self._cache.pop((*owner, old_version), None)
+
+        self._versions[owner] = key[2]
+        self._cache[key] = png
+
+        spilled: List[Tuple[RenderKey, bytes]] = []
+        while len(self._cache) > self._maxsize:
+            evicted, evicted_png = self._cache.popitem(last=False)
+            self._versions.pop(evicted[:2], None)
+            spilled.append((evicted, evicted_png))
+
+        return spilled
+
+    def _path(self, key: RenderKey) -> Path:
+        digest: str = hashlib.sha1(repr(key[2]).encode()).hexdigest()[:16]
+        return self._spill_dir / f"{key[0]}_{key[1] or 'group'}_{digest}.png"
+
+    def _load(self, key: RenderKey) -> Optional[bytes]:
+        with self._disk_lock:
+            self._index()
+            path: Optional[Path] = self._spilled.get(key[:2])
+            if path is None:
+                return None
+
+            # The data of the chart has changed since it was spilled
+            if path != self._path(key):
+                del self._spilled[key[:2]]
+                path.unlink(missing_ok=True)
+                return None
+
+            try:
+                return path.read_bytes()
+            except OSError:
+                del self._spilled[key[:2]]
+                return None
+
+    def _spill(self, spilled: List[Tuple[RenderKey, bytes]]) -> None:
+        with self._disk_lock:
+            self._index()
+            self._spill_dir.mkdir(parents=True, exist_ok=True)
+
+            for key, png in spilled:
+                path: Path = self._path(key)
+                # Drop the spilled older version of the chart
+                stale: Optional[Path] = self._spilled.pop(key[:2], None)
+                if stale is not None and stale != path:
+                    stale.unlink(missing_ok=True)
+
+                path.write_bytes(png)
+                self._spilled[key[:2]] = path
+
+            while len(self._spilled) > self._spill_size:
+                _, oldest = self._spilled.popitem(last=False)
+                oldest.unlink(missing_ok=True)
+
+    def _index(self) -> None:
+        '''
+            Index the charts spilled by the last run, oldest first, keeping only the latest one of each chart.
+        '''
+        if self._indexed:
+            return
+
+        self._indexed = True
+        if not self._spill_dir.exists():
+            return
+
+        for path in sorted(self._spill_dir.glob("*.png"), key=lambda p: p.stat().st_mtime):
+            fields: List[str] = path.stem.split("_")
+            if len(fields) != 3:
+                continue
+
+            owner: Tuple[str, str] = (fields[0], "" if fields[1] == "group" else fields[1])
+            stale: Optional[Path] = self._spilled.pop(owner, None)
+            if stale is not None:
+                stale.unlink(missing_ok=True)
+            self._spilled[owner] = path
+
+
+render_cache = RenderCache(morning_config.morning_render_cache_size, morning_config.morning_path / "cache",
+                           morning_config.morning_render_spill_size)
@@ -0,0 +1,564 @@
+import json
+import os
+import sqlite3
+import threading
+from nonebot.log import logger
+from pathlib import Path
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional, Set, TextIO, Tuple
+from .model import DATA_VERSION
+from .utils import DateTimeEncoder, morning_json_update
+
+GroupData = Dict[str, Dict[str, Dict[str, Any]]]
+# Accepted event: kind, gid, uid, time
+Event = Tuple[str, str, str, datetime]
+
+
+def read_legacy_data(morning_path: Path) -> Tuple[int, Dict[str, GroupData]]:
+    '''
+        Read morning.json, or data.json of v0.2.x, for importing into another backend.
+        Return the data format version along with the data.
+    '''
+    morning_json: Path = morning_path / "morning.json"
+    data_json: Path = morning_path / "data.json"
+
+    if morning_json.exists():
+        with open(morning_json, "r", encoding="utf-8") as f:
+            data: Dict[str, Any] = json.load(f)
+
+        return data.pop("version", 1), data
+
+    if data_json.exists():
+        with open(data_json, "r", encoding="utf-8") as f:
+            return 1, morning_json_update(json.load(f))
+
+    return DATA_VERSION, dict()
+
+
+def encode_group(group: GroupData) -> str:
+    '''
+        Compact JSON of a group. Backends rewriting all groups at once keep the groups encoded in memory,
+        in less than a third of the memory of the decoded ones, so that unmodified groups are neither copied nor encoded again.
+    '''
+    return json.dumps(group, ensure_ascii=False, separators=(",", ":"), cls=DateTimeEncoder)
+
+
+def write_groups(f: TextIO, head: str, groups: Dict[str, str]) -> None:
+    '''
+        Write a JSON object of the leading members in head followed by the encoded groups, one group per line.
+    '''
+    f.write("{" + head)
+    separator: str = ",\n" if head else "\n"
+    for gid, group in groups.items():
+        f.write(f"{separator}{json.dumps(gid, ensure_ascii=False)}: {group}")
+        separator = ",\n"
+
+    f.write("\n}")
+
+
+class MorningStorage:
+    '''
+        Base class of the persistence backends of morning data.
+        Data is exchanged in the layout of morning.json: gid -> uid/"group_count" -> section -> key -> value.
+        All methods are called from the writer thread of MorningManager, one at a time.
+    '''
+    # Whether groups are loaded on demand by load_group() instead of all at once by load()
+    lazy: bool = False
+    # Format version of the persisted data, read by load(). Data handed over to save() is always of DATA_VERSION,
+    # so the backend persists DATA_VERSION once all groups have been rewritten
+    version: int = DATA_VERSION
+    # Bytes written by save() so far, of the encoded values for SQLite whose pages are written by itself
+    bytes_written: int = 0
+    # Whether save() only reads the modified items of the groups, so that only those are copied on the event loop
+    partial: bool = False
+
+    def load(self) -> Dict[str, GroupData]:
+        '''
+            Load all groups.
+        '''
+        raise NotImplementedError
+
+    def save(self, groups: Dict[str, GroupData], dirty: Dict[str, Set[str]], events: List[Event]) -> None:
+        '''
+            Write back the modified data.
+            - groups: copies of the modified groups, owned by the storage from now on. Only of their items in dirty if partial
+            - dirty: gid -> keys of users (or "group_count") modified since the last save
+            - events: events accepted since the last save, whose effects are in groups. Backends persisting snapshots only ignore them
+        '''
+        raise NotImplementedError
+
+    def load_group(self, gid: str) -> Optional[GroupData]:
+        '''
+            Load a group on demand. Only backends loading groups lazily return it, others have loaded all groups in load().
+        '''
+        return None
+
+    def group_ids(self) -> List[str]:
+        '''
+            All persisted groups, which may not be loaded yet. Only for backends loading groups lazily.
+        '''
+        return []
+
+    def pending_events(self) -> Iterator[Event]:
+        '''
+            Events recorded after the loaded data, to be replayed on top of it.
+        '''
+        return iter(())
+
+    def close(self) -> None:
+        pass
+
+
+class JsonStorage(MorningStorage):
+    '''
+        Monolithic morning.json, rewritten as a whole on every save.
+        All groups are kept encoded since only the modified groups are handed over.
+    '''
+
+    def __init__(self, path: Path):
+        self._path: Path = path
+        self._encoded: Dict[str, str] = dict()
+
+    def load(self) -> Dict[str, GroupData]:
+        with open(self._path, "r", encoding="utf-8") as f:
+            data: Dict[str, Any] = json.load(f)
+
+        self.version = data.pop("version", 1)
+        self._encoded = {gid: encode_group(group) for gid, group in data.items()}
+
+        return data
+
+    def save(self, groups: Dict[str, GroupData], dirty: Dict[str, Set[str]], events: List[Event]) -> None:
+        for gid, group in groups.items():
+            self._encoded[gid] = encode_group(group)
+        self.version = DATA_VERSION
+
+        # Written aside and swapped in, so that a crash while writing leaves the last morning.json intact
+        tmp_path: Path = self._path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            write_groups(f, f'"version": {DATA_VERSION}', self._encoded)
+            self.bytes_written += f.tell()
+
+        os.replace(tmp_path, self._path)
+
+
+class SqliteStorage(MorningStorage):
+    '''
+        SQLite database in WAL mode, one row per counter so that a good-morning/night only updates the rows of its user.
+    '''
+    partial: bool = True
+    _schema: str = '''
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS groups (
+            gid TEXT PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS users (
+            gid TEXT NOT NULL REFERENCES groups(gid),
+            uid TEXT NOT NULL,
+            PRIMARY KEY (gid, uid)
+        );
+        CREATE TABLE IF NOT EXISTS group_counters (
+            gid TEXT NOT NULL REFERENCES groups(gid),
+            section TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (gid, section, key)
+        );
+        CREATE TABLE IF NOT EXISTS user_counters (
+            gid TEXT NOT NULL,
+            uid TEXT NOT NULL,
+            section TEXT NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT NOT NULL,
+            PRIMARY KEY (gid, uid, section, key),
+            FOREIGN KEY (gid, uid) REFERENCES users(gid, uid)
+        );
+    '''
+
+    def __init__(self, path: Path, legacy_dir: Path):
+        self._path: Path = path
+        self._legacy_dir: Path = legacy_dir
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self._path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(self._schema)
+
+        return self._conn
+
+    def load(self) -> Dict[str, GroupData]:
+        conn = self._connect()
+
+        if conn.execute("SELECT value FROM meta WHERE key = 'imported'").fetchone() is None:
+            self._import_legacy()
+
+        row: Optional[Tuple[str]] = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        self.version = int(row[0]) if row is not None else 1
+
+        data: Dict[str, GroupData] = dict()
+        for (gid,) in conn.execute("SELECT gid FROM groups"):
+            data[gid] = {"group_count": {"daily": dict(), "weekly": dict()}}
+
+        for gid, uid in conn.execute("SELECT gid, uid FROM users"):
+            data[gid][uid] = {"daily": dict(), "weekly": dict(), "total": dict()}
+
+        for gid, section, key, value in conn.execute("SELECT gid, section, key, value FROM group_counters"):
+            data[gid]["group_count"].setdefault(section, dict())[key] = json.loads(value)
+
+        for gid, uid, section, key, value in conn.execute("SELECT gid, uid, section, key, value FROM user_counters"):
+            data[gid][uid].setdefault(section, dict())[key] = json.loads(value)
+
+        return data
+
+    def save(self, groups: Dict[str, GroupData], dirty: Dict[str, Set[str]], events: List[Event]) -> None:
+        conn = self._connect()
+
+        with conn:
+            for gid, keys in dirty.items():
+                self._write_rows(conn, gid, groups[gid], keys)
+
+            if self.version != DATA_VERSION:
+                self._write_version(conn, DATA_VERSION)
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def _write_rows(self, conn: sqlite3.Connection, gid: str, group: GroupData, keys: Set[str]) -> None:
+        conn.execute("INSERT OR IGNORE INTO groups (gid) VALUES (?)", (gid,))
+
+        for uid in keys:
+            rows: List[Tuple[str, str, str]] = list(self._flatten(group[uid]))
+            self.bytes_written += sum(len(value) for _, _, value in rows)
+
+            if uid == "group_count":
+                conn.executemany(
+                    "INSERT OR REPLACE INTO group_counters (gid, section, key, value) VALUES (?, ?, ?, ?)",
+                    [(gid, section, key, value) for section, key, value in rows]
+                )
+            else:
+                conn.execute("INSERT OR IGNORE INTO users (gid, uid) VALUES (?, ?)", (gid, uid))
+                conn.executemany(
+                    "INSERT OR REPLACE INTO user_counters (gid, uid, section, key, value) VALUES (?, ?, ?, ?, ?)",
+                    [(gid, uid, section, key, value) for section, key, value in rows]
+                )
+
+    def _write_version(self, conn: sqlite3.Connection, version: int) -> None:
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('version', ?)", (str(version),))
+        self.version = version
+
+    @staticmethod
+    def _flatten(items: Dict[str, Dict[str, Any]]) -> Iterator[Tuple[str, str, str]]:
+        for section, counters in items.items():
+            for key, value in counters.items():
+                yield section, key, json.dumps(value, cls=DateTimeEncoder)
+
+    def _import_legacy(self) -> None:
+        '''
+            One-shot import from morning.json, or data.json of v0.2.x.
+        '''
+        version, data = read_legacy_data(self._legacy_dir)
+
+        conn = self._connect()
+        with conn:
+            for gid, group in data.items():
+                self._write_rows(conn, gid, group, set(group))
+
+            self._write_version(conn, version)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('imported', '1')")
+
+        if data:
+            logger.info(f"已将{len(data)}个群的早晚安数据导入至SQLite数据库！")
+
+
+class EventLogStorage(MorningStorage):
+    '''
+        Append-only log of accepted events on top of the last snapshot.
+        The log is compacted into a fresh snapshot in the background once it grows past a threshold,
+        the compacted log is kept as an archive of the raw history.
+        Only the modified items are handed over, they are merged into the encoded groups in the writer thread.
+    '''
+    partial: bool = True
+
+    def __init__(self, events_dir: Path, legacy_dir: Path, compact_size: int):
+        self._dir: Path = events_dir
+        self._legacy_dir: Path = legacy_dir
+        self._compact_size: int = compact_size
+
+        self._snapshot_path: Path = events_dir / "snapshot.json"
+        self._log_path: Path = events_dir / "current.log"
+        self._log: Optional[TextIO] = None
+
+        # Sequence number of the next event, and of the first event in current.log
+        self._seq: int = 1
+        self._log_first_seq: int = 1
+        self._snapshot_seq: int = 0
+        # All groups encoded, written into the snapshot on compaction
+        self._encoded: Dict[str, str] = dict()
+        self._compacting: Optional[threading.Thread] = None
+        # Sequence number covered by the snapshot and bytes written by the last compaction, applied by _reap()
+        self._compacted: Optional[Tuple[int, int]] = None
+
+    def load(self) -> Dict[str, GroupData]:
+        self._dir.mkdir(parents=True, exist_ok=True)
+
+        if self._snapshot_path.exists():
+            with open(self._snapshot_path, "r", encoding="utf-8") as f:
+                snapshot: Dict[str, Any] = json.load(f)
+
+            self._snapshot_seq = snapshot["seq"]
+            self.version = snapshot.get("version", 1)
+            data: Dict[str, GroupData] = snapshot["data"]
+        else:
+            self._snapshot_seq = 0
+            self.version, data = read_legacy_data(self._legacy_dir)
+
+        self._seq = self._snapshot_seq + 1
+        self._log_first_seq = self._seq
+        self._encoded = {gid: encode_group(group) for gid, group in data.items()}
+
+        return data
+
+    def pending_events(self) -> Iterator[Event]:
+        current_first_seq: Optional[int] = None
+
+        for log_path in self._log_files():
+            with open(log_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    fields: List[str] = line.rstrip("\n").split("\t")
+                    # Skip the line torn by a crash
+                    if len(fields) != 5:
+                        continue
+
+                    # Skip the events covered by the snapshot, and those written twice by a save retried after failing
+                    seq: int = int(fields[0])
+                    if seq < self._seq:
+                        continue
+
+                    if log_path == self._log_path and current_first_seq is None:
+                        current_first_seq = seq
+
+                    self._seq = seq + 1
+                    yield fields[1], fields[2], fields[3], datetime.fromtimestamp(int(fields[4]))
+
+        self._log_first_seq = current_first_seq if current_first_seq is not None else self._seq
+
+    def save(self, groups: Dict[str, GroupData], dirty: Dict[str, Set[str]], events: List[Event]) -> None:
+        self._reap()
+
+        for gid, items in groups.items():
+            group: GroupData = json.loads(self._encoded[gid]) if gid in self._encoded else dict()
+            group.update(items)
+            self._encoded[gid] = encode_group(group)
+
+        if events:
+            if self._log is None:
+                self._log = open(self._log_path, "a", encoding="utf-8")
+                # Terminate the line torn by a crash before appending
+                if self._log.tell() > 0:
+                    with open(self._log_path, "rb") as f:
+                        f.seek(-1, os.SEEK_END)
+                        if f.read(1) != b"\n":
+                            self._log.write("\n")
+
+            seq: int = self._seq
+            lines: List[str] = []
+            for kind, gid, uid, now_time in events:
+                lines.append(f"{seq}\t{kind}\t{gid}\t{uid}\t{int(now_time.timestamp())}\n")
+                seq += 1
+
+            start: int = self._log.tell()
+            try:
+                self._log.write("".join(lines))
+                self._log.flush()
+            except OSError:
+                # The events are handed over again on the next save, with the same sequence numbers.
+                # The log is reopened then, terminating the line torn by this failure
+                try:
+                    self._log.close()
+                except OSError:
+                    pass
+                self._log = None
+                raise
+
+            self._seq = seq
+            self.bytes_written += self._log.tell() - start
+
+        # A snapshot in an older format is replaced as soon as all groups are of the current one
+        if self.version != DATA_VERSION or self._log is not None and self._log.tell() > self._compact_size:
+            self._compact()
+
+    def close(self) -> None:
+        self._reap(wait=True)
+
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+    def _reap(self, wait: bool = False) -> None:
+        '''
+            Apply the result of the finished compaction in the writer thread, the compacting thread only returns it.
+        '''
+        if self._compacting is None or not wait and self._compacting.is_alive():
+            return
+
+        self._compacting.join()
+        self._compacting = None
+
+        if self._compacted is not None:
+            self._snapshot_seq, size = self._compacted
+            self.bytes_written += size
+            self._compacted = None
+
+    def _log_files(self) -> List[Path]:
+        '''
+            Archived logs not covered by the snapshot yet, in order, followed by current.log.
+        '''
+        archives: List[Path] = sorted(
+            p for p in self._dir.glob("*-*.log") if int(p.stem.split("-")[1]) > self._snapshot_seq
+        )
+
+        return archives + [self._log_path] if self._log_path.exists() else archives
+
+    def _compact(self) -> None:
+        '''
+            Archive current.log and write the snapshot covering it in the background.
+        '''
+        self._reap()
+        if self._compacting is not None:
+            return
+
+        last_seq: int = self._seq - 1
+
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
+        if self._log_path.exists():
+            self._log_path.rename(self._dir / f"{self._log_first_seq:012d}-{last_seq:012d}.log")
+            self._log_first_seq = last_seq + 1
+
+        self.version = DATA_VERSION
+        # Encoded groups are immutable, a shallow copy is the data as of last_seq
+        groups: Dict[str, str] = dict(self._encoded)
+        self._compacting = threading.Thread(target=self._write_snapshot, args=(groups, last_seq), daemon=True)
+        self._compacting.start()
+
+    def _write_snapshot(self, groups: Dict[str, str], seq: int) -> None:
+        '''
+            Run in the compacting thread, which touches no state of the storage shared with the writer thread but _compacted.
+        '''
+        tmp_path: Path = self._snapshot_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(f'{{"version": {DATA_VERSION}, "seq": {seq}, "data": ')
+            write_groups(f, "", groups)
+            f.write("}")
+            size: int = f.tell()
+
+        os.replace(tmp_path, self._snapshot_path)
+        self._compacted = (seq, size)
+        logger.info(f"早晚安事件日志已压缩至快照，序号{seq}")
+
+
+class ShardedJsonStorage(MorningStorage):
+    '''
+        One JSON file per group under groups/ with a manifest of all groups.
+        Groups are loaded on demand and only the modified ones are rewritten.
+    '''
+    lazy: bool = True
+
+    def __init__(self, groups_dir: Path, legacy_dir: Path):
+        self._dir: Path = groups_dir
+        self._legacy_dir: Path = legacy_dir
+        self._manifest_path: Path = groups_dir / "manifest.json"
+        self._gids: Set[str] = set()
+
+    def load(self) -> Dict[str, GroupData]:
+        if self._manifest_path.exists():
+            with open(self._manifest_path, "r", encoding="utf-8") as f:
+                manifest: Dict[str, Any] = json.load(f)
+
+            self.version = manifest.get("version", 1)
+            self._gids = set(manifest["groups"])
+        else:
+            self._migrate()
+
+        return dict()
+
+    def load_group(self, gid: str) -> Optional[GroupData]:
+        if gid not in self._gids:
+            return None
+
+        with open(self._dir / f"{gid}.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def group_ids(self) -> List[str]:
+        return sorted(self._gids)
+
+    def save(self, groups: Dict[str, GroupData], dirty: Dict[str, Set[str]], events: List[Event]) -> None:
+        new_group: bool = False
+
+        for gid in dirty:
+            self._write_group(gid, groups[gid])
+            if gid not in self._gids:
+                self._gids.add(gid)
+                new_group = True
+
+        if new_group or self.version != DATA_VERSION:
+            self.version = DATA_VERSION
+            self._write_manifest()
+
+    def _write_group(self, gid: str, group: GroupData) -> None:
+        tmp_path: Path = self._dir / f"{gid}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(group, f, ensure_ascii=False, indent=4, cls=DateTimeEncoder)
+            self.bytes_written += f.tell()
+
+        os.replace(tmp_path, self._dir / f"{gid}.json")
+
+    def _write_manifest(self) -> None:
+        tmp_path: Path = self._manifest_path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": self.version, "groups": sorted(self._gids)}, f, ensure_ascii=False, indent=4)
+            self.bytes_written += f.tell()
+
+        os.replace(tmp_path, self._manifest_path)
+
+    def _migrate(self) -> None:
+        '''
+            Split the monolithic morning.json, or data.json of v0.2.x, into group files.
+        '''
+        self._dir.mkdir(parents=True, exist_ok=True)
+        self.version, data = read_legacy_data(self._legacy_dir)
+
+        for gid, group in data.items():
+            self._write_group(gid, group)
+
+        self._gids = set(data)
+        self._write_manifest()
+
+        if data:
+            logger.info(f"已将{len(data)}个群的早晚安数据拆分为分群数据文件！")
+
+
+def create_storage(morning_path: Path, backend: str, compact_size: int = 4 << 20) -> MorningStorage:
+    '''
+        Create the storage backend given its name.
+    '''
+    if backend == "sqlite":
+        return SqliteStorage(morning_path / "morning.db", morning_path)
+
+    if backend == "sharded":
+        return ShardedJsonStorage(morning_path / "groups", morning_path)
+
+    if backend == "eventlog":
+        return EventLogStorage(morning_path / "events", morning_path, compact_size)
+
+    return JsonStorage(morning_path / "morning.json")
@@ -0,0 +1,124 @@
+import hashlib
+import secrets
+from pathlib import Path
+from typing import Any, Dict, List, Optional, TextIO
+try:
+    import ujson as json
+except ModuleNotFoundError:
+    import json
+from .storage import GroupData
+
+
+class TraceRecorder:
+    '''
+        Opt-in recorder of the handled commands, one line per command with anonymized group and user ids:
+        time in milliseconds, command, group, user, outcome and arguments, tab separated.
+        Every command reading or modifying the data or the config is recorded, so that replaying them reproduces the state.
+
+        The trace is split into sessions under trace_dir. Session N is <N>.json, an anonymized snapshot of the data
+        and config when it began, and <N>.log, the commands handled since then. The snapshot of session N + 1 is the
+        state after the commands of session N, so a session can be replayed and checked against the next snapshot.
+        Sessions begin at startup and whenever the log exceeds max_bytes, only the latest ones are kept.
+    '''
+
+    def __init__(self, trace_dir: Path, max_bytes: int, sessions: int):
+        self._dir: Path = trace_dir
+        self._max_bytes: int = max_bytes
+        self._sessions: int = sessions
+        self._file: Optional[TextIO] = None
+        self._size: int = 0
+
+        self._dir.mkdir(parents=True, exist_ok=True)
+        # Ids are hashed with a salt of this deployment, so that they can't be brute-forced from the trace
+        salt_path: Path = self._dir / "salt"
+        if not salt_path.exists():
+            salt_path.write_text(secrets.token_hex(16), encoding="utf-8")
+        self._salt: bytes = salt_path.read_bytes()
+
+    @property
+    def full(self) -> bool:
+        return self._size >= self._max_bytes
+
+    def anonymize(self, _id: str) -> str:
+        return hashlib.blake2b(_id.encode(), digest_size=8, key=self._salt).hexdigest()
+
+    def record(self, command: str, gid: str, uid: str, now_ms: int, outcome: str, args: str = "") -> None:
+        '''
+            Record a command, with its arguments other than the ids joined by "#", e.g. the new setting of a config command.
+        '''
+        line: str = f"{now_ms}\t{command}\t{self.anonymize(gid)}\t{self.anonymize(uid) if uid else ''}\t{outcome}\t{args}\n"
+        self._file.write(line)
+        self._size += len(line)
+
+    def flush(self) -> None:
+        if self._file is not None:
+            self._file.flush()
+
+    def begin(self, now_ms: int, new_log: bool = True) -> str:
+        '''
+            End the current session and begin a new one, return its name. Its snapshot is written by write_snapshot().
+            Without a new log, the snapshot only ends the last session.
+        '''
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        session: str = str(now_ms)
+        if new_log:
+            self._file = open(self._dir / f"{session}.log", "a", encoding="utf-8")
+            self._size = 0
+
+        return session
+
+    def write_snapshot(self, session: str, version: int, config: Dict[str, Any], groups: Dict[str, GroupData]) -> None:
+        '''
+            Write the anonymized snapshot of a session and drop the sessions out of the retention.
+        '''
+        snapshot: Dict[str, Any] = {
+            "version": version,
+            "config": {**config, "groups": {self.anonymize(gid): item for gid, item in config.get("groups", {}).items()}},
+            "data": {self.anonymize(gid): self._anonymize_group(group) for gid, group in groups.items()}
+        }
+
+        path: Path = self._dir / f"{session}.json"
+        with open(path.with_suffix(".tmp"), "w", encoding="utf-8") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        path.with_suffix(".tmp").replace(path)
+
+        logs: List[Path] = sorted(self._dir.glob("*.log"), key=lambda p: int(p.stem))
+        for log in logs[:-self._sessions]:
+            log.unlink(missing_ok=True)
+
+        # Snapshots before the oldest session kept, including the ones ending a session at shutdown
+        oldest: int = int(logs[-self._sessions:][0].stem) if logs else int(session)
+        for snapshot_path in self._dir.glob("*.json"):
+            if int(snapshot_path.stem) < oldest:
+                snapshot_path.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _anonymize_group(self, group: GroupData) -> GroupData:
+        items: GroupData = dict()
+        for key, value in group.items():
+            if key != "group_count":
+                items[self.anonymize(key)] = value
+                continue
+
+            daily: Dict[str, Any] = value["daily"]
+            weekly: Dict[str, Any] = value["weekly"]
+            items[key] = {
+                "daily": {
+                    **daily,
+                    "early_risers": [[self.anonymize(uid), t] for uid, t in daily.get("early_risers", [])],
+                    "late_sleepers": [[self.anonymize(uid), t] for uid, t in daily.get("late_sleepers", [])]
+                },
+                "weekly": {
+                    **weekly,
+                    "sleeping_king": self.anonymize(weekly["sleeping_king"]) if weekly["sleeping_king"] else ""
+                }
+            }
+
+        return items
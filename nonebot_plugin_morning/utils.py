@@ -1,6 +1,13 @@
-from datetime import datetime, timedelta, date
-from typing import Union, Tuple, List, Dict
+from datetime import datetime, timedelta, date, tzinfo
+from typing import Optional, Union, Tuple, List, Dict
 import json
+try:
+    from zoneinfo import ZoneInfo
+except ModuleNotFoundError:
+    try:
+        from backports.zoneinfo import ZoneInfo
+    except ModuleNotFoundError:
+        ZoneInfo = None
 
 mor_switcher: Dict[str, str] = {
     "时限": "morning_intime",
@@ -44,20 +51,46 @@ class DateTimeEncoder(json.JSONEncoder):
         return json.JSONEncoder.default(self, obj)
 
 
-def is_later(time1: Union[str, datetime], time2: Union[str, datetime]) -> bool:
+def get_timezone(name: Optional[str]) -> Optional[tzinfo]:
     '''
-        Return True if time #1 is later than time #2 of time part.
+        Get a timezone by its IANA name such as "Asia/Shanghai", None for the local time of the bot.
+        Raise ValueError if the name is unknown or zoneinfo is unavailable.
     '''
-    _time1: datetime = datetime.strptime(
-        time1, "%Y-%m-%d %H:%M:%S") if isinstance(time1, str) else time1
-    _time2: datetime = datetime.strptime(
-        time2, "%Y-%m-%d %H:%M:%S") if isinstance(time2, str) else time2
+    if name is None:
+        return None
 
-    return _time1.time() > _time2.time()
+    if ZoneInfo is None:
+        raise ValueError("Python 3.8 需安装 backports.zoneinfo 以设置时区")
+
+    try:
+        return ZoneInfo(name)
+    except (KeyError, ValueError) as e:
+        # ZoneInfoNotFoundError is a KeyError
+        raise ValueError(f"未知的时区：{name}") from e
+
+
+def is_later(time1: int, time2: int, tz: Optional[tzinfo] = None) -> bool:
+    '''
+        Return True if time #1 is later than time #2 of time part, both in epoch seconds, in the timezone.
+    '''
+    return datetime.fromtimestamp(time1, tz).time() > datetime.fromtimestamp(time2, tz).time()
+
+
+def format_time(epoch: Optional[int], tz: Optional[tzinfo] = None) -> str:
+    '''
+        Format a time in epoch seconds for replies, in the timezone.
+    '''
+    if epoch is None:
+        return "无"
+
+    return datetime.fromtimestamp(epoch, tz).strftime("%Y-%m-%d %H:%M:%S")
 
 
 def datetime2timedelta(_datetime: datetime) -> timedelta:
-    return _datetime - datetime(_datetime.year, _datetime.month, _datetime.day, 0, 0, 0)
+    '''
+        Time of the day on the wall clock, the timezone of an aware datetime is kept.
+    '''
+    return _datetime - _datetime.replace(hour=0, minute=0, second=0, microsecond=0)
 
 
 def is_later_oclock(now_time: datetime, oclock: int) -> bool:
@@ -82,6 +115,38 @@ def is_NigTimeinRange(early_time: int, late_time: int, now_time: datetime) -> bo
     return datetime2timedelta(now_time) > timedelta(hours=early_time) or datetime2timedelta(now_time) < timedelta(hours=late_time)
 
 
+def day_index(now_time: datetime, hour: int) -> int:
+    '''
+        Ordinal of the day since 0001-01-01, a day starts at the given hour.
+    '''
+    return (now_time - timedelta(hours=hour)).toordinal()
+
+
+def week_index(now_time: datetime, hour: int) -> int:
+    '''
+        Index of the week since 0001-01-01 which is Monday, a week starts at the given hour on Monday.
+    '''
+    return ((now_time - timedelta(hours=hour)).toordinal() - 1) // 7
+
+
+def next_day_start(now_time: datetime, hour: int) -> datetime:
+    '''
+        Start of the day after the one of now_time, in the same timezone. A day starts at the given hour.
+    '''
+    day: date = date.fromordinal(day_index(now_time, hour) + 1)
+
+    return datetime(day.year, day.month, day.day, tzinfo=now_time.tzinfo) + timedelta(hours=hour)
+
+
+def next_week_start(now_time: datetime, hour: int) -> datetime:
+    '''
+        Start of the week after the one of now_time, in the same timezone. A week starts at the given hour on Monday.
+    '''
+    monday: date = date.fromordinal((week_index(now_time, hour) + 1) * 7 + 1)
+
+    return datetime(monday.year, monday.month, monday.day, tzinfo=now_time.tzinfo) + timedelta(hours=hour)
+
+
 def total_seconds2tuple_time(secs: int) -> Tuple[int, int, int, int]:
     days: int = secs // (3600 * 24)
     hours: int = (secs - days * 3600 * 24) // 3600
@@ -91,19 +156,13 @@ def total_seconds2tuple_time(secs: int) -> Tuple[int, int, int, int]:
     return days, hours, minutes, seconds
 
 
-def sleeptime_update(_lold: List[int], _sleep: timedelta) -> List[int]:
+def format_duration(secs: int) -> str:
     '''
-        Add a timedelta to another one
-        - _lold: days, hrs, mins, secs
+        Format a duration in seconds for replies.
     '''
-    t_old: timedelta = timedelta(
-        days=_lold[0], hours=_lold[1], minutes=_lold[2], seconds=_lold[3])
-    t_new: timedelta = t_old + _sleep
-
-    days, hours, minutes, seconds = total_seconds2tuple_time(
-        int(t_new.total_seconds()))
+    days, hours, minutes, seconds = total_seconds2tuple_time(secs)
 
-    return [days, hours, minutes, seconds]
+    return f"{days}天{hours}时{minutes}分{seconds}秒"
 
 # A compatible transfer from old version format of data.json into new version's(morning.json)
 
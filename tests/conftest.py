@@ -0,0 +1,81 @@
+'''
+    The plugin is loaded once into NoneBot without a driver nor a bot, its startup hooks are never run.
+    Each test opens its own MorningManager on a fresh morning_path under a virtual clock in the timezone of Asia/Shanghai,
+    and closes it, so that reopening one on the same morning_path is a restart.
+'''
+import json
+from datetime import datetime
+from pathlib import Path
+from typing import Awaitable, Callable
+import nonebot
+import pytest
+
+nonebot.init(driver="~none")
+nonebot.load_plugin("nonebot_plugin_morning")
+
+from nonebot_plugin_morning.clock import VirtualClock
+from nonebot_plugin_morning.config import default_config, morning_config
+from nonebot_plugin_morning.data_source import MorningManager
+from nonebot_plugin_morning.model import DATA_VERSION
+from nonebot_plugin_morning.utils import get_timezone
+
+TIMEZONE: str = "Asia/Shanghai"
+BACKENDS = ["json", "sqlite", "eventlog", "sharded"]
+
+
+@pytest.fixture
+def morning_path(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    '''
+        Empty data under the default config in the timezone of Asia/Shanghai, stored in morning.json.
+    '''
+    monkeypatch.setattr(morning_config, "morning_path", tmp_path)
+    monkeypatch.setattr(morning_config, "morning_storage", "json")
+
+    config = default_config.dict()
+    config["timezone"] = TIMEZONE
+    (tmp_path / "config.json").write_text(json.dumps(config), encoding="utf-8")
+    (tmp_path / "morning.json").write_text(json.dumps({"version": DATA_VERSION}), encoding="utf-8")
+
+    return tmp_path
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request: pytest.FixtureRequest, morning_path: Path, monkeypatch: pytest.MonkeyPatch) -> str:
+    monkeypatch.setattr(morning_config, "morning_storage", request.param)
+
+    return request.param
+
+
+@pytest.fixture
+def clock() -> VirtualClock:
+    # Noon of Monday 2026-01-05
+    return VirtualClock(datetime(2026, 1, 5, 12, tzinfo=get_timezone(TIMEZONE)).timestamp())
+
+
+@pytest.fixture
+def travel(clock: VirtualClock) -> Callable[..., int]:
+    '''
+        Move the clock to a local time of Asia/Shanghai given as the arguments of datetime, return its epoch seconds.
+    '''
+    def travel(*args: int) -> int:
+        epoch: float = datetime(*args, tzinfo=get_timezone(TIMEZONE)).timestamp()
+        clock.set(epoch)
+
+        return int(epoch)
+
+    return travel
+
+
+@pytest.fixture
+def open_manager(morning_path: Path, clock: VirtualClock) -> Callable[[], Awaitable[MorningManager]]:
+    '''
+        Open a manager on the data under morning_path, as the plugin does at startup.
+    '''
+    async def open_manager() -> MorningManager:
+        manager = MorningManager()
+        manager.set_clock(clock)
+        await manager.load_data()
+
+        return manager
+
+    return open_manager
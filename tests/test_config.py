@@ -0,0 +1,74 @@
+import json
+import os
+import pytest
+from nonebot_plugin_morning import data_source
+from nonebot_plugin_morning.data_source import CONFIG_CHECK_INTERVAL, MorningManager
+
+
+@pytest.fixture
+def monotonic(monkeypatch):
+    '''
+        Monotonic time seen by the check of config.json, moved by hand.
+    '''
+    now = [1000.0]
+    monkeypatch.setattr(data_source, "monotonic", lambda: now[0])
+
+    return now
+
+
+def edit_config(morning_path, **settings) -> None:
+    '''
+        Edit config.json by hand, with a modified time different from the last one.
+    '''
+    path = morning_path / "config.json"
+    config = json.loads(path.read_text(encoding="utf-8"))
+    config.update(settings)
+    path.write_text(json.dumps(config), encoding="utf-8")
+
+    mtime = path.stat().st_mtime + 10
+    os.utime(path, (mtime, mtime))
+
+
+def test_hand_edit_reloaded_after_interval(morning_path, monotonic):
+    manager = MorningManager()
+    assert manager._group_config("1").timezone == "Asia/Shanghai"
+
+    edit_config(morning_path, timezone="Europe/London")
+    # Within the interval config.json isn't even checked
+    monotonic[0] += CONFIG_CHECK_INTERVAL / 2
+    assert manager._group_config("1").timezone == "Asia/Shanghai"
+
+    monotonic[0] += CONFIG_CHECK_INTERVAL
+    assert manager._group_config("1").timezone == "Europe/London"
+
+
+def test_unmodified_config_not_parsed_again(morning_path, monotonic, monkeypatch):
+    manager = MorningManager()
+    config = manager._group_config("1")
+
+    monkeypatch.setattr(MorningManager, "_apply_config", lambda *args: pytest.fail("config.json parsed again"))
+    monotonic[0] += CONFIG_CHECK_INTERVAL
+    assert manager._group_config("1") is config
+
+
+def test_forced_reload_within_interval(morning_path, monotonic):
+    manager = MorningManager()
+    manager._group_config("1")
+
+    edit_config(morning_path, timezone="Europe/London")
+    # Config commands apply on top of the config.json edited by hand meanwhile
+    msg = manager.morning_switch("1", "多重起床", True)
+
+    assert "配置更新成功" in str(msg)
+    assert manager._group_config("1").timezone == "Europe/London"
+    assert manager._group_config("1").morning.multi_get_up.enable
+
+
+def test_invalid_config_ignored(morning_path, monotonic):
+    manager = MorningManager()
+    manager._group_config("1")
+
+    edit_config(morning_path, timezone="Mars/Olympus_Mons")
+    monotonic[0] += CONFIG_CHECK_INTERVAL
+
+    assert manager._group_config("1").timezone == "Asia/Shanghai"
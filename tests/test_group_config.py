@@ -0,0 +1,126 @@
+'''
+    Overrides of the settings and timezones of single groups, and groups rebased when the boundaries of their days move.
+'''
+import asyncio
+import json
+import os
+import pytest
+from nonebot_plugin_morning.config import morning_config
+
+
+def test_override_only_affects_its_group(open_manager, travel):
+    async def run():
+        manager = await open_manager()
+        msg = manager.night_config("1", "时限", 22, 6)
+        travel(2026, 1, 5, 21, 30)
+        refused = await manager.get_night_msg("1", "10", "群友")
+        accepted = await manager.get_night_msg("2", "20", "群友")
+        config = (str(manager.get_group_config("1")), str(manager.get_group_config("2")))
+        await manager.close()
+
+        assert "配置更新成功" in str(msg)
+        assert "可以晚安的时间为22时到第二天早上6时" in str(refused)
+        assert "晚安成功" in str(accepted)
+        assert config[0].startswith("本群的早安晚安设置如下") and "最早允许睡觉时间：22点" in config[0]
+        assert config[1].startswith("早安晚安设置如下") and "最早允许睡觉时间：21点" in config[1]
+
+    asyncio.run(run())
+
+
+def test_group_in_its_own_timezone(open_manager, travel):
+    async def run():
+        manager = await open_manager()
+        msg = manager.set_timezone("2", "Europe/London")
+        invalid = manager.set_timezone("3", "Mars/Olympus_Mons")
+        # 22:00 in Shanghai is 14:00 in London, out of the time of good-night
+        travel(2026, 1, 5, 22)
+        accepted = await manager.get_night_msg("1", "10", "群友")
+        refused = await manager.get_night_msg("2", "20", "群友")
+        await manager.close()
+
+        assert "Europe/London" in str(msg)
+        assert "配置更新失败" in str(invalid)
+        assert "晚安成功" in str(accepted)
+        assert "晚安成功" not in str(refused)
+
+    asyncio.run(run())
+
+
+def test_group_rebased_when_its_day_starts_later(open_manager, travel):
+    async def run():
+        manager = await open_manager()
+        travel(2026, 1, 5, 22)
+        await manager.get_night_msg("1", "10", "群友")
+
+        # The counting day now starts at 23:00, the good-night at 22:00 is still of the day before it
+        travel(2026, 1, 5, 22, 30)
+        manager.night_config("1", "时限", 23, 6)
+        travel(2026, 1, 5, 22, 45)
+        before = await manager.get_group_routine("1")
+        travel(2026, 1, 5, 23, 30)
+        after = await manager.get_group_routine("1")
+        await manager.close()
+
+        assert before == (0, 1, None)
+        assert after == (0, 0, None)
+
+    asyncio.run(run())
+
+
+def test_group_rebased_when_its_timezone_changes(open_manager, travel):
+    async def run():
+        manager = await open_manager()
+        travel(2026, 1, 5, 22)
+        await manager.get_night_msg("1", "10", "群友")
+
+        # 22:30 in Shanghai is 14:30 in London, where the counting day started at 21:00 of the day before
+        travel(2026, 1, 5, 22, 30)
+        manager.set_timezone("1", "Europe/London")
+        routine = await manager.get_group_routine("1")
+        # 21:00 in London
+        travel(2026, 1, 6, 5)
+        after = await manager.get_group_routine("1")
+        await manager.close()
+
+        assert routine == (0, 1, None)
+        assert after == (0, 0, None)
+
+    asyncio.run(run())
+
+
+@pytest.mark.parametrize("flushed", [True, False])
+def test_unloaded_groups_rebased(morning_path, monkeypatch, open_manager, travel, flushed):
+    monkeypatch.setattr(morning_config, "morning_storage", "sharded")
+
+    async def run():
+        manager = await open_manager()
+        travel(2026, 1, 5, 22)
+        await manager.get_night_msg("1", "10", "群友")
+        await manager.close()
+
+        # Group 1 isn't loaded when config.json is edited by hand, moving the boundaries of all groups
+        manager = await open_manager()
+        travel(2026, 1, 5, 22, 30)
+        manager._load_config(force=True)
+        path = morning_path / "config.json"
+        config = json.loads(path.read_text(encoding="utf-8"))
+        config["night"]["night_intime"]["early_time"] = 23
+        path.write_text(json.dumps(config), encoding="utf-8")
+        os.utime(path, (path.stat().st_mtime + 10,) * 2)
+        manager._load_config(force=True)
+        if flushed:
+            await manager.flush()
+            loaded = "1" in manager._morning
+            await manager.close()
+            manager = await open_manager()
+        else:
+            loaded = False
+
+        travel(2026, 1, 5, 22, 45)
+        routine = await manager.get_group_routine("1")
+        await manager.close()
+
+        assert not loaded
+        assert routine == (0, 1, None)
+
+    asyncio.run(run())
@@ -0,0 +1,65 @@
+from datetime import datetime
+import pytest
+from nonebot_plugin_morning import history
+from nonebot_plugin_morning.history import DAY, SleepHistory, SleepStats, night_of
+from nonebot_plugin_morning.utils import get_timezone
+
+SHANGHAI = get_timezone("Asia/Shanghai")
+UTC_OFFSET: int = 8 * 3600
+HOUR: int = 3600
+
+
+def epoch(*args: int) -> int:
+    return int(datetime(*args, tzinfo=SHANGHAI).timestamp())
+
+
+@pytest.fixture(params=["numpy", "statistics"])
+def implementation(request, monkeypatch):
+    if request.param == "numpy" and history.np is None:
+        pytest.skip("numpy isn't installed")
+    if request.param == "statistics":
+        monkeypatch.setattr(history, "np", None)
+
+    return request.param
+
+
+def test_night_runs_from_noon_to_noon():
+    night: int = night_of(epoch(2026, 1, 5, 23), UTC_OFFSET)
+
+    assert night_of(epoch(2026, 1, 6, 1), UTC_OFFSET) == night
+    assert night_of(epoch(2026, 1, 6, 11, 59), UTC_OFFSET) == night
+    assert night_of(epoch(2026, 1, 6, 12), UTC_OFFSET) == night + 1
+    assert night_of(epoch(2026, 1, 5, 11, 59), UTC_OFFSET) == night - 1
+
+
+def test_sleeps_out_of_retention_dropped():
+    sleeps = SleepHistory()
+    for day in range(1, 11):
+        sleeps.append(epoch(2026, 1, day, 23), 8 * HOUR, 7 * DAY)
+
+    assert len(sleeps) == 8
+    assert sleeps.since(epoch(2026, 1, 9, 12)) == [(epoch(2026, 1, 9, 23), 8 * HOUR), (epoch(2026, 1, 10, 23), 8 * HOUR)]
+    assert SleepHistory.from_dict(sleeps.to_dict()).to_dict() == sleeps.to_dict()
+
+
+def test_stats(implementation):
+    sleeps = SleepHistory()
+    # Nights of 01-01 to 01-03, and 01-06 to 01-08 going to bed after midnight
+    for day, bedtime, hours in [(1, 23, 7), (2, 23, 8), (3, 23, 9), (7, 1, 6), (8, 1, 8), (9, 1, 10)]:
+        sleeps.append(epoch(2026, 1, day, bedtime), hours * HOUR, 90 * DAY)
+
+    stats: SleepStats = sleeps.stats(epoch(2026, 1, 9, 20), 30, UTC_OFFSET)
+
+    # Bedtimes are an hour before or after midnight
+    assert stats == SleepStats(6, 8 * HOUR, 8 * HOUR, HOUR, 3, 3)
+    # Only the last week, and the streak is broken once last night has been missed
+    assert sleeps.stats(epoch(2026, 1, 9, 20), 5, UTC_OFFSET).nights == 3
+    assert sleeps.stats(epoch(2026, 1, 11, 20), 30, UTC_OFFSET).current_streak == 0
+
+
+def test_no_stats_without_recent_sleeps(implementation):
+    sleeps = SleepHistory()
+    assert sleeps.stats(epoch(2026, 1, 9, 20), 7, UTC_OFFSET) is None
+
+    sleeps.append(epoch(2026, 1, 1, 23), 8 * HOUR, 90 * DAY)
+    assert sleeps.stats(epoch(2026, 1, 9, 20), 7, UTC_OFFSET) is None
@@ -0,0 +1,115 @@
+import asyncio
+import sys
+from nonebot_plugin_morning.member_cache import MemberInfoCache
+
+
+class FakeBot:
+    '''
+        Answer get_group_member_info with the current card of the member, once released.
+    '''
+
+    def __init__(self):
+        self.calls: int = 0
+        self.card: str = "群友"
+        self.release: asyncio.Event = asyncio.Event()
+        self.error: Exception = None
+
+    async def call_api(self, api: str, group_id: int, user_id: int) -> dict:
+        self.calls += 1
+        card = self.card
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+
+        return {"group_id": group_id, "user_id": user_id, "card": card}
+
+
+def test_concurrent_lookups_share_one_call():
+    async def run():
+        cache, bot = MemberInfoCache(16, 600), FakeBot()
+        tasks = [asyncio.ensure_future(cache.get(bot, 1, 10)) for _ in range(3)]
+        await asyncio.sleep(0)
+        bot.release.set()
+        infos = await asyncio.gather(*tasks)
+        again = await cache.get(bot, 1, 10)
+
+        assert bot.calls == 1
+        assert infos[0] is infos[1] is infos[2] is again
+        assert (cache.misses, cache.joined, cache.hits) == (1, 2, 1)
+
+    asyncio.run(run())
+
+
+def test_expired_info_looked_up_again(monkeypatch):
+    now = [0.0]
+    # The package exports the cache instance under the name of its module
+    monkeypatch.setattr(sys.modules["nonebot_plugin_morning.member_cache"], "monotonic", lambda: now[0])
+
+    async def run():
+        cache, bot = MemberInfoCache(16, 600), FakeBot()
+        bot.release.set()
+        await cache.get(bot, 1, 10)
+        now[0] += 601
+        await cache.get(bot, 1, 10)
+
+        assert bot.calls == 2
+
+    asyncio.run(run())
+
+
+def test_error_shared_with_waiters():
+    async def run():
+        cache, bot = MemberInfoCache(16, 600), FakeBot()
+        bot.error = RuntimeError("API failed")
+        tasks = [asyncio.ensure_future(cache.get(bot, 1, 10)) for _ in range(2)]
+        await asyncio.sleep(0)
+        bot.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert bot.calls == 1
+
+    asyncio.run(run())
+
+
+def test_cancelled_lookup_retried_by_waiters():
+    async def run():
+        cache, bot = MemberInfoCache(16, 600), FakeBot()
+        owner = asyncio.ensure_future(cache.get(bot, 1, 10))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(cache.get(bot, 1, 10))
+        await asyncio.sleep(0)
+
+        owner.cancel()
+        await asyncio.sleep(0)
+        bot.release.set()
+        info = await waiter
+
+        assert owner.cancelled()
+        assert info["card"] == "群友"
+        # The waiter looked the member up again on its own
+        assert bot.calls == 2
+
+    asyncio.run(run())
+
+
+def test_invalidated_lookup_in_flight_not_cached():
+    async def run():
+        cache, bot = MemberInfoCache(16, 600), FakeBot()
+        stale = asyncio.ensure_future(cache.get(bot, 1, 10))
+        await asyncio.sleep(0)
+
+        # The group card changed while the lookup was in flight
+        bot.card = "新名片"
+        cache.invalidate(1, 10)
+        fresh = asyncio.ensure_future(cache.get(bot, 1, 10))
+        await asyncio.sleep(0)
+        bot.release.set()
+        await asyncio.gather(stale, fresh)
+        cached = await cache.get(bot, 1, 10)
+
+        assert stale.result()["card"] == "群友"
+        assert fresh.result()["card"] == cached["card"] == "新名片"
+        assert bot.calls == 2
+
+    asyncio.run(run())
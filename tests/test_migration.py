@@ -0,0 +1,103 @@
+import asyncio
+import json
+from datetime import datetime
+import pytest
+from nonebot_plugin_morning.model import DATA_VERSION
+
+# morning.json of format version 1: times as local time strings or 0, durations as lists of days/hrs/mins/secs
+V1_DATA = {
+    "1": {
+        "group_count": {"daily": {"good_morning": 2, "good_night": 1}, "weekly": {"sleeping_king": "5"}},
+        "5": {
+            "daily": {"morning_time": "2026-01-05 07:08:09", "night_time": "2026-01-04 23:00:00"},
+            "weekly": {
+                "weekly_morning_count": 1, "weekly_night_count": 1, "weekly_sleep": [0, 8, 8, 9],
+                "lastweek_morning_count": 3, "lastweek_night_count": 4, "lastweek_sleep": [1, 2, 3, 4],
+                "lastweek_earliest_morning_time": 0, "lastweek_latest_night_time": "2026-01-04 23:00:00"
+            },
+            "total": {"morning_count": 10, "night_count": 11, "total_sleep": [3, 0, 0, 1]}
+        }
+    }
+}
+
+# data.json of v0.2.x
+V02_DATA = {
+    "1": {
+        "today_count": {"morning": 2, "night": 1},
+        "5": {"get_up_time": "2026-01-05 07:08:09", "sleep_time": "2026-01-04 23:00:00", "morning_count": 10, "night_count": 11}
+    }
+}
+
+
+def local_epoch(text: str) -> int:
+    return int(datetime.strptime(text, "%Y-%m-%d %H:%M:%S").timestamp())
+
+
+def test_v1_data_migrated(backend, morning_path, open_manager):
+    (morning_path / "morning.json").write_text(json.dumps(V1_DATA), encoding="utf-8")
+
+    async def run():
+        manager = await open_manager()
+        migrated = manager._storage.version
+        now_time = manager._now("1")
+        day, week = manager._day("1", now_time), manager._week("1", now_time)
+        data = await manager.snapshot()
+        await manager.close()
+
+        manager = await open_manager()
+        reloaded = manager._storage.version
+        routine = await manager.get_group_routine("1")
+        again = await manager.snapshot()
+        await manager.close()
+
+        return migrated, reloaded, day, week, data, routine, again
+
+    migrated, reloaded, day, week, data, routine, again = asyncio.run(run())
+
+    assert migrated == reloaded == DATA_VERSION
+    user = data["1"]["5"]
+    assert user["daily"] == {"morning_time": local_epoch("2026-01-05 07:08:09"), "night_time": local_epoch("2026-01-04 23:00:00")}
+    assert user["weekly"] == {
+        "week": week,
+        "weekly_morning_count": 1,
+        "weekly_night_count": 1,
+        "weekly_sleep": (8 * 60 + 8) * 60 + 9,
+        "lastweek_morning_count": 3,
+        "lastweek_night_count": 4,
+        "lastweek_sleep": ((24 + 2) * 60 + 3) * 60 + 4,
+        "lastweek_earliest_morning_time": None,
+        "lastweek_latest_night_time": local_epoch("2026-01-04 23:00:00")
+    }
+    assert user["total"] == {"morning_count": 10, "night_count": 11, "total_sleep": 3 * 24 * 3600 + 1}
+    # Counters kept up to date by the jobs of the old versions belong to today and this week
+    assert data["1"]["group_count"]["daily"]["day"] == day
+    assert data["1"]["group_count"]["weekly"] == {"week": week, "sleeping_king": "5"}
+    assert routine[:2] == (2, 1)
+    assert again == data
+
+
+def test_v02_data_imported(backend, morning_path, open_manager):
+    if backend == "json":
+        pytest.skip("morning.json is converted from data.json by the startup hook of the plugin, before the storage is opened")
+
+    (morning_path / "morning.json").unlink()
+    (morning_path / "data.json").write_text(json.dumps(V02_DATA), encoding="utf-8")
+
+    async def run():
+        manager = await open_manager()
+        data = await manager.snapshot()
+        await manager.close()
+
+        manager = await open_manager()
+        again = await manager.snapshot()
+        await manager.close()
+
+        return data, again
+
+    data, again = asyncio.run(run())
+
+    user = data["1"]["5"]
+    assert user["daily"] == {"morning_time": local_epoch("2026-01-05 07:08:09"), "night_time": local_epoch("2026-01-04 23:00:00")}
+    assert user["total"] == {"morning_count": 10, "night_count": 11, "total_sleep": 0}
+    assert data["1"]["group_count"]["daily"]["good_morning"] == 2
+    assert again == data
@@ -0,0 +1,139 @@
+import asyncio
+import pytest
+from nonebot_plugin_morning.render import RenderCache, bedtime_hour, chart_available, render_routine
+
+
+class Renderer:
+    '''
+        Render a chart of the version it's asked for, once released.
+    '''
+
+    def __init__(self):
+        self.calls: int = 0
+        self.release: asyncio.Event = asyncio.Event()
+        self.release.set()
+        self.error: Exception = None
+
+    def of(self, key):
+        async def render() -> bytes:
+            self.calls += 1
+            await self.release.wait()
+            if self.error is not None:
+                raise self.error
+
+            return repr(key).encode()
+
+        return render
+
+
+def get(cache: RenderCache, renderer: Renderer, key):
+    return cache.get(key, renderer.of(key))
+
+
+def test_concurrent_lookups_share_one_rendering(tmp_path):
+    async def run():
+        cache, renderer = RenderCache(4, tmp_path, 4), Renderer()
+        renderer.release.clear()
+        key = ("1", "10", 1)
+        tasks = [asyncio.ensure_future(get(cache, renderer, key)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        renderer.release.set()
+        charts = await asyncio.gather(*tasks)
+        again = await get(cache, renderer, key)
+
+        assert renderer.calls == 1
+        assert charts[0] is charts[1] is charts[2] is again
+        assert (cache.misses, cache.joined, cache.hits) == (1, 2, 1)
+
+    asyncio.run(run())
+
+
+def test_cancelled_rendering_retried_by_waiters(tmp_path):
+    async def run():
+        cache, renderer = RenderCache(4, tmp_path, 4), Renderer()
+        renderer.release.clear()
+        key = ("1", "10", 1)
+        owner = asyncio.ensure_future(get(cache, renderer, key))
+        await asyncio.sleep(0.01)
+        waiter = asyncio.ensure_future(get(cache, renderer, key))
+        await asyncio.sleep(0)
+
+        owner.cancel()
+        await asyncio.sleep(0.01)
+        renderer.release.set()
+        chart = await waiter
+
+        assert owner.cancelled()
+        assert chart == repr(key).encode()
+        # The waiter rendered the chart again on its own
+        assert renderer.calls == 2
+
+    asyncio.run(run())
+
+
+def test_error_shared_with_waiters(tmp_path):
+    async def run():
+        cache, renderer = RenderCache(4, tmp_path, 4), Renderer()
+        renderer.release.clear()
+        renderer.error = RuntimeError("rendering failed")
+        key = ("1", "10", 1)
+        tasks = [asyncio.ensure_future(get(cache, renderer, key)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        renderer.release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert renderer.calls == 1
+
+    asyncio.run(run())
+
+
+def test_new_version_replaces_old_one(tmp_path):
+    async def run():
+        cache, renderer = RenderCache(4, tmp_path, 4), Renderer()
+        await get(cache, renderer, ("1", "10", 1))
+        await get(cache, renderer, ("1", "10", 2))
+
+        assert list(cache._cache) == [("1", "10", 2)]
+
+    asyncio.run(run())
+
+
+def test_evicted_charts_spilled_and_read_back(tmp_path):
+    async def run():
+        cache, renderer = RenderCache(1, tmp_path, 2), Renderer()
+        for uid in ["10", "11", "12", "13"]:
+            await get(cache, renderer, ("1", uid, 1))
+
+        # At most spill_size charts on disk, the ones spilled earliest are deleted first
+        assert sorted(p.name.split("_")[1] for p in tmp_path.glob("*.png")) == ["11", "12"]
+
+        chart = await get(cache, renderer, ("1", "12", 1))
+        assert chart == repr(("1", "12", 1)).encode()
+        assert renderer.calls == 4
+
+        # The spilled chart of an older version isn't served, and is deleted
+        await get(cache, renderer, ("1", "11", 2))
+        assert renderer.calls == 5
+        assert not cache._path(("1", "11", 1)).exists()
+
+        # Charts spilled by the last run are served by the next one
+        spilled = sorted(p.name for p in tmp_path.glob("*.png"))
+        restarted, renderer = RenderCache(1, tmp_path, 2), Renderer()
+        assert await get(restarted, renderer, ("1", "12", 1)) == repr(("1", "12", 1)).encode()
+        assert renderer.calls == 0
+        assert spilled == sorted(cache._path(("1", uid, 1)).name for uid in ["12", "13"])
+
+    asyncio.run(run())
+
+
+def test_bedtime_after_midnight_counts_as_the_night_before():
+    assert bedtime_hour(23 * 3600) == 23
+    assert bedtime_hour(3600 + 1800) == 25.5
+
+
+@pytest.mark.skipif(not chart_available(), reason="Pillow isn't installed")
+def test_render_routine_png():
+    png: bytes = render_routine("test", ["01-01", "01-02"], [8.0, 7.5], ["01-01", "01-02"], [(0, 23.0), (1, 25.5)])
+
+    assert png.startswith(b"\x89PNG")
@@ -0,0 +1,150 @@
+'''
+    Under the default config a counting day starts at 21:00, the earliest time of good-night,
+    and a week starts at 12:00 on Monday, the latest time of good-morning. 2026-01-05 is a Monday.
+'''
+import asyncio
+from nonebot_plugin_morning.clock import BoundaryDispatcher
+from nonebot_plugin_morning.config import morning_config
+
+
+def test_day_rolls_over_lazily(open_manager, travel):
+    async def run():
+        manager = await open_manager()
+        travel(2026, 1, 5, 22)
+        await manager.get_night_msg("1", "10", "群友")
+        travel(2026, 1, 6, 7)
+        await manager.get_morning_msg("1", "10", "群友")
+
+        travel(2026, 1, 6, 20, 59)
+        before = await manager.get_group_routine("1")
+        boards_before = await manager.get_daily_boards("1")
+        # Nothing has run at the start of the counting day, the counts are reset on the next access
+        travel(2026, 1, 6, 21, 1)
+        after = await manager.get_group_routine("1")
+        boards_after = await manager.get_daily_boards("1")
+        await manager.close()
+
+        assert before == (1, 1, None)
+        assert [uid for uid, _ in boards_before[0]] == ["10"] and [uid for uid, _ in boards_before[1]] == ["10"]
+        assert after == (0, 0, None)
+        assert boards_after == ([], [])
+
+    asyncio.run(run())
+
+
+def test_day_rolled_over_when_persisted(open_manager, travel):
+    async def run():
+        manager = await open_manager()
+        travel(2026, 1, 5, 22)
+        await manager.get_night_msg("1", "10", "群友")
+        await manager.close()
+
+        # Restarted on the next counting day
+        travel(2026, 1, 6, 22)
+        manager = await open_manager()
+        routine = await manager.get_group_routine("1")
+        await manager.close()
+
+        assert routine == (0, 0, None)
+
+    asyncio.run(run())
+
+
+def test_week_rolls_over_lazily(open_manager, travel):
+    async def run():
+        manager = await open_manager()
+        for uid, night, morning in [("10", (2026, 1, 5, 22), (2026, 1, 6, 7)), ("11", (2026, 1, 5, 23), (2026, 1, 6, 6, 30))]:
+            travel(*night)
+            await manager.get_night_msg("1", uid, "群友")
+            travel(*morning)
+            await manager.get_morning_msg("1", uid, "群友")
+
+        # Still the first week before 12:00 of the next Monday
+        travel(2026, 1, 12, 11)
+        ranking = await manager.get_sleep_ranking("1", 10)
+        rank = await manager.get_my_rank("1", "11")
+        king_before = await manager.get_group_routine("1")
+
+        travel(2026, 1, 12, 13)
+        king = await manager.get_group_routine("1")
+        ranking_after = await manager.get_sleep_ranking("1", 10)
+        routine = (await manager.get_my_routine("1", "10")).data["text"]
+        user = manager._morning["1"].users["10"]
+        await manager.close()
+
+        assert ranking == [("10", 9 * 3600), ("11", 7.5 * 3600)]
+        assert rank == (2, 7.5 * 3600, 2)
+        assert king_before == (0, 0, None)
+        assert king == (0, 0, "10")
+        assert ranking_after == []
+        assert (user.weekly_sleep, user.lastweek_sleep) == (0, 9 * 3600)
+        assert (user.weekly_morning_count, user.lastweek_morning_count) == (0, 1)
+        assert "上周早安了1次" in routine and "上周睡眠时间为" in routine
+
+    asyncio.run(run())
+
+
+def test_skipped_week_leaves_last_week_empty(open_manager, travel):
+    async def run():
+        manager = await open_manager()
+        travel(2026, 1, 5, 22)
+        await manager.get_night_msg("1", "10", "群友")
+        travel(2026, 1, 6, 7)
+        await manager.get_morning_msg("1", "10", "群友")
+
+        # Nothing happened during the week from 2026-01-12
+        travel(2026, 1, 19, 13)
+        king = await manager.get_group_routine("1")
+        await manager.get_my_routine("1", "10")
+        user = manager._morning["1"].users["10"]
+        await manager.close()
+
+        assert king == (0, 0, None)
+        assert (user.lastweek_morning_count, user.lastweek_night_count, user.lastweek_sleep) == (0, 0, 0)
+
+    asyncio.run(run())
+
+
+def test_daily_boards(open_manager, travel, monkeypatch):
+    monkeypatch.setattr(morning_config, "morning_board_size", 2)
+
+    async def run():
+        manager = await open_manager()
+        for minute, uid in enumerate(["10", "11", "12"]):
+            travel(2026, 1, 5, 22, minute)
+            await manager.get_night_msg("1", uid, "群友")
+        for minute, uid in enumerate(["12", "10", "11"]):
+            travel(2026, 1, 6, 7, minute)
+            await manager.get_morning_msg("1", uid, "群友")
+
+        risers, sleepers = await manager.get_daily_boards("1")
+        await manager.close()
+
+        # The earliest risers earliest first, the latest sleepers latest first
+        assert [uid for uid, _ in risers] == ["12", "10"]
+        assert [uid for uid, _ in sleepers] == ["12", "11"]
+
+    asyncio.run(run())
+
+
+def test_dispatcher_rolls_groups_at_boundaries(open_manager, travel, clock):
+    async def run():
+        manager = await open_manager()
+        travel(2026, 1, 5, 22)
+        await manager.get_night_msg("1", "10", "群友")
+        travel(2026, 1, 6, 7)
+        await manager.get_morning_msg("1", "10", "群友")
+
+        dispatcher = BoundaryDispatcher(manager, clock)
+        dispatcher.watch("1")
+        await dispatcher.run_until(travel(2026, 1, 12, 12, 1))
+        group = manager._morning["1"]
+        user = group.users["10"]
+        await manager.close()
+
+        # Every day from 2026-01-06 21:00 to 2026-01-11 21:00, and the week at 2026-01-12 12:00
+        assert (dispatcher.day_rollovers, dispatcher.week_rollovers) == (6, 1)
+        assert (group.counters.good_morning, group.counters.sleeping_king) == (0, "10")
+        assert (user.weekly_sleep, user.lastweek_sleep) == (0, 9 * 3600)
+
+    asyncio.run(run())
@@ -0,0 +1,228 @@
+import asyncio
+from datetime import datetime
+import pytest
+from nonebot_plugin_morning.config import morning_config
+from nonebot_plugin_morning.data_source import MorningManager
+from nonebot_plugin_morning.storage import EventLogStorage
+
+
+async def one_night(manager: MorningManager, travel, gid: str, uid: str, night: tuple, morning: tuple) -> None:
+    travel(*night)
+    await manager.get_night_msg(gid, uid, "群友")
+    travel(*morning)
+    await manager.get_morning_msg(gid, uid, "群友")
+
+
+def test_round_trip(backend, open_manager, travel):
+    async def run():
+        manager = await open_manager()
+        await one_night(manager, travel, "1", "10", (2026, 1, 5, 22), (2026, 1, 6, 7))
+        await one_night(manager, travel, "1", "11", (2026, 1, 5, 23), (2026, 1, 6, 7, 30))
+        travel(2026, 1, 6, 22)
+        await manager.get_night_msg("2", "20", "群友")
+        before = await manager.snapshot()
+        await manager.close()
+
+        manager = await open_manager()
+        after = await manager.snapshot()
+        user = after["1"]["10"]
+        ranking = await manager.get_sleep_ranking("1", 10)
+        await manager.close()
+
+        assert after == before
+        assert user["total"] == {"morning_count": 1, "night_count": 1, "total_sleep": 9 * 3600}
+        assert after["2"]["20"]["total"]["night_count"] == 1
+        # The ranking is derived from the users when the group is loaded again
+        assert ranking == [("10", 9 * 3600), ("11", 8.5 * 3600)]
+
+    asyncio.run(run())
+
+
+def test_modified_again_after_restart(backend, open_manager, travel):
+    async def run():
+        manager = await open_manager()
+        await one_night(manager, travel, "1", "10", (2026, 1, 5, 22), (2026, 1, 6, 7))
+        travel(2026, 1, 6, 22)
+        await manager.get_night_msg("2", "20", "群友")
+        await manager.close()
+
+        manager = await open_manager()
+        await one_night(manager, travel, "1", "10", (2026, 1, 6, 23), (2026, 1, 7, 7))
+        before = await manager.snapshot()
+        await manager.close()
+
+        manager = await open_manager()
+        after = await manager.snapshot()
+        await manager.close()
+
+        assert after == before
+        assert after["1"]["10"]["total"] == {"morning_count": 2, "night_count": 2, "total_sleep": 17 * 3600}
+        # Untouched since the restart, e.g. never loaded by the sharded storage
+        assert after["2"]["20"]["total"]["night_count"] == 1
+
+    asyncio.run(run())
+
+
+def test_event_log_replayed_on_top_of_data(morning_path, monkeypatch, open_manager, travel):
+    monkeypatch.setattr(morning_config, "morning_storage", "eventlog")
+
+    async def run():
+        manager = await open_manager()
+        await one_night(manager, travel, "1", "10", (2026, 1, 5, 22), (2026, 1, 6, 7))
+        before = await manager.snapshot()
+        await manager.close()
+
+        manager = await open_manager()
+        after = await manager.snapshot()
+        await manager.close()
+
+        return before, after
+
+    before, after = asyncio.run(run())
+
+    # Far from the size of compaction, the accepted events are only in the log
+    assert not (morning_path / "events" / "snapshot.json").exists()
+    assert (morning_path / "events" / "current.log").read_text(encoding="utf-8").count("\n") == 2
+    assert after == before
+
+
+def test_event_log_lines_written_twice_replayed_once(morning_path):
+    now_time = datetime(2026, 1, 5, 22)
+    storage = EventLogStorage(morning_path / "events", morning_path, 1 << 20)
+    storage.load()
+    storage.save(dict(), dict(), [("night", "1", "10", now_time), ("morning", "1", "10", now_time)])
+    storage.close()
+
+    # An append retried after failing in part, along with a line torn by a crash
+    log = morning_path / "events" / "current.log"
+    lines = log.read_text(encoding="utf-8")
+    log.write_text(lines + lines + lines[:4], encoding="utf-8")
+
+    storage = EventLogStorage(morning_path / "events", morning_path, 1 << 20)
+    storage.load()
+    events = list(storage.pending_events())
+    storage.close()
+
+    assert events == [("night", "1", "10", now_time), ("morning", "1", "10", now_time)]
+
+
+def test_compaction_applied_by_the_writer(morning_path):
+    now_time = datetime(2026, 1, 5, 22)
+    storage = EventLogStorage(morning_path / "events", morning_path, 1)
+    storage.load()
+    storage.save(dict(), dict(), [("night", "1", "10", now_time), ("morning", "1", "10", now_time)])
+    log_size = storage.bytes_written
+    storage.close()
+
+    # The snapshot written in the background is accounted once the writer reaps the compaction
+    snapshot = morning_path / "events" / "snapshot.json"
+    assert storage._snapshot_seq == 2
+    assert storage.bytes_written == log_size + snapshot.stat().st_size
+
+
+def test_event_log_compacted(morning_path, monkeypatch, open_manager, travel):
+    monkeypatch.setattr(morning_config, "morning_storage", "eventlog")
+    monkeypatch.setattr(morning_config, "morning_log_compact_size", 1)
+
+    async def run():
+        manager = await open_manager()
+        for day, uid in enumerate(["10", "11", "12"]):
+            await one_night(manager, travel, "1", uid, (2026, 1, 5 + day, 22), (2026, 1, 6 + day, 7))
+            await manager.flush()
+
+        # Events after the last compaction are replayed on top of its snapshot
+        travel(2026, 1, 8, 22)
+        await manager.get_night_msg("1", "10", "群友")
+        before = await manager.snapshot()
+        await manager.close()
+
+        manager = await open_manager()
+        after = await manager.snapshot()
+        await manager.close()
+
+        return before, after
+
+    before, after = asyncio.run(run())
+
+    events = morning_path / "events"
+    assert (events / "snapshot.json").exists()
+    assert len(list(events.glob("*-*.log"))) >= 2
+    assert after == before
+
+
+def test_failed_save_retried(backend, open_manager, travel):
+    async def run():
+        manager = await open_manager()
+        save = manager._storage.save
+
+        def fail(*args):
+            raise OSError(28, "No space left on device")
+
+        travel(2026, 1, 5, 22)
+        await manager.get_night_msg("1", "10", "群友")
+        manager._storage.save = fail
+        with pytest.raises(OSError):
+            await manager.flush()
+
+        manager._storage.save = save
+        travel(2026, 1, 5, 23)
+        await manager.get_night_msg("1", "11", "群友")
+        before = await manager.snapshot()
+        await manager.close()
+
+        manager = await open_manager()
+        after = await manager.snapshot()
+        await manager.close()
+
+        assert after == before
+        assert set(after["1"]) == {"group_count", "10", "11"}
+
+    asyncio.run(run())
+
+
+def test_close_releases_storage_when_save_fails(backend, open_manager, travel):
+    async def run():
+        manager = await open_manager()
+        closed = []
+        close = manager._storage.close
+
+        def fail(*args):
+            raise OSError(13, "Permission denied")
+
+        travel(2026, 1, 5, 22)
+        await manager.get_night_msg("1", "10", "群友")
+        manager._storage.save = fail
+        manager._storage.close = lambda: closed.append(close())
+        with pytest.raises(OSError):
+            await manager.close()
+
+        assert closed
+
+    asyncio.run(run())
+
+
+def test_only_modified_items_handed_over(backend, open_manager, travel):
+    async def run():
+        manager = await open_manager()
+        await one_night(manager, travel, "1", "10", (2026, 1, 5, 22), (2026, 1, 6, 7))
+        await one_night(manager, travel, "1", "11", (2026, 1, 5, 23), (2026, 1, 6, 7, 30))
+        await manager.flush()
+
+        handed: list = []
+        save = manager._storage.save
+        manager._storage.save = lambda groups, dirty, events: (handed.append(groups), save(groups, dirty, events))
+        travel(2026, 1, 6, 22)
+        await manager.get_night_msg("1", "10", "群友")
+        await manager.flush()
+        before = await manager.snapshot()
+        partial = manager._storage.partial
+        await manager.close()
+
+        manager = await open_manager()
+        after = await manager.snapshot()
+        await manager.close()
+
+        assert set(handed[0]["1"]) == ({"group_count", "10"} if partial else {"group_count", "10", "11"})
+        assert after == before
+
+    asyncio.run(run())
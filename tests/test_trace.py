@@ -0,0 +1,85 @@
+import asyncio
+import json
+from argparse import Namespace
+from benchmarks.replay import find_session, read_trace, run
+from nonebot_plugin_morning.config import morning_config
+
+
+async def record_session(open_manager, travel) -> None:
+    '''
+        A session of every kind of command, with config changes moving the boundaries of days in the middle of it.
+    '''
+    manager = await open_manager()
+    travel(2026, 1, 5, 22)
+    await manager.get_night_msg("1", "10", "群友")
+    travel(2026, 1, 5, 22, 10)
+    await manager.get_night_msg("1", "11", "群友")
+    travel(2026, 1, 5, 22, 30)
+    manager.night_config("1", "时限", 23, 6)
+    manager.night_config("1", "优质睡眠", 25, 0)
+    await manager.get_group_routine("1")
+
+    travel(2026, 1, 6, 7)
+    await manager.get_morning_msg("1", "10", "群友")
+    travel(2026, 1, 6, 7, 30)
+    await manager.get_morning_msg("1", "11", "群友")
+    manager.set_timezone("1", "Asia/Tokyo")
+    manager.set_timezone("1", "Mars/Olympus_Mons")
+    manager.morning_switch("1", "多重起床", True)
+    manager.get_group_config("1")
+
+    # 23:00 in Tokyo, where the next counting day has started
+    travel(2026, 1, 6, 22)
+    await manager.get_daily_boards("1")
+    await manager.get_my_rank("1", "10")
+    await manager.get_my_rank("1", "12")
+    await manager.get_sleep_ranking("1", 5)
+    await manager.get_my_routine("1", "11")
+
+    # A new week
+    travel(2026, 1, 12, 13)
+    await manager.get_group_chart("1")
+    await manager.get_my_chart("1", "10")
+    await manager.get_sleep_ranking("1", 1)
+    travel(2026, 1, 12, 14)
+    await manager.close()
+
+
+def test_every_command_recorded(morning_path, monkeypatch, open_manager, travel):
+    monkeypatch.setattr(morning_config, "morning_trace", True)
+    asyncio.run(record_session(open_manager, travel))
+
+    session, _ = find_session(morning_path / "trace", None)
+    lines = read_trace(morning_path / "trace" / f"{session}.log")
+    commands = [command for _, command, _, _, _, _ in lines]
+
+    assert set(commands) == {
+        "night", "morning", "night_config", "group_routine", "set_timezone", "morning_switch", "group_config",
+        "daily_boards", "my_rank", "sleep_ranking", "my_routine", "group_chart", "my_chart"}
+    assert ("night_config", "ok", "时限#23#6") in [(line[1], line[4], line[5]) for line in lines]
+    assert ("night_config", "failed", "优质睡眠#25#0") in [(line[1], line[4], line[5]) for line in lines]
+    assert ("set_timezone", "invalid", "Mars/Olympus_Mons") in [(line[1], line[4], line[5]) for line in lines]
+    # Ids are anonymized
+    assert all(gid != "1" and uid not in ("10", "11", "12") for _, _, gid, uid, _, _ in lines)
+
+
+def test_session_replayed_exactly(tmp_path_factory, morning_path, monkeypatch, open_manager, travel):
+    monkeypatch.setattr(morning_config, "morning_trace", True)
+    asyncio.run(record_session(open_manager, travel))
+    monkeypatch.setattr(morning_config, "morning_trace", False)
+
+    # The snapshot beginning the session becomes the data and the config, as benchmarks.replay does
+    trace_dir = morning_path / "trace"
+    session, end = find_session(trace_dir, None)
+    snapshot = json.loads((trace_dir / f"{session}.json").read_text(encoding="utf-8"))
+    replay_path = tmp_path_factory.mktemp("replay")
+    (replay_path / "config.json").write_text(json.dumps(snapshot["config"]), encoding="utf-8")
+    (replay_path / "morning.json").write_text(json.dumps({"version": snapshot["version"], **snapshot["data"]}), encoding="utf-8")
+    monkeypatch.setattr(morning_config, "morning_path", replay_path)
+
+    args = Namespace(trace_dir=trace_dir, backend="json", max_diffs=20)
+    result = asyncio.run(run(args, replay_path, session, end))
+
+    assert result["meta"]["commands"] == 19
+    assert result["outcomes"] == {"differed": 0, "missing": 0, "diffs": []}
+    assert result["state"]["differed"] == 0